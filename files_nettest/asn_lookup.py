@@ -6,29 +6,228 @@
 # License: GNU General Public License v3
 # Developed for use by the EU H2020 MONROE project
 
+import os
 import sys
 import re
-from dns.resolver import Resolver
+import json
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from dns.resolver import Resolver, NXDOMAIN, NoAnswer
 from IPy import IP
 
 ASN_REGEX = re.compile(r'^(?P<asn>\d+) |')
 
-def get_asn(ip):
+# Cache defaults (overwritable with configure_asn_cache)
+ASN_CACHE_FILE = os.path.join(tempfile.gettempdir(), 'asn_cache.json')
+ASN_CACHE_TTL = 7 * 24 * 3600           # keep resolved ASNs for a week
+ASN_CACHE_NEGATIVE_TTL = 6 * 3600       # keep unresolvable IPs for 6 hours
+ASN_CACHE_SIZE = 4096                   # max. number of entries
+
+# Resolver defaults (overwritable with configure_asn_resolver)
+ASN_QUERY_TIMEOUT = 2.0                 # seconds per TXT query
+ASN_MAX_PARALLEL = 8                    # concurrent queries in get_asns
+
+class AsnCache(object):
+    """LRU cache mapping IPs to ASNs with per-entry expiry.
+
+       Unresolvable IPs are cached as None with a shorter TTL. If a path is
+       given, the cache is loaded from and saved to a JSON file so repeated
+       traceroutes on the same node do not cost any DNS round trips.
+    """
+
+    def __init__(self, path=None, ttl=ASN_CACHE_TTL, negative_ttl=ASN_CACHE_NEGATIVE_TTL, max_entries=ASN_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # ip -> [asn, expiry], oldest first
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    def get(self, ip):
+        """Return (hit, asn); hit is False if ip is unknown or expired."""
+        with self.lock:
+            entry = self.entries.pop(ip, None)
+            if entry is None:
+                return (False, None)
+            if entry[1] < time.time():
+                self.dirty = True
+                return (False, None)
+            self.entries[ip] = entry
+            return (True, entry[0])
+
+    def put(self, ip, asn):
+        ttl = self.ttl if asn else self.negative_ttl
+        with self.lock:
+            self.entries.pop(ip, None)
+            self.entries[ip] = [asn, time.time() + ttl]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except Exception as e:
+            return {}
+
+    def load(self):
+        now = time.time()
+        entries = sorted(self._read().items(), key=lambda item: item[1][1])
+        with self.lock:
+            for ip, entry in entries[-self.max_entries:]:
+                if entry[1] >= now and ip not in self.entries:
+                    self.entries[ip] = entry
+
+    def save(self):
+        """Write the cache to disk, merging entries saved by other processes."""
+        if not self.path or not self.dirty:
+            return
+        now = time.time()
+        merged = dict((ip, e) for ip, e in self._read().items() if e[1] >= now)
+        with self.lock:
+            merged.update((ip, e) for ip, e in self.entries.items() if e[1] >= now)
+            self.dirty = False
+        entries = sorted(merged.items(), key=lambda item: item[1][1])[-self.max_entries:]
+        try:
+            f = tempfile.NamedTemporaryFile(mode='w', delete=False, dir=os.path.dirname(self.path) or '.')
+            f.write(json.dumps(dict(entries)))
+            f.close()
+            os.rename(f.name, self.path)
+        except Exception as e:
+            #print e
+            pass
+
+_resolver = None
+_cache = None
+_table = None
+
+def configure_asn_backend(backend='dns', table_path=None):
+    """Select the lookup backend: 'dns' (Team Cymru) or 'table'.
+
+       The 'table' backend answers from an offline prefix table built with
+       asn_prefix_table.py and never touches the network.
+    """
+    global _table
+    _table = None
+    if backend == 'table':
+        from asn_prefix_table import PrefixTable
+        _table = PrefixTable(table_path)
+    return _table
+
+def configure_asn_cache(path=ASN_CACHE_FILE, ttl=ASN_CACHE_TTL, negative_ttl=ASN_CACHE_NEGATIVE_TTL, max_entries=ASN_CACHE_SIZE):
+    """Replace the shared ASN cache; path=None keeps it in memory only."""
+    global _cache
+    _cache = AsnCache(path, ttl, negative_ttl, max_entries)
+    return _cache
+
+def get_asn_cache():
+    global _cache
+    if _cache is None:
+        _cache = AsnCache(ASN_CACHE_FILE)
+    return _cache
+
+def save_asn_cache():
+    if _cache is not None:
+        _cache.save()
+
+def configure_asn_resolver(nameservers=None, port=53, timeout=ASN_QUERY_TIMEOUT):
+    """Replace the shared resolver, e.g. to use a local DNS server."""
+    global _resolver
+    resolver = Resolver()
+    if nameservers:
+        resolver.nameservers = list(nameservers)
+    resolver.port = port
+    resolver.timeout = timeout
+    resolver.lifetime = timeout
+    _resolver = resolver
+    return resolver
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        configure_asn_resolver()
+    return _resolver
+
+def query_asn(ip):
+    """Look up the origin ASN of ip via the Team Cymru DNS service.
+
+       Returns the ASN as string or None if there is none. Raises on
+       resolver errors (e.g. timeouts) so these are not cached.
+    """
+    host = IP(ip).reverseName()
+    host = host.replace('.in-addr.arpa.', '.origin.asn.cymru.com.')
+    host = host.replace('.ip6.arpa.', '.origin6.asn.cymru.com.')
+    try:
+        record = get_resolver().query(host, "TXT")
+    except (NXDOMAIN, NoAnswer):
+        return None
+    m = ASN_REGEX.match(record[0].strings[0])
+    return m.group('asn')
+
+def _resolve(ip):
     try:
-        ipy = IP(ip)
-        if ipy.iptype() == 'PRIVATE':
-            return None
-        host = ipy.reverseName()
-        host = host.replace('.in-addr.arpa.', '.origin.asn.cymru.com.')
-        host = host.replace('.ip6.arpa.', '.origin6.asn.cymru.com.')
-        record = Resolver().query(host, "TXT")
-        m = ASN_REGEX.match(record[0].strings[0])
-        return m.group('asn')
+        asn = query_asn(ip)
+        get_asn_cache().put(ip, asn)
+        return asn
     except Exception as e:
         #print e
-        #raise
         return None
 
+def _is_public(ip):
+    try:
+        return IP(ip).iptype() != 'PRIVATE'
+    except Exception as e:
+        return False
+
+def get_asn(ip):
+    if not _is_public(ip):
+        return None
+    if _table is not None:
+        return _table.lookup(ip)
+    hit, asn = get_asn_cache().get(ip)
+    if hit:
+        return asn
+    return _resolve(ip)
+
+def get_asns(ips, max_parallel=ASN_MAX_PARALLEL):
+    """Resolve the ASNs of many IPs concurrently.
+
+       Duplicates and cached IPs cost no query, the remaining ones are
+       resolved with at most max_parallel queries in flight over the shared
+       resolver. Returns a dict mapping every IP to its ASN (or None).
+    """
+    result = {}
+    pending = []
+    cache = get_asn_cache()
+    for ip in set(ips):
+        if not ip or not _is_public(ip):
+            result[ip] = None
+            continue
+        if _table is not None:
+            result[ip] = _table.lookup(ip)
+            continue
+        hit, asn = cache.get(ip)
+        if hit:
+            result[ip] = asn
+        else:
+            pending.append(ip)
+    if pending:
+        pool = ThreadPool(max(1, min(max_parallel, len(pending))))
+        try:
+            for ip, asn in zip(pending, pool.map(_resolve, pending)):
+                result[ip] = asn
+        finally:
+            pool.close()
+            pool.join()
+    return result
 
 if __name__ == '__main__':
     print(get_asn(sys.argv[1]))
+    save_asn_cache()
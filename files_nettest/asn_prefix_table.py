@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Offline longest-prefix-match IP to ASN lookup.
+
+A prefix->ASN dump (e.g. the CAIDA RouteViews pfx2as files, or lines of
+"<prefix>/<len> <asn>") is compiled into a binary table of disjoint address
+intervals, where every address maps to the ASN of its most specific prefix.
+Lookups are a binary search over the memory-mapped table and need no network.
+
+File layout (all integers big-endian):
+    magic 'ASNPFX1\\0', uint32 number of IPv4 records, uint32 number of IPv6 records
+    IPv4 records: 4 byte first address, 4 byte last address, uint32 asn
+    IPv6 records: 16 byte first address, 16 byte last address, uint32 asn
+Records are sorted, so comparing the raw address bytes orders them numerically.
+
+Usage:
+    asn_prefix_table.py build <dump> <table>
+    asn_prefix_table.py lookup <table> <ip> [<ip> ...]
+    asn_prefix_table.py bench <table> [num_lookups] [num_dns_lookups]
+"""
+
+import sys
+import mmap
+import time
+import socket
+import struct
+import random
+from binascii import hexlify, unhexlify
+
+MAGIC = b'ASNPFX1\0'
+HEADER = struct.Struct('>8sII')
+ASN = struct.Struct('>I')
+WIDTH = {4: 4, 6: 16}
+FAMILY = {4: socket.AF_INET, 6: socket.AF_INET6}
+
+def _to_int(packed):
+    return int(hexlify(packed), 16)
+
+def _to_bytes(value, width):
+    return unhexlify('%0*x' % (width * 2, value))
+
+def _parse_line(line):
+    """Return (version, first, last, asn) for a dump line or None."""
+    fields = line.replace('/', ' ').split()
+    if len(fields) < 3 or line.startswith('#'):
+        return None
+    try:
+        version = 6 if ':' in fields[0] else 4
+        width = WIDTH[version]
+        length = int(fields[1])
+        # multi-origin ("1_2") and AS set ("1,2") entries: use the first ASN
+        asn = int(fields[2].replace('_', ',').split(',')[0])
+        first = _to_int(socket.inet_pton(FAMILY[version], fields[0]))
+        host_bits = width * 8 - length
+        first = first >> host_bits << host_bits
+        return (version, first, first + (1 << host_bits) - 1, asn)
+    except Exception as e:
+        return None
+
+def flatten(prefixes):
+    """Turn nested (first, last, asn) prefixes into disjoint intervals.
+
+       Prefixes are either nested or disjoint, so a stack of enclosing
+       prefixes is enough to let the most specific one win.
+    """
+    out = []
+    def emit(first, last, asn):
+        if first > last:
+            return
+        if out and out[-1][1] + 1 == first and out[-1][2] == asn:
+            out[-1] = (out[-1][0], last, asn)
+        else:
+            out.append((first, last, asn))
+    stack = []
+    pos = 0
+    for first, last, asn in sorted(prefixes, key=lambda p: (p[0], -p[1])):
+        while stack and stack[-1][1] < first:
+            outer = stack.pop()
+            emit(pos, outer[1], outer[2])
+            pos = outer[1] + 1
+        if stack:
+            emit(pos, first - 1, stack[-1][2])
+        pos = first
+        stack.append((first, last, asn))
+    while stack:
+        outer = stack.pop()
+        emit(pos, outer[1], outer[2])
+        pos = outer[1] + 1
+    return out
+
+def build(dump_path, table_path):
+    """Compile a prefix dump into a table file; returns the record counts."""
+    prefixes = {4: [], 6: []}
+    with open(dump_path) as f:
+        for line in f:
+            entry = _parse_line(line)
+            if entry:
+                prefixes[entry[0]].append(entry[1:])
+    records = dict((version, flatten(p)) for version, p in prefixes.items())
+    with open(table_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records[4]), len(records[6])))
+        for version in (4, 6):
+            width = WIDTH[version]
+            for first, last, asn in records[version]:
+                f.write(_to_bytes(first, width) + _to_bytes(last, width) + ASN.pack(asn))
+    return len(records[4]), len(records[6])
+
+class PrefixTable(object):
+    """Memory-mapped table built by build()."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count4, count6 = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise Exception('Invalid ASN prefix table: ' + path)
+        self.sections = {4: (HEADER.size, count4), 6: (HEADER.size + count4 * (2 * 4 + 4), count6)}
+
+    def __len__(self):
+        return self.sections[4][1] + self.sections[6][1]
+
+    def lookup(self, ip):
+        """Return the ASN of ip as string or None."""
+        try:
+            version = 6 if ':' in ip else 4
+            key = socket.inet_pton(FAMILY[version], ip)
+        except Exception as e:
+            return None
+        base, count = self.sections[version]
+        width = WIDTH[version]
+        size = 2 * width + 4
+        mm = self.mm
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = base + mid * size
+            if mm[offset:offset + width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        offset = base + (lo - 1) * size
+        if key > mm[offset + width:offset + 2 * width]:
+            return None
+        return str(ASN.unpack_from(mm, offset + 2 * width)[0])
+
+    def sample(self, num):
+        """Return num random addresses covered by the table (for benchmarks)."""
+        ips = []
+        for version in (4, 6):
+            base, count = self.sections[version]
+            width = WIDTH[version]
+            size = 2 * width + 4
+            for i in range(min(num, count)):
+                offset = base + random.randrange(count) * size
+                ips.append(socket.inet_ntop(FAMILY[version], self.mm[offset:offset + width]))
+        random.shuffle(ips)
+        return ips[:num]
+
+def benchmark(table_path, num_lookups, num_dns_lookups):
+    table = PrefixTable(table_path)
+    ips = table.sample(num_lookups)
+    time_start = time.time()
+    for ip in ips:
+        table.lookup(ip)
+    elapsed = time.time() - time_start
+    print("table: {} records, {} lookups, {:.2f} us/lookup".format(len(table), len(ips), elapsed / max(1, len(ips)) * 1e6))
+    if num_dns_lookups:
+        from asn_lookup import configure_asn_cache, get_asn
+        configure_asn_cache(None)
+        ips = ips[:num_dns_lookups]
+        time_start = time.time()
+        agree = sum(1 for ip in ips if get_asn(ip) == table.lookup(ip))
+        elapsed = time.time() - time_start
+        print("dns: {} lookups, {:.2f} us/lookup, {} agree with table".format(len(ips), elapsed / max(1, len(ips)) * 1e6, agree))
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == 'build':
+        print("{} IPv4 and {} IPv6 intervals".format(*build(sys.argv[2], sys.argv[3])))
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'lookup':
+        table = PrefixTable(sys.argv[2])
+        for ip in sys.argv[3:]:
+            print("{} {}".format(ip, table.lookup(ip)))
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'bench':
+        args = sys.argv[3:] + ['100000', '20'][len(sys.argv[3:]):]
+        benchmark(sys.argv[2], int(args[0]), int(args[1]))
+    else:
+        print(__doc__)
+        sys.exit(1)
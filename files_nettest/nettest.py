@@ -25,7 +25,7 @@ import shutil
 import traceback
 import tarfile
 from os import path
-from traceroute_parser import parse_traceroute
+from traceroute_parser import parse_traceroute, parse_traceroute_stream, configure_asn_backend, configure_asn_cache, save_asn_cache
 from subprocess import Popen, PIPE, STDOUT, call
 from multiprocessing import Process, Manager
 from collections import OrderedDict
@@ -61,6 +61,13 @@ EXPCONFIG = {
         "save_metadata_resultdir": None,                # set to a dir to enable saving of metadata
         "add_modem_metadata_to_result": False,          # set to True to add one captured modem metadata to nettest result
         "traceroute_resultdir": "",# "/monroe/results/",     # set to a dir to enable traceroute before nettest
+        "asn_cache_file": "/tmp/asn_cache.json",        # on-disk ASN cache shared by all traceroutes, "" = memory only
+        "asn_cache_ttl_s": 604800,                      # lifetime of resolved ASNs in the cache
+        "asn_cache_negative_ttl_s": 21600,              # lifetime of unresolvable IPs in the cache
+        "asn_backend": "dns",                           # "dns" (Team Cymru) or "table" (offline prefix table, no network)
+        "asn_table_file": "/opt/monroe/asn_prefix_table.bin",  # built with asn_prefix_table.py
+        "traceroute_streaming": True,                   # parse hops and look up ASNs while traceroute is running
+        "traceroute_max_star_hops": 5,                  # stop after this many hops without reply (0 = never)
         "disabled_interfaces": ["lo",
                                 "metadata"
                                 ],                      # Interfaces to NOT run the experiment on
@@ -305,16 +312,33 @@ def traceroute(target, interface):
         print("doing traceroute...")
     time_start = time.time()
     p = Popen(cmd, stdout=PIPE)
-    data = p.communicate()[0]
+    if EXPCONFIG['traceroute_streaming']:
+        lines = []
+        def read_lines():
+            for line in iter(p.stdout.readline, b''):
+                lines.append(line)
+                yield line
+        try:
+            traceroute = parse_traceroute_stream(read_lines(), max_star_hops=EXPCONFIG['traceroute_max_star_hops'])
+        except Exception as e:
+            traceroute = {'error': 'could not parse traceroute'}
+        if p.poll() is None:
+            p.terminate()
+        p.wait()
+        data = b''.join(lines)
+    else:
+        data = p.communicate()[0]
     time_end = time.time()
     if EXPCONFIG['verbosity'] > 1:
         print("traceroute finished.")
     if EXPCONFIG['verbosity'] > 2:
         print("traceroute: {}".format(data))
-    try:
-        traceroute = parse_traceroute(data)
-    except Exception as e:
-        traceroute = {'error': 'could not parse traceroute'}
+    if not EXPCONFIG['traceroute_streaming']:
+        try:
+            traceroute = parse_traceroute(data)
+        except Exception as e:
+            traceroute = {'error': 'could not parse traceroute'}
+    save_asn_cache()
     if not traceroute:
         traceroute = {'error': 'no traceroute output'}
     traceroute['time_start'] = time_start
@@ -361,6 +385,14 @@ if __name__ == '__main__':
         print("Missing expconfig variable {}".format(e))
         raise e
 
+    configure_asn_cache(EXPCONFIG['asn_cache_file'] or None,
+                        EXPCONFIG['asn_cache_ttl_s'],
+                        EXPCONFIG['asn_cache_negative_ttl_s'])
+    try:
+        configure_asn_backend(EXPCONFIG['asn_backend'], EXPCONFIG['asn_table_file'])
+    except Exception as e:
+        print("Cannot load ASN prefix table, using DNS lookups {}".format(e))
+
     sequence_number = 0
     tot_start_time = time.time()
     for ifname in netifaces.interfaces():
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Benchmark of the ping/traceroute parsers on synthetic outputs.
+
+Reports records per second of the per-record parsers (pingparser.parse,
+parse_traceroute) and of the batch parsers in this process and on a
+process pool.
+
+Usage:
+    parse_bench.py [num_records] [processes]
+"""
+
+import sys
+import time
+import random
+
+import pingparser
+from traceroute_parser import parse_traceroute, parse_traceroute_batch
+
+def synthetic_ping(count=11):
+    lines = ['PING r4---sn-4g5e6nsz.googlevideo.com (173.194.182.74) 56(84) bytes of data.']
+    rtts = []
+    for seq in range(1, count + 1):
+        if random.random() < 0.05:
+            continue
+        rtt = random.uniform(20, 80)
+        rtts.append(rtt)
+        lines.append('64 bytes from 173.194.182.74: icmp_seq={} ttl=57 time={:.1f} ms'.format(seq, rtt))
+    lines.append('')
+    lines.append('--- r4---sn-4g5e6nsz.googlevideo.com ping statistics ---')
+    lines.append('{} packets transmitted, {} received, {:.0f}% packet loss, time 10012ms'.format(count, len(rtts), 100.0 * (count - len(rtts)) / count))
+    if rtts:
+        lines.append('rtt min/avg/max/mdev = {:.3f}/{:.3f}/{:.3f}/{:.3f} ms'.format(min(rtts), sum(rtts) / len(rtts), max(rtts), 1.0))
+    return '\n'.join(lines) + '\n'
+
+def synthetic_traceroute(hops=15):
+    lines = ['traceroute to r4---sn-4g5e6nsz.googlevideo.com (173.194.182.74), 30 hops max, 60 byte packets']
+    for hop in range(1, hops + 1):
+        if random.random() < 0.1:
+            lines.append('{:2d}  * * *'.format(hop))
+            continue
+        ip = '{}.{}.{}.{}'.format(random.randint(1, 223), random.randint(0, 255), random.randint(0, 255), random.randint(1, 254))
+        lines.append('{:2d}  {} ({}) [AS{}]  {:.3f} ms  {:.3f} ms  {:.3f} ms'.format(
+            hop, ip, ip, random.randint(1, 64000), random.uniform(1, 50), random.uniform(1, 50), random.uniform(1, 50)))
+    return '\n'.join(lines) + '\n'
+
+def measure(label, num, function):
+    time_start = time.time()
+    function()
+    elapsed = time.time() - time_start
+    print("{:40s} {:10.0f} records/s".format(label, num / elapsed))
+
+def main(num, processes):
+    pings = [synthetic_ping() for i in range(num)]
+    traceroutes = [synthetic_traceroute() for i in range(num)]
+    measure('pingparser.parse', num, lambda: [pingparser.parse(p) for p in pings])
+    measure('pingparser.parse_batch (1 process)', num, lambda: pingparser.parse_batch(pings, processes=1))
+    measure('pingparser.parse_batch ({} processes)'.format(processes or 'all'), num, lambda: pingparser.parse_batch(pings, processes=processes))
+    measure('parse_traceroute', num, lambda: [parse_traceroute(t, asnlookup=False) for t in traceroutes])
+    measure('parse_traceroute_batch (1 process)', num, lambda: parse_traceroute_batch(traceroutes, processes=1))
+    measure('parse_traceroute_batch ({} processes)'.format(processes or 'all'), num, lambda: parse_traceroute_batch(traceroutes, processes=processes))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else None)
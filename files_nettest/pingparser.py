@@ -9,11 +9,16 @@ Parses the output of the system ping command.
 __version__ = '0.5'
 
 from optparse import OptionGroup, OptionParser
+from multiprocessing import Pool
+from array import array
 
 import re
 import sys
 
 __all__ = ["parse",
+           "parse_batch",
+           "parse_replies",
+           "reply_stats",
            "format_ping_result",
            ]
 
@@ -30,11 +35,30 @@ host_matcher = re.compile(r'PING ([a-zA-Z0-9.\-]+) *\(')
 
 # This one works on OS X output which includes the percentage in 0.0% format
 # https://regex101.com/r/nmjQzI/2
-rslt_matcher = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?received, (\d+\.?\d*)% packet loss')
+# Also skips the "+1 duplicates," / "+2 errors," counters of Linux ping
+rslt_matcher = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?received,(?: \+\d+ \w+,)* (\d+\.?\d*)% packet loss')
 
 # Pull out round-trip min/avg/max/stddev = 49.042/49.042/49.042/0.000 ms
 minmax_matcher = re.compile(r'(\d+.\d+)/(\d+.\d+)/(\d+.\d+)/(\d+.\d+)')
 
+# Pull out the per-reply lines
+# 64 bytes from 8.8.8.8: icmp_seq=1 ttl=57 time=12.3 ms (DUP!)
+reply_matcher = re.compile(r'icmp_seq=(\d+) ttl=(\d+) time[=<]([\d.]+) ms( \(DUP!\))?')
+
+# Columns returned by parse_batch and their array typecodes (None = list)
+batch_columns = [('host', None),
+                 ('sent', 'l'),
+                 ('received', 'l'),
+                 ('packet_loss', 'd'),
+                 ('minping', 'd'),
+                 ('avgping', 'd'),
+                 ('maxping', 'd'),
+                 ('jitter', 'd'),
+                 ('ok', 'B')]
+
+# Percentiles reported by reply_stats
+reply_percentiles = (5, 25, 50, 75, 90, 95, 99)
+
 # Available replacements
 format_replacements = [('%h', 'host'),
                        ('%s', 'sent'),
@@ -59,7 +83,82 @@ def _get_match_groups(ping_output, regex):
     return match.groups()
 
 
-def parse(ping_output):
+def parse_replies(ping_output):
+    """
+    Parse the per-reply lines of `ping_output` into typed arrays
+    `(seq, ttl, rtt, dup)`: icmp sequence number, TTL, round trip time in
+    milliseconds and 1 for duplicate replies, in order of arrival.
+    """
+    seq = array('l')
+    ttl = array('B')
+    rtt = array('d')
+    dup = array('B')
+    for match in reply_matcher.finditer(ping_output):
+        seq.append(int(match.group(1)))
+        ttl.append(min(int(match.group(2)), 255))
+        rtt.append(float(match.group(3)))
+        dup.append(1 if match.group(4) else 0)
+    return seq, ttl, rtt, dup
+
+
+def _percentile(values, p):
+    """Linear interpolation between closest ranks of sorted `values`."""
+    rank = (len(values) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def reply_stats(seq, rtt, dup, sent):
+    """
+    Compute statistics of the replies returned by `parse_replies` for `sent`
+    ping requests (sequence numbers 1..sent):
+
+        `duplicates`: *int*; number of duplicate replies
+        `reordered`: *int*; replies arriving after one with a higher sequence
+        `loss_bursts`: *int*; number of runs of consecutive lost requests
+        `loss_burst_max`: *int*; longest run of consecutive lost requests
+        `loss_burst_mean`: *float*; mean length of the loss runs
+        `rtt_pXX`: *float*; percentiles of the round trip time in milliseconds
+    """
+    received = set()
+    reordered = 0
+    highest = 0
+    rtts = []
+    for s, r, d in zip(seq, rtt, dup):
+        if d:
+            continue
+        if s < highest:
+            reordered += 1
+        highest = max(highest, s)
+        received.add(s)
+        rtts.append(r)
+
+    bursts = []
+    run = 0
+    for s in range(1, sent + 1):
+        if s in received:
+            if run:
+                bursts.append(run)
+            run = 0
+        else:
+            run += 1
+    if run:
+        bursts.append(run)
+
+    stats = {'duplicates'      : sum(dup),
+             'reordered'       : reordered,
+             'loss_bursts'     : len(bursts),
+             'loss_burst_max'  : max(bursts) if bursts else 0,
+             'loss_burst_mean' : float(sum(bursts)) / len(bursts) if bursts else 0.0
+             }
+    rtts.sort()
+    for p in reply_percentiles:
+        stats['rtt_p%d' % p] = _percentile(rtts, p) if rtts else 'NaN'
+    return stats
+
+
+def parse(ping_output, replies=False):
     """
     Parse `ping_output` string into a dictionary containing the following
     fields:
@@ -75,6 +174,13 @@ def parse(ping_output):
                     milliseconds
         `jitter`: *float*; the standard deviation between round trip ping times
                     in milliseconds
+
+    With `replies` set, the per-reply data is added as well:
+
+        `replies`: *dict*; lists `seq`, `ttl` and `rtt` (see `parse_replies`)
+                    of the non-duplicate replies in order of arrival
+        `reply_stats`: *dict*; loss bursts, reordering and RTT percentiles
+                    (see `reply_stats`)
     """
     host = _get_match_groups(ping_output, host_matcher)[0]
     sent, received, packet_loss = _get_match_groups(ping_output, rslt_matcher)
@@ -85,15 +191,94 @@ def parse(ping_output):
     except:
         minping = avgping = maxping = jitter = 'NaN'
 
-    return {'host'        : host,
-            'sent'        : sent,
-            'received'    : received,
-            'packet_loss' : packet_loss,
-            'minping'     : minping,
-            'avgping'     : avgping,
-            'maxping'     : maxping,
-            'jitter'      : jitter
-            }
+    result = {'host'        : host,
+              'sent'        : sent,
+              'received'    : received,
+              'packet_loss' : packet_loss,
+              'minping'     : minping,
+              'avgping'     : avgping,
+              'maxping'     : maxping,
+              'jitter'      : jitter
+              }
+
+    if replies:
+        seq, ttl, rtt, dup = parse_replies(ping_output)
+        keep = [i for i, d in enumerate(dup) if not d]
+        result['replies'] = {'seq' : [seq[i] for i in keep],
+                             'ttl' : [ttl[i] for i in keep],
+                             'rtt' : [rtt[i] for i in keep]
+                             }
+        result['reply_stats'] = reply_stats(seq, rtt, dup, int(sent))
+
+    return result
+
+
+def _new_columns():
+    return dict((field, array(typecode) if typecode else [])
+                for field, typecode in batch_columns)
+
+
+def _parse_chunk(ping_outputs):
+    """
+    Parse a list of ping outputs into columns, see `parse_batch`.
+    """
+    nan = float('nan')
+    columns = _new_columns()
+    for ping_output in ping_outputs:
+        if isinstance(ping_output, bytes) and not isinstance(ping_output, str):
+            ping_output = ping_output.decode('ascii', 'replace')
+        host = host_matcher.search(ping_output)
+        rslt = rslt_matcher.search(ping_output)
+        minmax = minmax_matcher.search(ping_output) if rslt else None
+        columns['host'].append(host.group(1) if host else None)
+        columns['sent'].append(int(rslt.group(1)) if rslt else -1)
+        columns['received'].append(int(rslt.group(2)) if rslt else -1)
+        columns['packet_loss'].append(float(rslt.group(3)) if rslt else nan)
+        for field, value in zip(('minping', 'avgping', 'maxping', 'jitter'),
+                                minmax.groups() if minmax else (nan,) * 4):
+            columns[field].append(float(value))
+        columns['ok'].append(1 if host and rslt else 0)
+    return columns
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_batch(ping_outputs, processes=None, chunksize=1000):
+    """
+    Parse an iterable of ping outputs (`str` or `bytes`) into columns: a
+    dictionary mapping each field of `parse` plus `ok` to an array (`host`
+    is a list) with one entry per output, in input order.
+
+    Outputs are parsed in chunks of `chunksize` on a pool of `processes`
+    worker processes (all CPUs by default, 1 parses in this process).
+    Unparsable outputs do not raise; they get `ok` 0, -1 counts and NaN
+    times.
+    """
+    pool = Pool(processes) if processes != 1 else None
+    try:
+        columns = _new_columns()
+        chunks = _chunks(ping_outputs, chunksize)
+        if pool:
+            parsed = pool.imap(_parse_chunk, chunks)
+        else:
+            parsed = (_parse_chunk(chunk) for chunk in chunks)
+        for chunk in parsed:
+            for field in columns:
+                columns[field].extend(chunk[field])
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return columns
 
 
 def format_ping_result(ping_result, format_string=default_format):
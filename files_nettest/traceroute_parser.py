@@ -7,13 +7,24 @@
 # Developed for use by the EU H2020 MONROE project
 
 import re
+from array import array
 from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 try:
-    from asn_lookup import get_asn
+    from asn_lookup import get_asn, get_asns, configure_asn_backend, configure_asn_cache, save_asn_cache
 except Exception as e:
     def get_asn(ip):
         return None
+    def get_asns(ips, max_parallel=None):
+        return {}
+    def configure_asn_backend(*args, **kwargs):
+        return None
+    def configure_asn_cache(*args, **kwargs):
+        return None
+    def save_asn_cache():
+        pass
 
 HEADER_RE = re.compile(r'^traceroute to (?P<target>\S+?)\s*(?:\((?P<target_ip>\S+)\))?[\s,]+' +
     '(?P<hops_max>\d+)\s+hops max[\s,]+(?P<pkt_size>\d+)\sbyte packets')
@@ -22,54 +33,216 @@ HOP_RE = re.compile(r'^\s*(?P<hop>\d+)\s+(?P<probes>.*)$', re.MULTILINE)
 
 PROBE_RE = re.compile(r'(?:(?P<name>[^\s*]+)?\s+)?(?:\(\s*(?P<ip>[^\s]+)\s*\)\s+)?(?:\[(?P<asn>[^\s]+)\]\s+)?(?:(?P<rtt>[\d.]+?)\s+ms(?:\s+(?P<annotation>![^\s]*))?|\s*(?P<star>\*)\s*)')
 
-def parse_traceroute(data, asnlookup=True):
-    m = HEADER_RE.match(data)
-    if not m:
-        return None
+def fill_asns(traceroutes, max_parallel=8):
+    """Look up missing ASNs of one or many parsed traceroutes in place.
+
+       All unique probe IPs without an ASN are resolved with one batch of
+       concurrent queries (see asn_lookup.get_asns).
+    """
+    if isinstance(traceroutes, dict):
+        traceroutes = [traceroutes]
+    probes = [probe for traceroute in traceroutes if traceroute and 'hops' in traceroute
+                    for hop in traceroute['hops']
+                    for probe in hop['probes']
+                    if probe['ip'] and not probe['asn']]
+    asns = get_asns([probe['ip'] for probe in probes], max_parallel)
+    for probe in probes:
+        asn = asns.get(probe['ip'])
+        if asn:
+            probe['asn'] = "AS" + asn
+    return traceroutes
+
+def _iter_probes(probes):
+    """Yield (name, ip, asn, rtt, annotation) for the probes of one hop line.
+
+       Name, IP and ASN are only printed when they change, so they carry
+       over to the following probes.
+    """
+    name = None
+    ip = None
+    asn = None
+    for p in PROBE_RE.finditer(probes):
+        #print p.group(0)
+        if p.group('name'):
+            name = p.group('name')
+        if p.group('ip'):
+            ip = p.group('ip')
+        if p.group('asn'):
+            asn = p.group('asn')
+            if asn == '*':
+                asn = None
+        rtt = p.group('rtt')
+        try:
+            rtt = float(rtt)
+        except Exception as e:
+            pass
+        yield name, ip, asn, rtt, p.group('annotation')
+
+def _parse_header(m):
     result = OrderedDict()
     result['target'] = m.group('target')
     result['target_ip'] = m.group('target_ip')
     result['hops_max'] = m.group('hops_max')
     result['pkt_size'] = m.group('pkt_size')
     result['hops'] = []
+    return result
+
+def _parse_hop(m):
+    probes = []
+    #print "x"+m.group('probes')+"x"
+    for name, ip, asn, rtt, annotation in _iter_probes(m.group('probes')):
+        probe = OrderedDict()
+        probe['name'] = name
+        probe['ip'] = ip
+        probe['asn'] = asn
+        probe['rtt'] = rtt
+        probe['annotation'] = annotation
+        probes.append(probe)
+    hop = OrderedDict()
+    hop['hop'] = int(m.group('hop'))
+    hop['probes'] = probes
+    return hop
+
+def parse_traceroute(data, asnlookup=True):
+    m = HEADER_RE.match(data)
+    if not m:
+        return None
+    result = _parse_header(m)
     for m in HOP_RE.finditer(data):
-        probes = []
-        #print "x"+m.group('probes')+"x"
-        name = None
-        ip = None
-        asn = None
-        for p in PROBE_RE.finditer(m.group('probes')):
-            #print p.group(0)
-            if p.group('name'):
-                name = p.group('name')
-            if p.group('ip'):
-                ip = p.group('ip')
-            if p.group('asn'):
-                asn = p.group('asn')
-                if asn == '*':
-                    asn = None
-            if asnlookup and ip and not asn:
-                asn = get_asn(ip)
-                if asn:
-                    asn = "AS" + asn
-            rtt = p.group('rtt')
-            try:
-                rtt = float(rtt)
-            except Exception as e:
-                pass
-            probe = OrderedDict()
-            probe['name'] = name
-            probe['ip'] = ip
-            probe['asn'] = asn
-            probe['rtt'] = rtt
-            probe['annotation'] = p.group('annotation')
-            probes.append(probe)
-        hop = OrderedDict()
-        hop['hop'] = int(m.group('hop'))
-        hop['probes'] = probes
-        result['hops'].append(hop)
+        result['hops'].append(_parse_hop(m))
+    if asnlookup:
+        fill_asns(result)
     return result
 
+def parse_traceroute_stream(lines, asnlookup=True, max_star_hops=None):
+    """Parse traceroute output line by line while it is being produced.
+
+       The ASN lookup of each hop starts in the background as soon as the
+       hop is parsed, overlapping with the probing of later hops. Reading
+       stops early once the target answered or after max_star_hops
+       consecutive hops without any reply; the caller should then terminate
+       traceroute. Returns the same result as parse_traceroute.
+    """
+    result = None
+    pool = ThreadPool(4) if asnlookup else None
+    lookups = []
+    stars = 0
+    try:
+        for line in lines:
+            if isinstance(line, bytes) and not isinstance(line, str):
+                line = line.decode('ascii', 'replace')
+            if result is None:
+                m = HEADER_RE.match(line)
+                if m:
+                    result = _parse_header(m)
+                continue
+            m = HOP_RE.match(line)
+            if not m:
+                continue
+            hop = _parse_hop(m)
+            result['hops'].append(hop)
+            if pool:
+                lookups.append(pool.apply_async(fill_asns, ({'hops': [hop]},)))
+            if any(probe['ip'] == result['target_ip'] for probe in hop['probes'] if probe['ip']):
+                break
+            if all(probe['ip'] is None for probe in hop['probes']):
+                stars += 1
+                if max_star_hops and stars >= max_star_hops:
+                    break
+            else:
+                stars = 0
+        for lookup in lookups:
+            lookup.get()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return result
+
+# Columns returned by parse_traceroute_batch and their array typecodes (None = list)
+RECORD_COLUMNS = [('target', None), ('target_ip', None), ('hops_max', 'l'), ('pkt_size', 'l'), ('ok', 'B')]
+PROBE_COLUMNS = [('record', 'l'), ('hop', 'l'), ('name', None), ('ip', None), ('asn', None), ('rtt', 'd'), ('annotation', None)]
+
+def _new_columns(columns):
+    return dict((field, array(typecode) if typecode else []) for field, typecode in columns)
+
+def _parse_chunk(args):
+    """Parse (first record index, list of outputs) into record and probe columns."""
+    first, outputs = args
+    nan = float('nan')
+    records = _new_columns(RECORD_COLUMNS)
+    probes = _new_columns(PROBE_COLUMNS)
+    for index, data in enumerate(outputs, first):
+        if isinstance(data, bytes) and not isinstance(data, str):
+            data = data.decode('ascii', 'replace')
+        m = HEADER_RE.match(data)
+        records['target'].append(m.group('target') if m else None)
+        records['target_ip'].append(m.group('target_ip') if m else None)
+        records['hops_max'].append(int(m.group('hops_max')) if m else -1)
+        records['pkt_size'].append(int(m.group('pkt_size')) if m else -1)
+        records['ok'].append(1 if m else 0)
+        if not m:
+            continue
+        for m in HOP_RE.finditer(data):
+            hop = int(m.group('hop'))
+            for name, ip, asn, rtt, annotation in _iter_probes(m.group('probes')):
+                probes['record'].append(index)
+                probes['hop'].append(hop)
+                probes['name'].append(name)
+                probes['ip'].append(ip)
+                probes['asn'].append(asn)
+                probes['rtt'].append(rtt if isinstance(rtt, float) else nan)
+                probes['annotation'].append(annotation)
+    return records, probes
+
+def _chunks(iterable, size):
+    chunk = []
+    first = 0
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield first, chunk
+            first += size
+            chunk = []
+    if chunk:
+        yield first, chunk
+
+def parse_traceroute_batch(outputs, asnlookup=False, processes=None, chunksize=500):
+    """Parse an iterable of traceroute outputs (str or bytes) into columns.
+
+       Returns (records, probes): dicts mapping field names to arrays (lists
+       for strings). records has one entry per output, unparsable outputs get
+       ok 0. probes has one entry per probe; its 'record' column is the index
+       of the output it belongs to and rtt is NaN for lost probes.
+
+       Chunks of chunksize outputs are parsed on a pool of processes worker
+       processes (all CPUs by default, 1 parses in this process). With
+       asnlookup, missing ASNs are resolved in one batch afterwards.
+    """
+    pool = Pool(processes) if processes != 1 else None
+    try:
+        records = _new_columns(RECORD_COLUMNS)
+        probes = _new_columns(PROBE_COLUMNS)
+        chunks = _chunks(outputs, chunksize)
+        if pool:
+            parsed = pool.imap(_parse_chunk, chunks)
+        else:
+            parsed = (_parse_chunk(chunk) for chunk in chunks)
+        for chunk_records, chunk_probes in parsed:
+            for field in records:
+                records[field].extend(chunk_records[field])
+            for field in probes:
+                probes[field].extend(chunk_probes[field])
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if asnlookup:
+        asns = get_asns([ip for ip, asn in zip(probes['ip'], probes['asn']) if ip and not asn])
+        probes['asn'] = [asn or ("AS" + asns[ip] if asns.get(ip) else None)
+                         for ip, asn in zip(probes['ip'], probes['asn'])]
+    return records, probes
+
 if __name__ == '__main__':
     import sys
     import json
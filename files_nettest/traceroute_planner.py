@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Path-deduplicated traceroutes to clusters of servers.
+
+Servers of one CDN site (e.g. rN---sn-xxxx.googlevideo.com) usually share all
+but the last hop or two. Targets are grouped by the prefix of their resolved
+address; one representative per group is traced in full, the other members
+are only probed from the first TTL after the shared path (traceroute -f).
+Their results are rebuilt by prepending the representative's shared hops,
+which are marked with 'shared_from'. The shared path ends at the last
+responding hop before the tail; if the representative did not reach its
+target (e.g. stopped after too many silent hops), the point where the
+paths split is unknown and the members are traced in full.
+"""
+
+import copy
+import socket
+from binascii import hexlify
+from multiprocessing.pool import ThreadPool
+
+def resolve(target):
+    """Return the first address of target or None."""
+    try:
+        return socket.getaddrinfo(target, None)[0][4][0]
+    except Exception as e:
+        return None
+
+def prefix_key(ip, prefix_v4=24, prefix_v6=48):
+    """Return the network ip/prefix belongs to, as hex string with length."""
+    try:
+        family, bits, length = (socket.AF_INET6, 128, prefix_v6) if ':' in ip else (socket.AF_INET, 32, prefix_v4)
+        network = int(hexlify(socket.inet_pton(family, ip)), 16) >> (bits - length)
+        return '{:x}/{}'.format(network, length)
+    except Exception as e:
+        return None
+
+def plan_traceroutes(targets, prefix_v4=24, prefix_v6=48):
+    """Group targets by address prefix.
+
+       Returns a list of (representative, [other members]); targets that do
+       not resolve form a group of their own.
+    """
+    groups = {}
+    order = []
+    for target in targets:
+        ip = resolve(target)
+        key = prefix_key(ip, prefix_v4, prefix_v6) if ip else None
+        if key is None:
+            key = ('unresolved', target)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(target)
+    return [(groups[key][0], groups[key][1:]) for key in order]
+
+def reached(traceroute):
+    """True if the last hop of traceroute is its target."""
+    hops = traceroute.get('hops') or []
+    target_ip = traceroute.get('target_ip')
+    return bool(hops and target_ip and any(probe['ip'] == target_ip for probe in hops[-1]['probes']))
+
+def shared_path(traceroute, tail_hops):
+    """The hops of traceroute before the last tail_hops, up to the last responding one."""
+    if not reached(traceroute):
+        return []
+    shared = traceroute['hops'][:max(0, len(traceroute['hops']) - tail_hops)]
+    while shared and not any(probe['ip'] for probe in shared[-1]['probes']):
+        shared = shared[:-1]
+    return shared
+
+def rebuild(tail, shared_hops, representative, first_ttl):
+    """Prepend the shared hops of the representative to a tail traceroute."""
+    if 'hops' not in tail:
+        return tail
+    hops = copy.deepcopy(shared_hops)
+    for hop in hops:
+        hop['shared_from'] = representative
+    tail['hops'] = hops + tail['hops']
+    tail['first_ttl'] = first_ttl
+    tail['shared_from'] = representative
+    return tail
+
+def run_planned_traceroutes(targets, trace, tail_hops=2, prefix_v4=24, prefix_v6=48, max_parallel=4):
+    """Trace all targets with path deduplication.
+
+       trace(target, first_ttl) must run one traceroute starting at
+       first_ttl and return the parsed result. Representatives are traced
+       one after another, the tail probes of their members with up to
+       max_parallel traceroutes at a time. Returns a dict target -> result.
+    """
+    results = {}
+    pool = ThreadPool(max(1, max_parallel))
+    try:
+        for representative, members in plan_traceroutes(targets, prefix_v4, prefix_v6):
+            full = trace(representative, 1)
+            results[representative] = full
+            if not members:
+                continue
+            shared = shared_path(full, tail_hops)
+            first_ttl = shared[-1]['hop'] + 1 if shared else 1
+            tails = pool.map(lambda member: trace(member, first_ttl), members)
+            for member, tail in zip(members, tails):
+                results[member] = rebuild(tail, shared, representative, first_ttl) if shared else tail
+    finally:
+        pool.close()
+        pool.join()
+    return results
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Lightweight in-process packet capture with an AF_PACKET TPACKET_V3 ring.
+
+An alternative to the live tshark dissection in run_yomo: a kernel BPF
+filter passes only TCP and UDP (IPv4/IPv6) packets, truncated to the
+headers, into a memory-mapped ring of blocks. Only the IP and transport
+headers are read, and the packets are aggregated into counters instead of
+writing one text line per packet:
+
+- per interval: downlink/uplink bytes and packets
+- per flow (protocol, local address/port, remote address/port): downlink and
+  uplink bytes and packets, first and last packet time
+
+Byte counts are IP packet lengths (tshark's frame.len includes the link
+header). The capture runs in a separate process (run_exp is a daemonic
+process and may not fork multiprocessing children), which writes the
+result as JSON when it is terminated.
+
+Usage:
+    afpacket_capture.py <interface> <outfile> [interval_s] [seconds]
+    afpacket_capture.py --bench [seconds] [packets_per_second]
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import ctypes
+import socket
+import select
+import struct
+import signal
+import resource
+import threading
+from subprocess import Popen, PIPE
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86dd
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+SO_ATTACH_FILTER = 26
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+PACKET_OUTGOING = 4
+
+# struct tpacket_req3
+TPACKET_REQ3 = struct.Struct('IIIIIII')
+# struct tpacket3_hdr up to tp_net; struct sockaddr_ll follows at TPACKET_ALIGN(sizeof(tpacket3_hdr)) = 48
+TPACKET3_HDR = struct.Struct('IIIIIIHH')
+SLL_PKTTYPE = 48 + 10
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1
+BLOCK_STATUS = 8
+BLOCK_NUM_PKTS = 12
+BLOCK_FIRST_PKT = 16
+U32 = struct.Struct('I')
+PORTS = struct.Struct('!HH')
+TPACKET_STATS_V3 = struct.Struct('III')
+
+# classic BPF opcodes
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_JEQ_K = 0x15
+BPF_JA = 0x05
+BPF_RET_K = 0x06
+SKF_AD_PROTOCOL = 0xfffff000
+
+INTERVAL_FIELDS = ['down_bytes', 'up_bytes', 'down_packets', 'up_packets']
+FLOW_FIELDS = ['protocol', 'local_ip', 'local_port', 'remote_ip', 'remote_port',
+               'down_bytes', 'up_bytes', 'down_packets', 'up_packets', 'first', 'last']
+PROTOCOLS = {6: 'tcp', 17: 'udp'}
+
+def bpf_filter(snaplen):
+    """TCP and UDP over IPv4 or IPv6 (without extension headers), cut to snaplen.
+
+       With SOCK_DGRAM the packet starts at the network header, the
+       ethertype is taken from skb->protocol.
+    """
+    program = [(BPF_LD_H_ABS, 0, 0, SKF_AD_PROTOCOL),
+               (BPF_JEQ_K, 0, 2, ETH_P_IP),
+               (BPF_LD_B_ABS, 0, 0, 9),      # IPv4 protocol
+               (BPF_JA, 0, 0, 2),
+               (BPF_JEQ_K, 0, 4, ETH_P_IPV6),
+               (BPF_LD_B_ABS, 0, 0, 6),      # IPv6 next header
+               (BPF_JEQ_K, 1, 0, 6),
+               (BPF_JEQ_K, 0, 1, 17),
+               (BPF_RET_K, 0, 0, snaplen),
+               (BPF_RET_K, 0, 0, 0)]
+    return b''.join(struct.pack('HBBI', *instruction) for instruction in program)
+
+def _attach_filter(sock, program):
+    buf = ctypes.create_string_buffer(program)
+    # struct sock_fprog {unsigned short len; struct sock_filter *filter;}
+    fprog = struct.pack('HL', len(program) // 8, ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    return buf
+
+def capture(interface, stop, interval=1.0, snaplen=128, block_size=1 << 20, block_nr=16, block_timeout_ms=100):
+    """Capture on interface until the threading.Event stop is set; returns the counters."""
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL))
+    # keep the filter program alive until the socket is closed
+    program = _attach_filter(sock, bpf_filter(snaplen))
+    sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+    frame_size = 2048
+    sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ3.pack(
+        block_size, block_nr, frame_size, block_size // frame_size * block_nr, block_timeout_ms, 0, 0))
+    ring = mmap.mmap(sock.fileno(), block_size * block_nr, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+    sock.bind((interface, ETH_P_ALL))
+
+    start = time.time()
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    intervals = {}
+    flows = {}
+    hdr_unpack = TPACKET3_HDR.unpack_from
+    u32_unpack = U32.unpack_from
+    ports_unpack = PORTS.unpack_from
+    block = 0
+    poller = select.poll()
+    poller.register(sock, select.POLLIN | select.POLLERR)
+    try:
+        while not stop.is_set():
+            offset = block * block_size
+            if not u32_unpack(ring, offset + BLOCK_STATUS)[0] & TP_STATUS_USER:
+                try:
+                    poller.poll(block_timeout_ms)
+                except (select.error, IOError, OSError):
+                    # interrupted by the stop signal
+                    pass
+                continue
+            pkt = offset + u32_unpack(ring, offset + BLOCK_FIRST_PKT)[0]
+            for i in range(u32_unpack(ring, offset + BLOCK_NUM_PKTS)[0]):
+                next_offset, sec, nsec, caplen, length, status, mac, net = hdr_unpack(ring, pkt)
+                ts = sec + nsec * 1e-9
+                up = ord(ring[pkt + SLL_PKTTYPE:pkt + SLL_PKTTYPE + 1]) == PACKET_OUTGOING
+                ip = pkt + net
+                version = ord(ring[ip:ip + 1]) >> 4
+                if version == 4:
+                    protocol = ord(ring[ip + 9:ip + 10])
+                    src, dst = ring[ip + 12:ip + 16], ring[ip + 16:ip + 20]
+                    l4 = ip + (ord(ring[ip:ip + 1]) & 0x0f) * 4
+                else:
+                    protocol = ord(ring[ip + 6:ip + 7])
+                    src, dst = ring[ip + 8:ip + 24], ring[ip + 24:ip + 40]
+                    l4 = ip + 40
+                sport, dport = ports_unpack(ring, l4) if l4 + 4 <= pkt + net + caplen else (0, 0)
+                if up:
+                    key = (protocol, src, sport, dst, dport)
+                else:
+                    key = (protocol, dst, dport, src, sport)
+                flow = flows.get(key)
+                if flow is None:
+                    flow = flows[key] = [0, 0, 0, 0, ts, ts]
+                counters = intervals.get(int((ts - start) // interval))
+                if counters is None:
+                    counters = intervals[int((ts - start) // interval)] = [0, 0, 0, 0]
+                if up:
+                    flow[1] += length
+                    flow[3] += 1
+                    counters[1] += length
+                    counters[3] += 1
+                else:
+                    flow[0] += length
+                    flow[2] += 1
+                    counters[0] += length
+                    counters[2] += 1
+                flow[5] = ts
+                pkt += next_offset
+            # hand the block back to the kernel
+            U32.pack_into(ring, offset + BLOCK_STATUS, TP_STATUS_KERNEL)
+            block = (block + 1) % block_nr
+        kernel_packets, kernel_drops, freeze = TPACKET_STATS_V3.unpack(sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS_V3.size))
+    finally:
+        ring.close()
+        sock.close()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    def address(raw):
+        return socket.inet_ntop(socket.AF_INET if len(raw) == 4 else socket.AF_INET6, raw)
+
+    num_intervals = max(intervals) + 1 if intervals else 0
+    return {'interface': interface,
+            'start': start,
+            'interval': interval,
+            'interval_fields': INTERVAL_FIELDS,
+            'intervals': [intervals.get(i, [0, 0, 0, 0]) for i in range(num_intervals)],
+            'flow_fields': FLOW_FIELDS,
+            'flows': [[PROTOCOLS.get(key[0], key[0]), address(key[1]), key[2], address(key[3]), key[4]] + flow
+                      for key, flow in sorted(flows.items(), key=lambda item: -(item[1][0] + item[1][1]))],
+            'kernel_packets': kernel_packets,
+            'kernel_drops': kernel_drops,
+            'cpu_s': (usage.ru_utime - usage_start.ru_utime) + (usage.ru_stime - usage_start.ru_stime)}
+
+def run(interface, outfile, interval=1.0, seconds=None):
+    """Capture until SIGTERM/SIGINT (or for seconds) and write the result to outfile."""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    if seconds:
+        timer = threading.Timer(seconds, stop.set)
+        timer.daemon = True
+        timer.start()
+    try:
+        result = capture(interface, stop, interval)
+    except Exception as e:
+        result = {'interface': interface, 'error': str(e)}
+    with open(outfile, 'w') as f:
+        f.write(json.dumps(result))
+
+class AfPacketCapture(object):
+    """Capture in a child process; the counters are written to outfile on stop()."""
+
+    def __init__(self, interface, outfile, interval=1.0):
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        self.args = [sys.executable, script, interface, outfile, str(interval)]
+        self.process = None
+
+    def start(self):
+        self.process = Popen(self.args)
+
+    def stop(self, timeout=10):
+        if self.process is None:
+            return
+        self.process.terminate()
+        for i in range(timeout * 10):
+            if self.process.poll() is not None:
+                return
+            time.sleep(0.1)
+        self.process.kill()
+        self.process.wait()
+
+def _udp_traffic(seconds, rate, port=45123):
+    """Send 1200 byte UDP datagrams to port on loopback at about rate per second."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = b'\0' * 1200
+    batch = max(1, rate // 100)
+    sent = 0
+    time_start = time.time()
+    while time.time() - time_start < seconds:
+        for i in range(batch):
+            sock.sendto(payload, ('127.0.0.1', port))
+        sent += batch
+        delay = time_start + float(sent) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    sock.close()
+
+def benchmark(seconds, rate):
+    """CPU use of this capture and of tshark (if installed) on loopback traffic."""
+    outfile = '/tmp/afpacket_bench.json'
+    results = []
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 45123))
+    try:
+        afpacket = AfPacketCapture('lo', outfile)
+        afpacket.start()
+        time.sleep(1)
+        _udp_traffic(seconds, rate)
+        afpacket.stop()
+        with open(outfile) as f:
+            result = json.load(f)
+        os.remove(outfile)
+        if 'error' in result:
+            print("afpacket: {}".format(result['error']))
+        else:
+            packets = sum(row[2] + row[3] for row in result['intervals'])
+            results.append(('afpacket', result['cpu_s'], packets))
+
+        try:
+            usage_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+            tshark = Popen(['tshark', '-n', '-i', 'lo', '-E', 'separator=,', '-T', 'fields', '-e', 'frame.time_epoch',
+                            '-e', 'frame.len', '-e', 'ip.src', '-e', 'ip.dst', '-Y', 'tcp or dns or quic or udp'], stdout=PIPE, stderr=PIPE)
+            time.sleep(3)
+            _udp_traffic(seconds, rate)
+            time.sleep(1)
+            tshark.terminate()
+            lines = tshark.communicate()[0].count(b'\n')
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            results.append(('tshark', (usage.ru_utime - usage_start.ru_utime) + (usage.ru_stime - usage_start.ru_stime), lines))
+        except OSError as e:
+            print("tshark: {}".format(e))
+    finally:
+        sink.close()
+    for name, cpu, packets in results:
+        print("{:10s} {:8.2f} s CPU for {} s at {} packets/s ({:.1f}% of one core), {} packets seen".format(
+            name, cpu, seconds, rate, 100.0 * cpu / seconds, packets))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 10, int(sys.argv[3]) if len(sys.argv) > 3 else 20000)
+    elif 3 <= len(sys.argv) <= 5:
+        run(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 1.0, float(sys.argv[4]) if len(sys.argv) > 4 else None)
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Capture-then-dissect mode for run_yomo.
+
+During playback dumpcap only writes raw packets into a ring buffer of
+pcapng files (kernel capture filter, snaplen). No dissection runs during
+the measurement. After playback, tshark reads the files with the same field
+arguments as the live capture (tshark_columnar.tshark_field_arguments), so
+the <prefix>_tshark.txt output has the same format.
+
+The output equals the live dissection as long as no packet is lost before
+tshark sees it:
+- the capture filter is a superset of the display filter 'tcp or dns or
+  quic': all TCP and UDP (DNS and QUIC on any port) and ICMP (errors
+  quoting a TCP packet)
+- packets are captured in full by default; a snaplen cuts e.g. large DNS
+  responses, whose dns.a/dns.aaaa answers are then missing
+- the ring buffer keeps the newest ring_files files; when it wraps, the
+  oldest packets are gone (reported by wrapped())
+
+The ring files are normally concatenated with mergecap and dissected by one
+tshark, which gives the same TCP analysis as a live capture. They can also be
+dissected in parallel, one tshark per file. That is faster on several cores,
+but TCP analysis state (ack_rtt, lost segments, retransmissions) does not
+carry over file boundaries, so the first packets of a connection in each
+file lack it.
+
+Usage:
+    dumpcap_capture.py <output_tshark.txt> <pcapng> [<pcapng> ...]
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import signal
+from subprocess import Popen, call
+from multiprocessing.pool import ThreadPool
+
+from tshark_columnar import tshark_field_arguments, write_log_header
+
+# superset of the packets the display filter 'tcp or dns or quic' can match
+CAPTURE_FILTER = 'tcp or udp or icmp or icmp6'
+
+class DumpcapCapture(object):
+    """dumpcap into <path>_NNNNN_<time>.pcapng ring files."""
+
+    def __init__(self, interface, path, snaplen=0, filesize_kb=20000, ring_files=50, errfile=None):
+        # snaplen 0: full packets; ring_files > 0 keeps only the newest files (older packets are lost), 0: unbounded
+        self.path = path
+        self.args = ['dumpcap', '-q', '-i', interface, '-f', CAPTURE_FILTER,
+                     '-b', 'filesize:' + str(filesize_kb), '-w', path + '.pcapng']
+        if snaplen:
+            self.args.extend(['-s', str(snaplen)])
+        if ring_files:
+            self.args.extend(['-b', 'files:' + str(ring_files)])
+        self.errfile = errfile
+        self.process = None
+
+    def start(self):
+        err = open(self.errfile, 'a') if self.errfile else None
+        try:
+            self.process = Popen(self.args, stderr=err)
+        finally:
+            if err:
+                err.close()
+
+    def stop(self, timeout=10):
+        if self.process is None:
+            return
+        # SIGINT lets dumpcap close the current file properly
+        self.process.send_signal(signal.SIGINT)
+        for i in range(timeout * 10):
+            if self.process.poll() is not None:
+                return
+            time.sleep(0.1)
+        self.process.kill()
+        self.process.wait()
+
+    def files(self):
+        """The ring files in capture order."""
+        return sorted(glob.glob(self.path + '_*.pcapng'))
+
+    def wrapped(self):
+        """True if the ring buffer dropped its oldest files (the first file number is not 1)."""
+        files = self.files()
+        if not files:
+            return False
+        number = os.path.basename(files[0])[len(os.path.basename(self.path)) + 1:].split('_', 1)[0]
+        return number.isdigit() and int(number) > 1
+
+def _tshark(infile, outfile, errfile):
+    with open(outfile, 'ab') as out:
+        with open(errfile, 'ab') as err:
+            return call(['tshark', '-n', '-r', infile] + tshark_field_arguments(), stdout=out, stderr=err)
+
+def dissect(files, outfile, errfile, parallel=1):
+    """Dissect pcapng files into the tshark text format, appending to outfile.
+
+       parallel > 1 runs one tshark per file (see above for the TCP analysis
+       caveat). Returns the number of files dissected.
+    """
+    if not files:
+        return 0
+    write_log_header(outfile)
+    if parallel > 1 and len(files) > 1:
+        parts = [outfile + '.part{}'.format(i) for i in range(len(files))]
+        pool = ThreadPool(parallel)
+        try:
+            pool.map(lambda job: _tshark(job[0], job[1], errfile), zip(files, parts))
+        finally:
+            pool.close()
+            pool.join()
+        with open(outfile, 'ab') as out:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(part)
+    elif len(files) > 1:
+        merged = outfile + '.merged.pcapng'
+        with open(errfile, 'ab') as err:
+            call(['mergecap', '-a', '-w', merged] + files, stderr=err)
+        try:
+            _tshark(merged, outfile, errfile)
+        finally:
+            if os.path.exists(merged):
+                os.remove(merged)
+    else:
+        _tshark(files[0], outfile, errfile)
+    return len(files)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    time_start = time.time()
+    dissect(sys.argv[2:], sys.argv[1], sys.argv[1] + '.err')
+    print("dissected {} files in {:.1f} s".format(len(sys.argv) - 2, time.time() - time_start))
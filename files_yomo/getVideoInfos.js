@@ -1,10 +1,20 @@
+function playerReady(){
+	return document.getElementsByTagName("video")[0]!=null && document.getElementsByClassName("ytp-iv-video-content").length != 0;
+}
+
 var init = function (){
 	
-	if (document.getElementsByTagName("video")[0]!=null && document.getElementsByClassName("ytp-iv-video-content").length != 0){
+	if (playerReady()){
 
+		if (observer) {
+			observer.disconnect();
+			observer = null;
+		}
 		player = document.getElementsByTagName("video")[0];
+		playerAttached = new Date().getTime();
 
 		addOutDivs();
+		window.videomonDrain = drain;
 
 		last_infos = "";
 		last_videoHeight = -1;
@@ -16,8 +26,14 @@ var init = function (){
 		addEventListeners();
 		//setWide();
 		run();
-	} else {
-		setTimeout(init, 100);
+	} else if (!observer) {
+		// wait for the player to be attached instead of polling
+		observer = new MutationObserver(function (){
+			if (playerReady()) {
+				init();
+			}
+		});
+		observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, attributeFilter: ["class"]});
 	};
 };
 
@@ -28,14 +44,65 @@ function showError()
    	return true
 }
 
+// samples and events are kept in preallocated ring buffers (no DOM writes)
+// and streamed to python by videomonDrain()
+function pushSample(time, currentTime, bufferedTime, availablePlaybackTime, quality){
+	var i = (sampleHead % SAMPLE_CAPACITY) * SAMPLE_FIELDS;
+	samples[i] = time;
+	samples[i + 1] = currentTime;
+	samples[i + 2] = bufferedTime;
+	samples[i + 3] = availablePlaybackTime;
+	// frame counters, NaN if the browser doesn't report them
+	samples[i + 4] = quality ? quality.totalVideoFrames : NaN;
+	samples[i + 5] = quality ? quality.droppedVideoFrames : NaN;
+	samples[i + 6] = quality ? quality.corruptedVideoFrames : NaN;
+	sampleHead++;
+}
+
+function pushEvent(time, infos){
+	// event texts are interned, the ring only holds their codes
+	var code = eventIds[infos];
+	if (code === undefined) {
+		code = eventNames.length;
+		eventIds[infos] = code;
+		eventNames.push(infos);
+	}
+	var i = eventHead % EVENT_CAPACITY;
+	eventTimes[i] = time;
+	eventCodes[i] = code;
+	eventHead++;
+}
+
+function drain(){
+	// entries overwritten before they were drained are counted as dropped
+	if (sampleHead - sampleTail > SAMPLE_CAPACITY) {
+		dropped += sampleHead - sampleTail - SAMPLE_CAPACITY;
+		sampleTail = sampleHead - SAMPLE_CAPACITY;
+	}
+	if (eventHead - eventTail > EVENT_CAPACITY) {
+		dropped += eventHead - eventTail - EVENT_CAPACITY;
+		eventTail = eventHead - EVENT_CAPACITY;
+	}
+	var outSamples = [];
+	for (; sampleTail < sampleHead; sampleTail++) {
+		var i = (sampleTail % SAMPLE_CAPACITY) * SAMPLE_FIELDS;
+		for (var k = 0; k < SAMPLE_FIELDS; k++) {
+			outSamples.push(samples[i + k]);
+		}
+	}
+	var outEvents = [];
+	for (; eventTail < eventHead; eventTail++) {
+		var j = eventTail % EVENT_CAPACITY;
+		outEvents.push([eventTimes[j], eventNames[eventCodes[j]]]);
+	}
+	// the debug log only grows, hand out what was added since the last drain
+	var log = document.getElementById("divLog").innerHTML;
+	var debug = log.substring(debugTail);
+	debugTail = log.length;
+	return {samples: outSamples, events: outEvents, dropped: dropped, debug: debug};
+}
+
 function addOutDivs(){
-	var divOutC = document.createElement("div");
-	divOutC.id = "outC";
-	body = document.getElementsByTagName("body")[0];
-	body.appendChild(divOutC);
-	var divOutE = document.createElement("div");
-	divOutE.id = "outE";
-	body.appendChild(divOutE);
 	var divLog = document.createElement("div");
 	divLog.id = "divLog";
 	document.getElementsByTagName("body")[0].appendChild(divLog);
@@ -52,7 +119,23 @@ var setWide = function (){
 };
 
 
-var run = function (){
+// playback state for the supervisor in run_yomo: ended/error and the last
+// time the playback position advanced (no-progress watchdog)
+function checkProgress(){
+	if (player.currentTime != lastCurrentTime) {
+		lastCurrentTime = player.currentTime;
+		lastProgress = new Date().getTime();
+	}
+}
+
+function state(){
+	return {attached: playerAttached, ended: playbackEnded, error: playbackError, lastProgress: lastProgress, now: new Date().getTime(),
+		currentTime: player ? player.currentTime : null, duration: player ? player.duration : null};
+}
+
+function sample(){
+	lastSample = new Date().getTime();
+	checkProgress();
 	try {
 		//divLog.innerHTML += new Date().getTime() + " " + window.getComputedStyle(document.getElementsByClassName("ytp-iv-video-content")[0]).getPropertyValue('width') + " \n";
 		getInfos();
@@ -60,17 +143,54 @@ var run = function (){
 		var i = player.buffered.length;
 		var availablePlaybackTime = player.buffered.end(i-1);
 		var bufferedTime = availablePlaybackTime - currentTime;
-		outC = outC + new Date().getTime() + "#" +  currentTime + "#" + bufferedTime + "#" + availablePlaybackTime +"\n";
-		//outE = outE + "here \n";
-		document.getElementById("outC").innerHTML = outC;
-		document.getElementById("outE").innerHTML = outE;
+		var quality = player.getVideoPlaybackQuality ? player.getVideoPlaybackQuality() : null;
+		pushSample(lastSample, currentTime, bufferedTime, availablePlaybackTime, quality);
 	}
 	catch(err) {
 		document.getElementById("divLog").innerHTML += err.message;
 	}	
-	setTimeout(run, 1000);
+}
+
+// samples every SAMPLE_INTERVAL ms, every FAST_SAMPLE_INTERVAL ms for
+// FAST_SAMPLE_WINDOW ms after waiting, stalled, playing and quality changes
+var run = function (){
+	sample();
+	clearTimeout(runTimer);
+	runTimer = setTimeout(run, new Date().getTime() < fastUntil ? FAST_SAMPLE_INTERVAL : SAMPLE_INTERVAL);
 };
 
+function boost(){
+	var now = new Date().getTime();
+	var boosted = now < fastUntil;
+	fastUntil = now + FAST_SAMPLE_WINDOW;
+	if (!boosted) {
+		clearTimeout(runTimer);
+		runTimer = setTimeout(run, FAST_SAMPLE_INTERVAL);
+	}
+	if (player.requestVideoFrameCallback && !framePending) {
+		framePending = true;
+		player.requestVideoFrameCallback(onFrame);
+	}
+}
+
+// while boosted, played frames and timeupdate also take samples (at most
+// one per FAST_SAMPLE_INTERVAL), the timer keeps sampling during stalls
+function sampleFast(){
+	var now = new Date().getTime();
+	if (now < fastUntil && now - lastSample >= FAST_SAMPLE_INTERVAL) {
+		sample();
+	}
+}
+
+function onFrame(){
+	framePending = false;
+	sampleFast();
+	if (new Date().getTime() < fastUntil) {
+		framePending = true;
+		player.requestVideoFrameCallback(onFrame);
+	}
+}
+
 function getInfos(){
 	var currentTime = new Date().getTime();
     
@@ -79,35 +199,36 @@ function getInfos(){
 		last_videoHeight = videoHeight;
 		var videoWidth = player.videoWidth;
 		var infos = "quality:"+ videoHeight + "p" + " (" + videoWidth + "x" + videoHeight + ")";
-		outE = outE + currentTime + "#" + infos + "\n";
+		pushEvent(currentTime, infos);
+		boost();
 	}
 
 	var volume = player.volume;
 	if(last_volume != volume){
 		last_volume = volume;
 		var infos = "volume:"+ volume + "";
-		outE = outE + currentTime + "#" + infos + "\n";
+		pushEvent(currentTime, infos);
 	}
 
 	var duration = player.duration;
 	if(last_duration != duration){
 		last_duration = duration;
 		var infos = "duration:"+ duration + "";
-		outE = outE + currentTime + "#" + infos + "\n";
+		pushEvent(currentTime, infos);
 	}
 
 	var ytid = getYouTubeID();
 	if(last_ytid != ytid){
 		last_ytid = ytid;
 		var infos = "ytid:"+ ytid + "";
-		outE = outE + currentTime + "#" + infos + "\n";
+		pushEvent(currentTime, infos);
 	}
 
 	var title = getTitle();
 	if(last_title != title){
 		last_title = title;
 		var infos = "title:"+ title + "";
-		outE = outE + currentTime + "#" + infos + "\n";
+		pushEvent(currentTime, infos);
 	}        
 };
 
@@ -139,7 +260,7 @@ function addEventListeners(){
 	  var event = "loadstart";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
 	});
 
 	player.addEventListener("canplay", function() 
@@ -147,7 +268,7 @@ function addEventListeners(){
 	  var event = "canplay";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
 	});
 
 	player.addEventListener("playing", function() 
@@ -155,7 +276,8 @@ function addEventListeners(){
 	  var event = "playing";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
+	  boost();
 	});
 
 	player.addEventListener("play", function() 
@@ -163,7 +285,7 @@ function addEventListeners(){
 	  var event = "play";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
 	});
 
 	player.addEventListener("pause", function() 
@@ -171,7 +293,7 @@ function addEventListeners(){
 	  var event = "pause";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos +  "\n";
+	  pushEvent(currentTime, infos);
 	});
 
 	player.addEventListener("ended", function()
@@ -179,7 +301,8 @@ function addEventListeners(){
 	  var event = "ended";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
+	  playbackEnded = true;
 	});
 
 	player.addEventListener("stalled", function() 
@@ -187,7 +310,8 @@ function addEventListeners(){
 	  var event = "stalled";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
+	  boost();
 	});
 
 	player.addEventListener("waiting", function() 
@@ -195,7 +319,8 @@ function addEventListeners(){
 	  var event = "waiting";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
+	  boost();
 	});
 
 	player.addEventListener("abort", function() 
@@ -203,7 +328,7 @@ function addEventListeners(){
 	  var event = "abort";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
 	});
 
 	player.addEventListener("emptied", function() 
@@ -211,7 +336,7 @@ function addEventListeners(){
 	  var event = "emptied";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
 	});
 
 	player.addEventListener("error", function() 
@@ -219,7 +344,8 @@ function addEventListeners(){
 	  var event = "error";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos + "\n";
+	  pushEvent(currentTime, infos);
+	  playbackError = player.error ? player.error.code : -1;
 	});
 
 	player.addEventListener("suspend", function() 
@@ -227,15 +353,49 @@ function addEventListeners(){
 	  var event = "suspend";
 	  var infos = event;
 	  var currentTime = new Date().getTime();
-	  outE = outE + currentTime + "#" + infos +  "\n";
+	  pushEvent(currentTime, infos);
 	});
+
+	// resolution changes are noticed by the next sample
+	player.addEventListener("resize", sample);
+	player.addEventListener("timeupdate", sampleFast);
 }
 
 
-var outE = "";
-var outC = "";
+// sampling intervals (ms), passed by run_yomo as the script argument
+var sampling = (typeof arguments !== "undefined" && arguments[0]) || {};
+var SAMPLE_INTERVAL = sampling.interval_ms || 1000;
+var FAST_SAMPLE_INTERVAL = sampling.fast_interval_ms || 100;
+var FAST_SAMPLE_WINDOW = sampling.fast_window_ms || 3000;
+var runTimer = null;
+var lastSample = 0;
+var fastUntil = 0;
+var framePending = false;
+
+// time, currentTime, buffered, available playback time, total/dropped/corrupted frames
+var SAMPLE_FIELDS = 7;
+var SAMPLE_CAPACITY = 4096;
+var EVENT_CAPACITY = 4096;
+var samples = new Float64Array(SAMPLE_CAPACITY * SAMPLE_FIELDS);
+var sampleHead = 0;
+var sampleTail = 0;
+var eventTimes = new Float64Array(EVENT_CAPACITY);
+var eventCodes = new Int32Array(EVENT_CAPACITY);
+var eventHead = 0;
+var eventTail = 0;
+var eventNames = [];
+var eventIds = {};
+var dropped = 0;
+var debugTail = 0;
+
+var playbackEnded = false;
+var playbackError = null;
+var lastCurrentTime = -1;
+var lastProgress = new Date().getTime();
 
 var player = null;
+var playerAttached = null;
+var observer = null;
 var last_infos = "";
 var last_videoHeight = -1;
 var last_volume = -1;
@@ -248,6 +408,7 @@ divLog.id = "divLog";
 document.getElementsByTagName("body")[0].appendChild(divLog);
 divLog.innerHTML += new Date().getTime() + " Starting \n";
 
+window.videomonState = state;
 init();
 
 
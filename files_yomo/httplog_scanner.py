@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Single-pass extraction of *.googlevideo.com servers from the browser HTTP logs.
+
+Handles the Chrome net-log (<prefix>_httpLog_C.json) and the Firefox nsHttp
+log (<prefix>_httpLog_FF.txt). Files are memory-mapped and searched for the
+domain suffix in a single pass, so large logs are neither read into memory
+nor piped through external tools. Optionally the first time each host was seen is
+returned (seconds since the epoch).
+
+Usage:
+    httplog_scanner.py <logfile> [<logfile> ...]
+    httplog_scanner.py --bench [size_mb]
+"""
+
+import os
+import re
+import sys
+import mmap
+import time
+import random
+import calendar
+import tempfile
+from subprocess import Popen, PIPE
+
+# go for: ..."https://r2---sn-4g5ednss.googlevideo.com/generate_204"...
+#         ...ders":["Host: r2---sn-4g5e6nlk.googlevideo.com","...
+#         ...":"r2---sn-4g5e6nlk.googlevideo.com:443","is...
+#         .../nsHttp   Host: r2---sn-4g5e6nlk.googlevideo.com...
+# the file is searched for the domain suffix, the host label is taken from
+# the bytes in front of it; wildcard entries like *.googlevideo.com are skipped
+DOMAIN = b'.googlevideo.com'
+LABEL_RE = re.compile(br'(?<![.A-Za-z0-9\-])[A-Za-z0-9\-]{1,63}$')
+
+# Chrome: event times are ms relative to constants.timeTickOffset, the
+# "time" key follows the params of an event
+CHROME_OFFSET_RE = re.compile(br'"timeTickOffset"\s*:\s*"?(\d+)')
+CHROME_TIME_RE = re.compile(br'"time"\s*:\s*"?(\d+)')
+
+# Firefox: 2018-04-20 10:11:12.123456 UTC - [Socket Thread]: ...
+FIREFOX_TIME_RE = re.compile(br'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(\.\d+)? UTC')
+
+def _first_seen_chrome(mm, pos, offset):
+    m = CHROME_TIME_RE.search(mm, pos)
+    if not m or offset is None:
+        return None
+    return (offset + int(m.group(1))) / 1000.0
+
+def _first_seen_firefox(mm, pos):
+    m = FIREFOX_TIME_RE.match(mm, mm.rfind(b'\n', 0, pos) + 1)
+    if not m:
+        return None
+    seconds = calendar.timegm(time.strptime(m.group(1).decode('ascii'), '%Y-%m-%d %H:%M:%S'))
+    return seconds + float(m.group(2) or 0)
+
+def scan_servers(logfile, servers=None, first_seen=False):
+    """Add all googlevideo.com hosts found in logfile to the dict servers.
+
+       Maps each host to the time it was first seen if first_seen is set,
+       to None otherwise. Returns servers.
+    """
+    if servers is None:
+        servers = {}
+    with open(logfile, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return servers
+    try:
+        chrome = logfile.endswith('.json')
+        offset = None
+        if first_seen and chrome:
+            m = CHROME_OFFSET_RE.search(mm, 0, min(len(mm), 1 << 20))
+            offset = int(m.group(1)) if m else None
+        found = set()
+        pos = mm.find(DOMAIN)
+        while pos != -1:
+            m = LABEL_RE.search(mm[max(0, pos - 64):pos])
+            if m and m.group(0) not in found:
+                found.add(m.group(0))
+                host = m.group(0).decode('ascii') + '.googlevideo.com'
+                seen = None
+                if first_seen:
+                    # logs are written in time order, the first match is the earliest
+                    if chrome:
+                        seen = _first_seen_chrome(mm, pos, offset)
+                    else:
+                        seen = _first_seen_firefox(mm, pos)
+                if servers.get(host) is None or (seen is not None and seen < servers[host]):
+                    servers[host] = seen
+            pos = mm.find(DOMAIN, pos + len(DOMAIN))
+    finally:
+        mm.close()
+    return servers
+
+def get_servers(logfiles, first_seen=False):
+    """Scan all logfiles; returns a dict host -> first seen time (or None)."""
+    servers = {}
+    for logfile in logfiles:
+        try:
+            scan_servers(logfile, servers, first_seen)
+        except (IOError, OSError) as e:
+            print("Cannot scan HTTP log {}: {}".format(logfile, e))
+    return servers
+
+def _shell_servers(logfile):
+    """The former grep|sed|sort|uniq pipeline, kept for the benchmark."""
+    cmd = "grep googlevideo.com " + logfile + " | sed -re 's/^.*[ \"\\/]([^\\. :\"]+\\.googlevideo\\.com).*$/\\1/g' | sort | uniq"
+    p = Popen(cmd, shell=True, stdout=PIPE)
+    data = list(filter(None, p.communicate()[0].decode("utf-8").split("\n")))
+    return [el for el in data if "*." not in el]
+
+def _write_synthetic_logs(directory, size):
+    hosts = ['r{}---sn-{:08x}.googlevideo.com'.format(random.randint(1, 20), random.getrandbits(32)) for i in range(50)]
+    chrome = os.path.join(directory, 'bench_httpLog_C.json')
+    firefox = os.path.join(directory, 'bench_httpLog_FF.txt')
+    with open(chrome, 'w') as f:
+        f.write('{"constants":{"timeTickOffset":"1524000000000"},\n"events": [\n')
+        written, tick = 0, 0
+        while written < size:
+            tick += 3
+            if tick % 10 == 0:
+                line = '{{"params":{{"headers":["Host: {}","Range: bytes=0-"]}},"phase":0,"source":{{"id":{},"type":1}},"time":"{}","type":180}},\n'.format(random.choice(hosts), tick, tick)
+            else:
+                line = '{{"params":{{"byte_count":1400}},"phase":0,"source":{{"id":{},"type":8}},"time":"{}","type":68}},\n'.format(tick, tick)
+            f.write(line)
+            written += len(line)
+    with open(firefox, 'w') as f:
+        written, usec = 0, 0
+        while written < size:
+            usec += 997
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1524000000 + usec // 1000000)) + '.{:06d} UTC'.format(usec % 1000000)
+            if usec % 10 == 0:
+                line = '{} - [Socket Thread]: I/nsHttp   Host: {}\n'.format(stamp, random.choice(hosts))
+            else:
+                line = '{} - [Socket Thread]: V/nsHttp nsHttpConnection::OnSocketReadable [this=7f0a]\n'.format(stamp)
+            f.write(line)
+            written += len(line)
+    return [chrome, firefox]
+
+def benchmark(size):
+    directory = tempfile.mkdtemp()
+    try:
+        logfiles = _write_synthetic_logs(directory, size)
+        for logfile in logfiles:
+            time_start = time.time()
+            shell = set(_shell_servers(logfile))
+            time_shell = time.time() - time_start
+            time_start = time.time()
+            scanned = get_servers([logfile])
+            time_scan = time.time() - time_start
+            time_start = time.time()
+            get_servers([logfile], first_seen=True)
+            time_seen = time.time() - time_start
+            print("{} ({:.0f} MB): shell {:.3f} s, scanner {:.3f} s, scanner with first seen {:.3f} s, {} hosts, same result: {}".format(
+                os.path.basename(logfile), os.path.getsize(logfile) / 1e6, time_shell, time_scan, time_seen, len(scanned), shell == set(scanned)))
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        benchmark(int(float(sys.argv[2]) * 1e6) if len(sys.argv) > 2 else 100000000)
+    elif len(sys.argv) > 1:
+        for host, seen in sorted(get_servers(sys.argv[1:], first_seen=True).items()):
+            print("{} {}".format(host, seen))
+    else:
+        print(__doc__)
+        sys.exit(1)
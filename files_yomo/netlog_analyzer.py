@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Streaming analysis of the Chrome net-log (<prefix>_httpLog_C.json).
+
+The net-log is a JSON object with "constants" followed by a (possibly
+unterminated) "events" array. Events are decoded one at a time from a
+chunked read, so the file is never loaded as a whole. Per source we only
+keep the few timestamps and counters needed for:
+
+- per-request records: host, protocol (QUIC/TLS/TCP), DNS, connect and
+  handshake durations of the connection the request was bound to, bytes,
+  start and end time (ms since the epoch)
+- per-session QUIC/TCP summaries
+
+Event names differ between Chrome versions; events that are not present in
+the log's constants are simply never matched.
+
+Usage:
+    netlog_analyzer.py <prefix>_httpLog_C.json
+"""
+
+import sys
+import json
+
+CHUNK_SIZE = 1 << 20
+
+REQUEST_FIELDS = ['host', 'protocol', 'start', 'end', 'dns_ms', 'connect_ms', 'handshake_ms', 'bytes']
+
+# events that bind a request (or stream job) to the source it continues on
+BIND_EVENTS = ('HTTP_STREAM_REQUEST_BOUND_TO_JOB',
+               'HTTP_STREAM_REQUEST_BOUND_TO_QUIC_SESSION',
+               'SOCKET_POOL_BOUND_TO_CONNECT_JOB',
+               'SOCKET_POOL_BOUND_TO_SOCKET')
+
+def iter_netlog(f, chunk_size=CHUNK_SIZE):
+    """Yield the constants dict first, then every event of the net-log file f."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def more():
+        data = f.read(chunk_size)
+        return data, not data
+
+    # constants object
+    while True:
+        key = buf.find('"constants"')
+        colon = buf.find(':', key) if key >= 0 else -1
+        if colon >= 0:
+            start = colon + 1
+            while start < len(buf) and buf[start] in ' \t\r\n':
+                start += 1
+            try:
+                constants, pos = decoder.raw_decode(buf, start)
+                break
+            except ValueError:
+                pass
+        if eof:
+            return
+        data, eof = more()
+        buf += data
+    yield constants
+
+    # events array
+    while True:
+        key = buf.find('"events"', pos)
+        start = buf.find('[', key) if key >= 0 else -1
+        if start >= 0:
+            pos = start + 1
+            break
+        if eof:
+            return
+        data, eof = more()
+        buf += data
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buf):
+            if buf[pos] == ']':
+                return
+            try:
+                event, end = decoder.raw_decode(buf, pos)
+                yield event
+                pos = end
+                continue
+            except ValueError:
+                if eof:
+                    # truncated log, e.g. the browser was killed
+                    return
+        elif eof:
+            return
+        buf = buf[pos:]
+        pos = 0
+        data, eof = more()
+        buf += data
+
+def _host(url):
+    """Host name of an URL or host:port string."""
+    if '://' in url:
+        url = url.split('://', 1)[1]
+    host = url.split('/', 1)[0]
+    if host.startswith('['):
+        return host[1:].split(']', 1)[0]
+    return host.rsplit(':', 1)[0] if host.count(':') == 1 else host
+
+def _duration(begin, end):
+    if begin is None or end is None:
+        return None
+    return end - begin
+
+def _median(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[len(values) // 2]
+
+def analyze_events(events):
+    """Reduce net-log events (constants first) to request records and session summaries."""
+    events = iter(events)
+    constants = next(events)
+    names = dict((v, k) for k, v in constants.get('logEventTypes', {}).items())
+    source_names = dict((v, k) for k, v in constants.get('logSourceType', {}).items())
+    phases = constants.get('logEventPhase', {})
+    begin_phase = phases.get('PHASE_BEGIN', 1)
+    end_phase = phases.get('PHASE_END', 2)
+    offset = int(constants.get('timeTickOffset', 0))
+
+    requests = {}
+    sockets = {}
+    quic = {}
+    bindings = {}
+    pending_dns = {}
+    resolves = []
+
+    for event in events:
+        try:
+            name = names.get(event['type'])
+            source = event['source']
+            source_type = source_names.get(source['type'])
+            sid = source['id']
+            t = int(event['time']) + offset
+            phase = event.get('phase')
+            params = event.get('params') or {}
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if source_type == 'URL_REQUEST':
+            r = requests.setdefault(sid, {'host': None, 'protocol': None, 'start': None, 'end': None, 'bytes': 0, 'length': 0, 'bound': None})
+            if name == 'REQUEST_ALIVE':
+                if phase == begin_phase:
+                    r['start'] = t
+                elif phase == end_phase:
+                    r['end'] = t
+            elif name == 'URL_REQUEST_START_JOB' and 'url' in params:
+                r['host'] = _host(params['url'])
+                r['https'] = params['url'].startswith('https')
+            elif name == 'HTTP_TRANSACTION_QUIC_SEND_REQUEST_HEADERS':
+                r['protocol'] = 'QUIC'
+            elif name == 'HTTP_TRANSACTION_HTTP2_SEND_REQUEST_HEADERS':
+                r['protocol'] = 'TLS'
+            elif name == 'HTTP_TRANSACTION_SEND_REQUEST_HEADERS' and not r['protocol']:
+                r['protocol'] = 'TLS' if r.get('https') else 'TCP'
+            elif name in ('URL_REQUEST_JOB_BYTES_READ', 'URL_REQUEST_JOB_FILTERED_BYTES_READ'):
+                r['bytes'] += params.get('byte_count', 0)
+            elif name == 'HTTP_TRANSACTION_READ_RESPONSE_HEADERS':
+                for header in params.get('headers', []):
+                    if header.lower().startswith('content-length:'):
+                        try:
+                            r['length'] += int(header.split(':', 1)[1])
+                        except ValueError:
+                            pass
+            elif name in BIND_EVENTS and 'source_dependency' in params:
+                r['bound'] = params['source_dependency']['id']
+        elif source_type == 'SOCKET':
+            s = sockets.setdefault(sid, {'start': None, 'connect': [None, None], 'handshake': [None, None], 'received': 0, 'sent': 0})
+            if name == 'SOCKET_ALIVE' and phase == begin_phase:
+                s['start'] = t
+            elif name == 'TCP_CONNECT':
+                s['connect'][0 if phase == begin_phase else 1] = t
+            elif name == 'SSL_CONNECT':
+                s['handshake'][0 if phase == begin_phase else 1] = t
+            elif name == 'SOCKET_BYTES_RECEIVED':
+                s['received'] += params.get('byte_count', 0)
+            elif name == 'SOCKET_BYTES_SENT':
+                s['sent'] += params.get('byte_count', 0)
+        elif source_type == 'QUIC_SESSION':
+            q = quic.setdefault(sid, {'host': None, 'start': None, 'end': None, 'handshake': None, 'received': 0, 'sent': 0})
+            if name == 'QUIC_SESSION':
+                if phase == begin_phase:
+                    q['start'] = t
+                    q['host'] = params.get('host')
+                elif phase == end_phase:
+                    q['end'] = t
+            elif name in ('QUIC_SESSION_HANDSHAKE_CONFIRMED', 'QUIC_SESSION_CRYPTO_HANDSHAKE_MESSAGE_RECEIVED') and q['handshake'] is None:
+                # first server handshake message (or confirmation in newer versions)
+                q['handshake'] = t
+            elif name == 'QUIC_SESSION_PACKET_RECEIVED':
+                q['received'] += params.get('size', 0)
+            elif name == 'QUIC_SESSION_PACKET_SENT':
+                q['sent'] += params.get('size', 0)
+        elif source_type in ('HTTP_STREAM_JOB', 'CONNECT_JOB', 'TRANSPORT_CONNECT_JOB', 'SSL_CONNECT_JOB'):
+            if name in BIND_EVENTS and 'source_dependency' in params:
+                bindings[sid] = params['source_dependency']['id']
+        elif source_type == 'HOST_RESOLVER_IMPL_JOB' and name == 'HOST_RESOLVER_IMPL_JOB':
+            if phase == begin_phase:
+                pending_dns[sid] = (_host(params.get('host') or ''), t)
+            elif phase == end_phase and sid in pending_dns:
+                host, begin = pending_dns.pop(sid)
+                resolves.append((host, begin, t))
+
+    # the last DNS resolution of a host that finished before a connection started
+    def dns_ms(host, before):
+        best = None
+        for h, begin, end in resolves:
+            if h == host and before is not None and end <= before and (best is None or end > best[1]):
+                best = (begin, end)
+        return _duration(*best) if best else None
+
+    for q in quic.values():
+        q['dns_ms'] = dns_ms(q['host'], q['start'])
+
+    records = []
+    for sid in sorted(requests):
+        r = requests[sid]
+        if r['start'] is None or r['host'] is None:
+            continue
+        # follow request -> stream job -> connect job -> socket / QUIC session
+        target = r['bound']
+        for i in range(4):
+            if target in sockets or target in quic or target not in bindings:
+                break
+            target = bindings[target]
+        connect_ms = handshake_ms = None
+        dns = None
+        if target in sockets:
+            s = sockets[target]
+            connect_ms = _duration(*s['connect'])
+            handshake_ms = _duration(*s['handshake'])
+            dns = dns_ms(r['host'], s['connect'][0] or s['start'])
+        elif target in quic:
+            q = quic[target]
+            handshake_ms = _duration(q['start'], q['handshake'])
+            dns = q['dns_ms']
+        records.append([r['host'], r['protocol'], r['start'], r['end'], dns, connect_ms, handshake_ms, r['bytes'] or r['length']])
+
+    tcp_sessions = [s for s in sockets.values() if s['connect'][1] is not None]
+    sessions = {
+        'quic': {
+            'count': len(quic),
+            'hosts': len(set(q['host'] for q in quic.values())),
+            'bytes_received': sum(q['received'] for q in quic.values()),
+            'bytes_sent': sum(q['sent'] for q in quic.values()),
+            'handshake_ms_median': _median(_duration(q['start'], q['handshake']) for q in quic.values()),
+            'requests': sum(1 for r in records if r[1] == 'QUIC'),
+        },
+        'tcp': {
+            'count': len(tcp_sessions),
+            'tls': sum(1 for s in tcp_sessions if s['handshake'][1] is not None),
+            'bytes_received': sum(s['received'] for s in tcp_sessions),
+            'bytes_sent': sum(s['sent'] for s in tcp_sessions),
+            'connect_ms_median': _median(_duration(*s['connect']) for s in tcp_sessions),
+            'handshake_ms_median': _median(_duration(*s['handshake']) for s in tcp_sessions),
+            'requests': sum(1 for r in records if r[1] in ('TCP', 'TLS')),
+        },
+        'dns': {
+            'count': len(resolves),
+            'ms_median': _median(end - begin for h, begin, end in resolves),
+        },
+    }
+    return {'request_fields': REQUEST_FIELDS, 'requests': records, 'sessions': sessions}
+
+def analyze_netlog(path):
+    """Analyze a Chrome net-log file; returns None if it has no constants."""
+    with open(path) as f:
+        try:
+            return analyze_events(iter_netlog(f))
+        except StopIteration:
+            return None
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    print(json.dumps(analyze_netlog(sys.argv[1])))
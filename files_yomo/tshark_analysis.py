@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Vectorized time-series analysis of the tshark capture.
+
+Works on the columns of tshark_columnar (the _tshark.col file, or the text
+log parsed into memory) with NumPy binning only, there are no per-packet
+Python loops:
+
+- per-second downlink and uplink throughput (kbit/s)
+- TCP ACK RTT percentiles (ms) of the downlink packets: the uplink ACKs of a
+  download measure the local delayed ACK time, not the network RTT
+- TCP lost segment, out-of-order, fast retransmission and duplicate ACK rates
+- QUIC packet number gaps per connection ID (missing, reordered, duplicates)
+  of the short header packets; the long header packets (Initial, Handshake)
+  have their own packet number spaces
+- downlink bytes per flow (TCP: remote address/port and local port, QUIC:
+  connection ID), the largest flows only
+
+Downlink packets are the ones sent to a local address: the given IP for its
+address family, otherwise the address seen in most packets of the family.
+
+Usage:
+    tshark_analysis.py <prefix>_tshark.col|<prefix>_tshark.txt [local_ip]
+"""
+
+import sys
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from tshark_columnar import load, FLAG_LOST_SEGMENT, FLAG_OUT_OF_ORDER, FLAG_FAST_RETRANSMISSION, FLAG_DUPLICATE_ACK, FLAG_QUIC_LONG_HEADER
+
+PERCENTILES = [5, 25, 50, 75, 95]
+MAX_FLOWS = 10
+FLOW_FIELDS = ['remote_ip', 'remote_port', 'local_port', 'quic_cid', 'bytes', 'packets', 'first', 'last']
+
+def _percentiles(values, scale=1.0):
+    if not len(values):
+        return None
+    return [round(float(v) * scale, 3) for v in np.percentile(values, PERCENTILES)]
+
+def _rate(count, total):
+    return round(float(count) / total, 6) if total else None
+
+def _local_ips(capture, local_ip=None):
+    """Dictionary indexes of the local IPv4 and IPv6 address."""
+    ips = capture.dictionaries['ip']
+    counts = np.bincount(np.concatenate((capture['src'], capture['dst'])).astype(np.int64), minlength=len(ips))
+    counts[0] = 0
+    v6 = np.array([':' in ip for ip in ips], dtype=bool)
+    v4 = ~v6
+    # index 0 is the empty string of packets without IP
+    v4[0] = False
+    local = []
+    for family in (v4, v6):
+        if local_ip and local_ip in ips and family[ips.index(local_ip)]:
+            local.append(ips.index(local_ip))
+        elif family.any() and counts[family].max() > 0:
+            local.append(int(np.flatnonzero(family)[np.argmax(counts[family])]))
+    return local
+
+def _throughput(second, frame_len, mask, seconds):
+    kbps = np.bincount(second[mask], weights=frame_len[mask], minlength=seconds) * 8 / 1000.0
+    return np.rint(kbps).astype(np.int64).tolist()
+
+def _quic_gaps(t, cid, pn):
+    """Missing, reordered and duplicate packet numbers per connection ID."""
+    if not len(cid):
+        return {'connections': 0, 'packets': 0, 'missing': 0, 'loss_rate': None, 'reordered': 0, 'duplicates': 0}
+    # packet number span minus distinct packet numbers received, per CID
+    unique = np.unique((cid.astype(np.int64) << 32) | pn)
+    unique_cid = unique >> 32
+    unique_pn = unique & 0xffffffff
+    starts = np.flatnonzero(np.r_[True, unique_cid[1:] != unique_cid[:-1]])
+    ends = np.r_[starts[1:], len(unique)]
+    span = unique_pn[ends - 1] - unique_pn[starts] + 1
+    missing = int(np.sum(span - (ends - starts)))
+    # packet numbers lower than their predecessor on the same CID, in capture order
+    order = np.lexsort((t, cid))
+    same = cid[order][1:] == cid[order][:-1]
+    reordered = int(np.count_nonzero(np.diff(pn[order])[same] < 0))
+    return {'connections': len(starts),
+            'packets': len(cid),
+            'missing': missing,
+            'loss_rate': _rate(missing, int(np.sum(span))),
+            'reordered': reordered,
+            'duplicates': len(cid) - len(unique)}
+
+def _flows(capture, t, frame_len, down):
+    """Downlink bytes of the largest TCP and QUIC flows."""
+    tcp = down & (capture['tcp_len'] >= 0)
+    quic = down & ~tcp & (capture['quic_cid'] > 0)
+    src = capture['src'].astype(np.int64)
+    # TCP keys are >= 0, QUIC keys (the CID index) negative
+    key = np.zeros(len(t), dtype=np.int64)
+    key[tcp] = (src[tcp] << 32) | (capture['srcport'][tcp].astype(np.int64) << 16) | capture['dstport'][tcp]
+    key[quic] = -capture['quic_cid'][quic].astype(np.int64)
+    selected = tcp | quic
+    flows, inverse = np.unique(key[selected], return_inverse=True)
+    if not len(flows):
+        return 0, []
+    size = np.bincount(inverse, weights=frame_len[selected]).astype(np.int64)
+    packets = np.bincount(inverse)
+    first = np.full(len(flows), np.inf)
+    last = np.full(len(flows), -np.inf)
+    np.minimum.at(first, inverse, t[selected])
+    np.maximum.at(last, inverse, t[selected])
+    # remote address of a QUIC flow: the source of its first packet
+    first_row = np.full(len(flows), len(inverse), dtype=np.int64)
+    np.minimum.at(first_row, inverse, np.arange(len(inverse)))
+    remote = src[selected][first_row]
+    ips = capture.dictionaries['ip']
+    cids = capture.dictionaries['cid']
+    rows = []
+    for i in np.argsort(-size)[:MAX_FLOWS]:
+        k = int(flows[i])
+        if k >= 0:
+            row = [ips[k >> 32], (k >> 16) & 0xffff, k & 0xffff, None]
+        else:
+            row = [ips[remote[i]], None, None, cids[-k]]
+        rows.append(row + [int(size[i]), int(packets[i]), round(float(first[i]), 3), round(float(last[i]), 3)])
+    return len(flows), rows
+
+def analyze(capture, local_ip=None):
+    """Compute the time series and summary statistics of a capture (see load())."""
+    if np is None:
+        raise ImportError('tshark analysis requires numpy')
+    if not len(capture):
+        return None
+    t = capture['time']
+    frame_len = np.maximum(capture['frame_len'], 0).astype(np.float64)
+    start = np.floor(t.min())
+    second = (t - start).astype(np.int64)
+    seconds = int(second.max()) + 1
+    local = _local_ips(capture, local_ip)
+    down = np.in1d(capture['dst'], local)
+    up = np.in1d(capture['src'], local)
+
+    down_kbps = _throughput(second, frame_len, down, seconds)
+    throughput = {'start': int(start),
+                  'down_kbps': down_kbps,
+                  'up_kbps': _throughput(second, frame_len, up, seconds),
+                  'down_kbps_mean': round(float(np.mean(down_kbps)), 1),
+                  'down_kbps_percentiles': _percentiles(down_kbps)}
+
+    rtt = capture['ack_rtt'][down]
+    rtt = rtt[~np.isnan(rtt)]
+
+    flags = capture['flags']
+    tcp = capture['tcp_len'] >= 0
+    data = int(np.count_nonzero(capture['tcp_len'] > 0))
+    counts = dict((name, int(np.count_nonzero(flags & flag))) for name, flag in (('lost_segment', FLAG_LOST_SEGMENT),
+                                                                                ('out_of_order', FLAG_OUT_OF_ORDER),
+                                                                                ('fast_retransmission', FLAG_FAST_RETRANSMISSION),
+                                                                                ('duplicate_ack', FLAG_DUPLICATE_ACK)))
+    tcp_stats = {'packets': int(np.count_nonzero(tcp)), 'data_packets': data}
+    for name, count in counts.items():
+        tcp_stats[name] = count
+        tcp_stats[name + '_rate'] = _rate(count, data if name != 'duplicate_ack' else tcp_stats['packets'])
+
+    quic = down & (capture['quic_cid'] > 0) & (capture['quic_pn'] >= 0) & (flags & FLAG_QUIC_LONG_HEADER == 0)
+    flow_count, flows = _flows(capture, t, frame_len, down)
+
+    return {'local_ips': [capture.dictionaries['ip'][i] for i in local],
+            'throughput': throughput,
+            'rtt_ms': {'samples': len(rtt), 'percentiles': _percentiles(rtt, 1000.0)},
+            'tcp': tcp_stats,
+            'quic': _quic_gaps(t[quic], capture['quic_cid'][quic], capture['quic_pn'][quic].astype(np.int64)),
+            'flow_count': flow_count,
+            'flow_fields': FLOW_FIELDS,
+            'flows': flows}
+
+def analyze_file(path, local_ip=None):
+    """Analyze a columnar file or tshark text log."""
+    capture = load(path)
+    try:
+        return analyze(capture, local_ip)
+    finally:
+        capture.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__)
+        sys.exit(1)
+    print(json.dumps(analyze_file(*sys.argv[1:])))
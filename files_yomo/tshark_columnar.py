@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Columnar binary format for the tshark capture log (<prefix>_tshark.txt).
+
+The text log has one comma separated line per packet with the fields in
+TSHARK_FIELDS. It is converted into one typed array per field: timestamps,
+lengths, ports, RTTs and packet numbers as numbers, TCP analysis flags as a
+bitmask, IPs, QUIC CIDs and DNS names as indexes into per-kind
+dictionaries. DNS fields are only present on a few packets, so they are
+stored sparsely: the dns_* columns have one entry per packet with DNS
+fields, whose row is given by dns_row. A per-second index gives the rows of
+every capture second.
+
+tshark joins multiple occurrences of a field (several dns.a answers, the
+two ip.src of an ICMP error quoting a TCP packet, the CIDs of coalesced
+QUIC packets) with the aggregator ';', so every line has one comma
+separated value per field. Numeric and dictionary columns keep the first
+value of a field, the DNS columns all values as written by tshark. The
+last field, quic.header_form, is only requested from tshark versions that
+know it; it sets the QUIC long header bit of the flags column.
+
+Logs written this way start with the line LOG_HEADER + the requested
+fields (write_log_header()). Logs without it were written before the
+aggregator was set and joined repeated fields with ',' as well: their
+lines with more than 21 fields keep only the time, the lengths and ip.src
+(the fields before the first one that can repeat) and, for DNS packets,
+the DNS part verbatim in the dns_tail column.
+
+File layout:
+    magic 'TSHCOL1\\0', uint32 header length, JSON header (row count, byte
+    order, column offsets/types, dictionaries, index start second), then the
+    column arrays, each starting at a multiple of 8 bytes.
+
+Usage:
+    tshark_columnar.py convert <prefix>_tshark.txt [<prefix>_tshark.col]
+    tshark_columnar.py report <prefix>_tshark.txt <prefix>_tshark.col
+    tshark_columnar.py --bench [num_packets]
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import random
+import struct
+import tempfile
+from array import array
+from subprocess import check_output, CalledProcessError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# fields of the tshark capture, in output order
+TSHARK_FIELDS = ['frame.time_epoch', 'tcp.len', 'frame.len', 'ip.src', 'ip.dst', 'tcp.srcport', 'tcp.dstport',
+                 'tcp.analysis.ack_rtt', 'tcp.analysis.lost_segment', 'tcp.analysis.out_of_order',
+                 'tcp.analysis.fast_retransmission', 'tcp.analysis.duplicate_ack', 'dns', 'quic.cid',
+                 'quic.packet_number', 'dns.cname', 'dns.qry.name', 'dns.resp.name', 'dns.resp.type', 'dns.a', 'dns.aaaa',
+                 'quic.header_form']
+# last field, only known to tshark versions with the IETF QUIC dissector
+OPTIONAL_FIELD = 'quic.header_form'
+TSHARK_DISPLAY_FILTER = 'tcp or dns or quic'
+# joins repeated values of a field, must differ from the separator
+TSHARK_AGGREGATOR = ';'
+# first line of logs written with the aggregator, followed by the comma separated fields
+LOG_HEADER = '#fields:'
+
+_tshark_field_names = None
+
+def _tshark_knows(field):
+    global _tshark_field_names
+    if _tshark_field_names is None:
+        try:
+            output = check_output(['tshark', '-G', 'fields'], stderr=open(os.devnull, 'w'))
+            _tshark_field_names = set(line.split('\t')[2] for line in output.decode('utf-8', 'replace').splitlines()
+                                      if line.startswith('F\t') and line.count('\t') >= 2)
+        except (OSError, CalledProcessError):
+            _tshark_field_names = set()
+    return field in _tshark_field_names
+
+def tshark_fields():
+    """TSHARK_FIELDS without OPTIONAL_FIELD if tshark does not know it."""
+    return [field for field in TSHARK_FIELDS if field != OPTIONAL_FIELD or _tshark_knows(field)]
+
+def tshark_field_arguments():
+    """tshark arguments that print tshark_fields() of the packets passing the display filter."""
+    arguments = ['-E', 'separator=,', '-E', 'aggregator=' + TSHARK_AGGREGATOR, '-T', 'fields']
+    for field in tshark_fields():
+        arguments.extend(['-e', field])
+    return arguments + ['-Y', TSHARK_DISPLAY_FILTER]
+
+def write_log_header(path):
+    """Start a new tshark log with the header line (before tshark appends to it)."""
+    if os.path.exists(path) and os.path.getsize(path):
+        return
+    with open(path, 'a') as f:
+        f.write(LOG_HEADER + ','.join(tshark_fields()) + '\n')
+
+MAGIC = b'TSHCOL1\0'
+HEADER_LENGTH = struct.Struct('<I')
+
+# (column, array type code, dictionary); missing values are -1, 0 or NaN
+PACKET_COLUMNS = [('time', 'd', None),
+                  ('tcp_len', 'i', None),
+                  ('frame_len', 'i', None),
+                  ('src', 'I', 'ip'),
+                  ('dst', 'I', 'ip'),
+                  ('srcport', 'H', None),
+                  ('dstport', 'H', None),
+                  ('ack_rtt', 'f', None),
+                  ('flags', 'B', None),
+                  ('quic_cid', 'I', 'cid'),
+                  ('quic_pn', 'i', None)]
+DNS_COLUMNS = [('dns_row', 'I', None),
+               ('dns_cname', 'I', 'name'),
+               ('dns_qry_name', 'I', 'name'),
+               ('dns_resp_name', 'I', 'name'),
+               ('dns_resp_type', 'I', 'name'),
+               ('dns_a', 'I', 'name'),
+               ('dns_aaaa', 'I', 'name'),
+               ('dns_tail', 'I', 'name')]
+COLUMNS = PACKET_COLUMNS + DNS_COLUMNS
+
+NUMPY_TYPES = {'d': 'f8', 'f': 'f4', 'i': 'i4', 'I': 'u4', 'H': 'u2', 'B': 'u1'}
+
+# bits of the flags column
+FLAG_LOST_SEGMENT = 1
+FLAG_OUT_OF_ORDER = 2
+FLAG_FAST_RETRANSMISSION = 4
+FLAG_DUPLICATE_ACK = 8
+FLAG_DNS = 16
+FLAG_QUIC_LONG_HEADER = 32
+
+NAN = float('nan')
+
+class _Dictionary(object):
+    """String -> index mapping, index 0 is the empty string."""
+
+    def __init__(self):
+        self.strings = ['']
+        self.index = {'': 0}
+
+    def encode(self, value):
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+def _first(value):
+    """First of the aggregated values of a field."""
+    return value.split(TSHARK_AGGREGATOR, 1)[0]
+
+def _int(value, default):
+    try:
+        return int(_first(value))
+    except ValueError:
+        return default
+
+def _float(value):
+    try:
+        return float(_first(value))
+    except ValueError:
+        return NAN
+
+def _parse_lines(lines):
+    """Parse tshark text lines into (arrays, dictionaries, skipped lines)."""
+    arrays = dict((name, array(code)) for name, code, dictionary in COLUMNS)
+    dictionaries = {'ip': _Dictionary(), 'cid': _Dictionary(), 'name': _Dictionary()}
+    ip, cid, name = dictionaries['ip'].encode, dictionaries['cid'].encode, dictionaries['name'].encode
+    append = dict((column, arrays[column].append) for column in arrays)
+    # logs without header: the fields of TSHARK_FIELDS but OPTIONAL_FIELD, repeated fields joined with ','
+    header = False
+    num_fields = len(TSHARK_FIELDS) - 1
+    long_header = None
+    skipped = 0
+    row = 0
+    for line in lines:
+        if line.startswith(LOG_HEADER):
+            fields = line[len(LOG_HEADER):].strip().split(',')
+            header = True
+            num_fields = len(fields)
+            long_header = fields.index(OPTIONAL_FIELD) if OPTIONAL_FIELD in fields else None
+            continue
+        f = line.rstrip('\r\n').split(',')
+        try:
+            t = float(f[0])
+        except ValueError:
+            # empty or garbled line (e.g. cut off when tshark was stopped)
+            skipped += 1
+            continue
+        if len(f) < num_fields:
+            f.extend([''] * (num_fields - len(f)))
+        legacy = not header and len(f) > num_fields
+        if legacy:
+            # a field repeated in an old log shifts the fields after it: keep the
+            # ones up to ip.src (the first field that can repeat) and the DNS part
+            f = f[:4] + [''] * 8 + [f[12] if f[12] and not any(f[13:15]) else ''] + ['', ''] + f[15:]
+        append['time'](t)
+        append['tcp_len'](_int(f[1], -1))
+        append['frame_len'](_int(f[2], -1))
+        append['src'](ip(_first(f[3])))
+        append['dst'](ip(_first(f[4])))
+        port = _int(f[5], 0)
+        append['srcport'](port if 0 <= port <= 0xffff else 0)
+        port = _int(f[6], 0)
+        append['dstport'](port if 0 <= port <= 0xffff else 0)
+        append['ack_rtt'](_float(f[7]))
+        append['flags']((FLAG_LOST_SEGMENT if f[8] else 0) | (FLAG_OUT_OF_ORDER if f[9] else 0) |
+                        (FLAG_FAST_RETRANSMISSION if f[10] else 0) | (FLAG_DUPLICATE_ACK if f[11] else 0) |
+                        (FLAG_DNS if f[12] else 0) |
+                        (FLAG_QUIC_LONG_HEADER if long_header is not None and _first(f[long_header]) in ('1', 'True') else 0))
+        append['quic_cid'](cid(_first(f[13])))
+        pn = _int(f[14], -1)
+        append['quic_pn'](pn if -1 <= pn <= 0x7fffffff else -1)
+        row += 1
+        if not (f[12] and any(f[15:]) if legacy else any(f[15:21])):
+            # no DNS fields, or an old log's repeated non-DNS field
+            continue
+        append['dns_row'](row - 1)
+        if not legacy:
+            append['dns_cname'](name(f[15]))
+            append['dns_qry_name'](name(f[16]))
+            append['dns_resp_name'](name(f[17]))
+            append['dns_resp_type'](name(f[18]))
+            append['dns_a'](name(f[19]))
+            append['dns_aaaa'](name(f[20]))
+            append['dns_tail'](0)
+        else:
+            for column in ('dns_cname', 'dns_qry_name', 'dns_resp_name', 'dns_resp_type', 'dns_a', 'dns_aaaa'):
+                append[column](0)
+            append['dns_tail'](name(','.join(f[15:])))
+    return arrays, dict((kind, d.strings) for kind, d in dictionaries.items()), skipped
+
+def _second_index(times):
+    """Return (start second, index) where rows of second start+k are index[k]:index[k+1].
+
+       Rows are in capture order; a packet stamped slightly earlier than its
+       predecessor stays in the predecessor's second.
+    """
+    index = array('I')
+    if not times:
+        return 0, index
+    start = int(times[0])
+    second = start
+    for i, t in enumerate(times):
+        while t >= second:
+            index.append(i)
+            second += 1
+    index.append(len(times))
+    return start, index
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % 8))
+
+def convert(text_path, col_path=None):
+    """Convert a tshark text log into the columnar format; returns the output path."""
+    if col_path is None:
+        col_path = os.path.splitext(text_path)[0] + '.col'
+    with open(text_path) as f:
+        arrays, dictionaries, skipped = _parse_lines(f)
+    index_start, index = _second_index(arrays['time'])
+    blocks = [(name, code, arrays[name]) for name, code, dictionary in COLUMNS] + [('second_index', 'I', index)]
+    columns = {}
+    offset = 0
+    for name, code, data in blocks:
+        size = len(data) * data.itemsize
+        columns[name] = {'type': code, 'offset': offset, 'count': len(data)}
+        offset += size + (-size % 8)
+    header = json.dumps({'version': 1,
+                         'fields': TSHARK_FIELDS,
+                         'rows': len(arrays['time']),
+                         'skipped': skipped,
+                         'byteorder': sys.byteorder,
+                         'columns': columns,
+                         'dictionaries': dictionaries,
+                         'index_start': index_start}).encode('utf-8')
+    tmp = col_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+        _pad(f)
+        for name, code, data in blocks:
+            data.tofile(f)
+            _pad(f)
+    os.rename(tmp, col_path)
+    return col_path
+
+class ColumnarCapture(object):
+    """Memory-mapped capture written by convert().
+
+       capture['time'], capture['tcp_len'], ... return the column as numpy
+       array (without copying) if numpy is installed, as array.array otherwise.
+    """
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise Exception('Invalid columnar tshark file: ' + path)
+        length = HEADER_LENGTH.unpack_from(self.mm, len(MAGIC))[0]
+        start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(self.mm[start:start + length].decode('utf-8'))
+        self.base = start + length + (-(start + length) % 8)
+        self.rows = header['rows']
+        self.skipped = header['skipped']
+        self.byteorder = header['byteorder']
+        self.columns = header['columns']
+        self.dictionaries = header['dictionaries']
+        self.dictionary_of = dict((name, dictionary) for name, code, dictionary in COLUMNS)
+        self.index_start = header['index_start']
+        self.cache = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            column = self.columns[name]
+            offset = self.base + column['offset']
+            if np is not None:
+                dtype = np.dtype(NUMPY_TYPES[column['type']]).newbyteorder('<' if self.byteorder == 'little' else '>')
+                data = np.frombuffer(self.mm, dtype=dtype, count=column['count'], offset=offset)
+            else:
+                data = array(column['type'])
+                (getattr(data, 'frombytes', None) or data.fromstring)(self.mm[offset:offset + column['count'] * data.itemsize])
+                if self.byteorder != sys.byteorder:
+                    data.byteswap()
+            self.cache[name] = data
+        return self.cache[name]
+
+    def strings(self, name):
+        """Decode a dictionary encoded column into a list of strings."""
+        dictionary = self.dictionaries[self.dictionary_of[name]]
+        return [dictionary[i] for i in self[name]]
+
+    def seconds(self):
+        """Number of capture seconds covered by the index."""
+        return max(0, len(self['second_index']) - 1)
+
+    def second_rows(self, second):
+        """(begin, end) rows captured in the epoch second, via the index."""
+        index = self['second_index']
+        k = int(second) - self.index_start
+        if k < 0 or k >= len(index) - 1:
+            return 0, 0
+        return int(index[k]), int(index[k + 1])
+
+    def close(self):
+        self.cache = {}
+        try:
+            self.mm.close()
+        except Exception as e:
+            # numpy views still reference the map, it is unmapped with them
+            pass
+        self.f.close()
+
+class TextCapture(ColumnarCapture):
+    """A tshark text log parsed into memory, with the interface of ColumnarCapture."""
+
+    def __init__(self, path):
+        with open(path) as f:
+            arrays, self.dictionaries, self.skipped = _parse_lines(f)
+        self.index_start, arrays['second_index'] = _second_index(arrays['time'])
+        self.rows = len(arrays['time'])
+        self.dictionary_of = dict((name, dictionary) for name, code, dictionary in COLUMNS)
+        self.cache = {}
+        for name, data in arrays.items():
+            if np is not None:
+                data = np.frombuffer(data, dtype=NUMPY_TYPES[data.typecode]) if len(data) else np.zeros(0, NUMPY_TYPES[data.typecode])
+            self.cache[name] = data
+
+    def close(self):
+        self.cache = {}
+
+def load(path):
+    """Open a columnar file, or parse a tshark text log (*.txt) into memory."""
+    if path.endswith('.txt'):
+        return TextCapture(path)
+    return ColumnarCapture(path)
+
+def report(text_path, col_path):
+    """Compare size and full load time of the text log and the columnar file."""
+    time_start = time.time()
+    with open(text_path) as f:
+        _parse_lines(f)
+    text_load = time.time() - time_start
+    time_start = time.time()
+    capture = ColumnarCapture(col_path)
+    for name in capture.columns:
+        capture[name]
+    # names are decoded on demand, the dictionaries are part of the load
+    binary_load = time.time() - time_start
+    rows = len(capture)
+    capture.close()
+    text_bytes = os.path.getsize(text_path)
+    binary_bytes = os.path.getsize(col_path)
+    return {'rows': rows,
+            'text_bytes': text_bytes,
+            'binary_bytes': binary_bytes,
+            'size_ratio': float(binary_bytes) / text_bytes if text_bytes else None,
+            'text_load_s': text_load,
+            'binary_load_s': binary_load}
+
+def _write_synthetic_log(path, num):
+    servers = ['173.194.182.{}'.format(i) for i in range(70, 80)]
+    cids = ['{:016x}'.format(random.getrandbits(64)) for i in range(10)]
+    t = 1524000000.0
+    with open(path, 'w') as f:
+        f.write(LOG_HEADER + ','.join(field for field in TSHARK_FIELDS if field != OPTIONAL_FIELD) + '\n')
+        for i in range(num):
+            t += random.expovariate(1000.0)
+            r = random.random()
+            if r < 0.001:
+                f.write('{:.9f},,120,10.0.0.2,8.8.8.8,,,,,,,,1,,,r4---sn-4g5e6nsz.googlevideo.com,r4---sn-4g5e6nsz.googlevideo.com,'
+                        'r4---sn-4g5e6nsz.googlevideo.com,5,1,{}\n'.format(t, random.choice(servers)))
+            elif r < 0.5:
+                f.write('{:.9f},,1392,{},10.0.0.2,,,,,,,,,{},{},,,,,,\n'.format(t, random.choice(servers), random.choice(cids), i))
+            else:
+                lost = '1' if random.random() < 0.01 else ''
+                f.write('{:.9f},1388,1454,{},10.0.0.2,443,{},{:.9f},{},,,,,,,,,,,,\n'.format(
+                    t, random.choice(servers), random.randint(40000, 40010), random.uniform(0.01, 0.08), lost))
+
+def benchmark(num):
+    directory = tempfile.mkdtemp()
+    try:
+        text_path = os.path.join(directory, 'bench_tshark.txt')
+        _write_synthetic_log(text_path, num)
+        time_start = time.time()
+        col_path = convert(text_path)
+        print("convert: {:.3f} s".format(time.time() - time_start))
+        print(json.dumps(report(text_path, col_path), indent=1, sort_keys=True))
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == 'convert':
+        print(convert(*sys.argv[2:]))
+    elif len(sys.argv) == 4 and sys.argv[1] == 'report':
+        print(json.dumps(report(sys.argv[2], sys.argv[3]), indent=1, sort_keys=True))
+    else:
+        print(__doc__)
+        sys.exit(1)
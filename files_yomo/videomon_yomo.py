@@ -7,6 +7,9 @@ import csv
 import datetime
 import sys
 import random
+import signal
+import pipes
+import threading
 #import psutil
 #import numpy as np
 import selenium.webdriver.support.ui as ui
@@ -24,82 +27,248 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-from subprocess import call
+from subprocess import call, Popen
+from tshark_columnar import tshark_field_arguments, write_log_header
+from afpacket_capture import AfPacketCapture
+from dumpcap_capture import DumpcapCapture, dissect
+from yomo_qoe import summarize
+from webdriver_pool import wait_for, start_display, start_browser, clone_profile, attach, log_offsets, copy_log, mark_failed
 
+# values per sample in getVideoInfos.js (see yomo_qoe.py for the _buffer.txt format)
+SAMPLE_FIELDS = 7
 
-def run_yomo(ytid, duration, prefix, bitrates,interf,resultDir,quant1,quant2,quant3,quant4,browser,quic):
+WINDOW_SIZE = (3840, 2260) #7000,4000 / 5920,2880 / 3840, 2260 / 2960,1440
 
+
+def stop_capture(tshark, afpacket, dumpcap):
+	if afpacket is not None:
+		afpacket.stop()
+	if dumpcap is not None:
+		dumpcap.stop()
+	if tshark is None:
+		return
+	# SIGINT lets tshark flush the last packets before it exits
+	try:
+		tshark.send_signal(signal.SIGINT)
+		for i in range(50):
+			if tshark.poll() is not None:
+				return
+			time.sleep(0.1)
+		tshark.kill()
+		tshark.wait()
+	except Exception as e:
+		print time.time(), ' stopping tshark failed: ', e
+
+
+def dissect_capture(dumpcap, resultDir, prefix, options):
+	# dissect the dumpcap ring files into the same _tshark.txt as the live capture
+	if dumpcap is None:
+		return
+	try:
+		files = dumpcap.files()
+		if dumpcap.wrapped():
+			print time.time(), ' capture ring buffer wrapped, the oldest packets are missing'
+		print time.time(), ' dissect ', len(files), ' capture files'
+		dissect(files, resultDir + prefix + "_tshark.txt", resultDir + prefix + "_tshark_error.txt", options.get('dissect_parallel', 1))
+		print time.time(), ' dissection finished'
+		if not options.get('keep_pcap', False):
+			for name in files:
+				os.remove(name)
+	except Exception as e:
+		print time.time(), ' dissection failed: ', e
+
+
+def js_number(value):
+	# same text as JavaScript's number to string conversion
+	if value is None:
+		return 'NaN'
+	if isinstance(value, float):
+		if value.is_integer():
+			return str(int(value))
+		return repr(value)
+	return str(value)
+
+
+def drain_telemetry(browser, bufferFile, eventsFile, debugFile=None):
+	# move the samples, events and debug log collected by getVideoInfos.js into the output files
+	data = browser.execute_script('return window.videomonDrain ? window.videomonDrain() : null;')
+	if not data:
+		return 0
+	samples = data['samples']
+	for i in range(0, len(samples), SAMPLE_FIELDS):
+		bufferFile.write('#'.join(js_number(v) for v in samples[i:i + SAMPLE_FIELDS]) + '\n')
+	for eventTime, infos in data['events']:
+		eventsFile.write(js_number(eventTime) + '#' + infos.encode("UTF-8") + '\n')
+	bufferFile.flush()
+	eventsFile.flush()
+	if debugFile is not None and data.get('debug'):
+		debugFile.write(data['debug'].encode("UTF-8"))
+		debugFile.flush()
+	return data['dropped']
+
+
+class TelemetryHarvester(threading.Thread):
+	# owns the WebDriver connection during playback: polls the player state every second
+	# and drains the telemetry every drain_interval_s into the output files, so a crash or
+	# kill only loses the last interval; fsync is batched to every fsync_interval_s
+
+	def __init__(self, browser, files, drainInterval=5, fsyncInterval=30):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.browser = browser
+		self.files = files
+		self.drainInterval = drainInterval
+		self.fsyncInterval = fsyncInterval
+		self.state = None
+		self.dropped = 0
+		self.error = None
+		self.stopped = threading.Event()
+
+	def sync(self):
+		for f in self.files:
+			os.fsync(f.fileno())
+
+	def run(self):
+		timeDrain = timeSync = time.time()
+		try:
+			while not self.stopped.wait(1):
+				self.state = self.browser.execute_script('return window.videomonState ? window.videomonState() : null;') or {}
+				now = time.time()
+				if now - timeDrain >= self.drainInterval:
+					self.dropped = drain_telemetry(self.browser, *self.files)
+					timeDrain = now
+				if now - timeSync >= self.fsyncInterval:
+					self.sync()
+					timeSync = now
+		except Exception as e:
+			self.error = e
+
+	def stop(self):
+		# last drain after the thread ended; returns the number of dropped samples/events
+		self.stopped.set()
+		self.join()
+		self.dropped = drain_telemetry(self.browser, *self.files)
+		self.sync()
+		return self.dropped
+
+
+def write_startup(path, timings):
+	with open(path, 'w') as f:
+		for name, seconds, ready in timings:
+			f.write(name + '#' + str(round(seconds, 3)) + '#' + str(int(ready)) + '\n')
+
+
+def supervise_playback(harvester, duration, options):
+	# wait until the video ended, failed, made no progress or the nominal duration is over;
+	# returns the reason ("ended", "error", "no_progress" or "duration")
+	progressTimeout = options.get('progress_timeout_s', 60)
+	timeStart = time.time()
+	# duration <= 0: the whole video, as soon as the player knows its duration
+	timeEnd = timeStart + duration if duration > 0 else None
+	while True:
+		time.sleep(1)
+		now = time.time()
+		if harvester.error is not None:
+			raise harvester.error
+		state = harvester.state or {}
+		if timeEnd is None and state.get('duration'):
+			timeEnd = timeStart + state['duration']
+		if state.get('ended'):
+			return "ended"
+		if state.get('error') is not None:
+			return "error"
+		if state:
+			stalled = (state['now'] - state['lastProgress']) / 1000.0
+		else:
+			stalled = now - timeStart
+		if stalled > progressTimeout:
+			return "no_progress"
+		if timeEnd is not None and now >= timeEnd:
+			return "duration"
+
+
+def write_end_reason(eventsFile, reason):
+	eventsFile.write(str(int(round(time.time() * 1000))) + '#videomon_end:' + reason + '\n')
+	eventsFile.flush()
+
+
+def run_yomo(ytid, duration, prefix, bitrates,interf,resultDir,quant1,quant2,quant3,quant4,browser,quic,options=None):
+
+	# options: "capture": "tshark" (live dissection, _tshark.txt), "afpacket" (in-process counters, _afpacket.json)
+	#                     or "dumpcap" (pcapng ring files during playback, dissected into _tshark.txt afterwards),
+	#          "capture_interval_s": interval of the afpacket counters,
+	#          "snaplen", "ring_filesize_kb", "ring_files", "dissect_parallel", "keep_pcap": dumpcap capture and dissection,
+	#          "out_fields": QoE fields to return (default: all of yomo_qoe.out_fields()),
+	#          "drain_interval_s": interval for moving samples/events from the browser into the output files,
+	#          "fsync_interval_s": interval for syncing the output files to disk,
+	#          "sampling": {"interval_ms", "fast_interval_ms", "fast_window_ms"} buffer sampling of getVideoInfos.js,
+	#          "progress_timeout_s": end the run if the playback position did not advance for this long,
+	#          "startup_timeout_s": upper bound for each startup wait (X server, window size, player),
+	#          "window_size": browser window (width, height),
+	#          "headless": run the browser headless instead of on an Xvfb display,
+	#          "profile_template": profile template directory to clone for the browser (default: empty profile),
+	#          "session": warm browser session from webdriver_pool.SessionPool.acquire() (default: start one)
+	options = options or {}
+	session = options.get('session')
+	display = None
+	driver = None
+	logOffsets = None
+	failed = False
+	profile = None
+	startupTimeout = options.get('startup_timeout_s', 30)
+	startup = []
+	windowSize = tuple(options.get('window_size', WINDOW_SIZE))
+	tshark = None
+	afpacket = None
+	dumpcap = None
+	bufferFile = None
+	eventsFile = None
+	debugFile = None
+	harvester = None
 	try:
 
 		# write output without buffering
 		sys.stdout.flush()
 		sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 
-		# start tshark
-		callTshark = "tshark -n -i " + interf + " -E separator=, -T fields -e frame.time_epoch -e tcp.len -e frame.len -e ip.src -e ip.dst -e tcp.srcport -e tcp.dstport -e tcp.analysis.ack_rtt -e tcp.analysis.lost_segment -e tcp.analysis.out_of_order -e tcp.analysis.fast_retransmission -e tcp.analysis.duplicate_ack -e dns -e quic.cid -e quic.packet_number -e dns.cname -e dns.qry.name -e dns.resp.name -e dns.resp.type -e dns.a -e dns.aaaa -Y 'tcp or dns or quic'  >>" + resultDir + prefix + "_tshark.txt  2>" + resultDir + prefix + "_tshark_error.txt &"
-
-		print time.time(), ' start tshark'
-		call(callTshark, shell=True)
-
-		# start display
-		display = Display(visible=0, size=(4000,2400)) # 8000,7000 / 4000,2400
-		print time.time(), ' start display'
-		display.start()
-		time.sleep(5)
+		if options.get('capture', 'tshark') == 'afpacket':
+			# start in-process capture
+			print time.time(), ' start afpacket capture'
+			afpacket = AfPacketCapture(interf, resultDir + prefix + '_afpacket.json', interval=options.get('capture_interval_s', 1.0))
+			afpacket.start()
+		elif options.get('capture') == 'dumpcap':
+			# start raw capture, dissected after playback
+			print time.time(), ' start dumpcap'
+			dumpcap = DumpcapCapture(interf, resultDir + prefix + '_capture', options.get('snaplen', 0), options.get('ring_filesize_kb', 20000),
+						 options.get('ring_files', 50), errfile=resultDir + prefix + "_tshark_error.txt")
+			dumpcap.start()
+		else:
+			# start tshark (exec, so that terminating the shell stops the capture)
+			write_log_header(resultDir + prefix + "_tshark.txt")
+			callTshark = "exec tshark -n -i " + interf + " " + " ".join(pipes.quote(a) for a in tshark_field_arguments()) + "  >>" + resultDir + prefix + "_tshark.txt  2>" + resultDir + prefix + "_tshark_error.txt"
+
+			print time.time(), ' start tshark'
+			tshark = Popen(callTshark, shell=True)
+
+		if session is not None:
+			# warm session of the pool in the parent process
+			print time.time(), ' attach to ', session['browser'], ' session (run ', session['runs'], ')'
+			startup.extend(session['startup'])
+			driver = attach(session)
+			logOffsets = log_offsets(session)
+		else:
+			# start display and browser
+			headless = options.get('headless', False)
+			if not headless:
+				display = start_display(windowSize, startupTimeout, startup)
+			httpLog = resultDir + prefix + ('_httpLog_C.json' if browser == "chrome" else '_httpLog_FF.txt')
+			if options.get('profile_template'):
+				profile = clone_profile(options['profile_template'], startup)
+			driver = start_browser(browser, quic, windowSize, httpLog, startupTimeout, startup, headless, profile)
 
 		# get url
 		url = 'https://www.youtube.com/watch?v=' + ytid
 
-		# select browser
-		if (browser == "chrome"):
-
-			# chrome
-			print time.time(), ' selected browser: chrome'
-
-			# define chrome settings
-			chrome_options = webdriver.ChromeOptions()
-			chrome_options.add_argument('--no-sandbox')
-			chrome_options.add_argument('--disable-dev-shm-usage')
-			chrome_options.add_argument('-log-net-log=' + resultDir + prefix + '_httpLog_C.json')
-			if (quic == False):
-				print time.time(), " -- quic disabled"
-				chrome_options.add_argument('--disable-quic')
-			else:
-				print time.time(), " -- quic enabled"
-				chrome_options.add_argument('--enable-quic')
-
-			# start chrome
-			print time.time(), ' start chrome'
-			browser = webdriver.Chrome('/usr/bin/chromedriver', chrome_options=chrome_options)
-
-		else:
-
-			# firefox
-			print time.time(), ' selected browser: firefox'
-
-			# define firefox settings
-			caps = DesiredCapabilities().FIREFOX
-			caps["pageLoadStrategy"] = "normal"  #  complete
-			#caps["pageLoadStrategy"] = "none"
-
-			# enable HTTP logging
-			#enaHttpLog = "export MOZ_LOG=timestamp,nsHttp:3"
-			#enaHttpLog2 = "export MOZ_LOG_FILE=" + resultDir + prefix + "_httpLog.txt"
-			print time.time(), ' - enable HTTP logging'
-			os.environ["MOZ_LOG"] = "timestamp,nsHttp:3"
-			os.environ["MOZ_LOG_FILE"] = resultDir + prefix + "_httpLog_FF.txt"
-			#call(enaHttpLog, shell=True)
-			#call(enaHttpLog2, shell=True)
-
-			# start firefox
-			print time.time(), ' start firefox'
-			browser = webdriver.Firefox(capabilities=caps)
-
-		# set window size
-		browser.set_window_position(0,0)
-		browser.set_window_size(3840, 2260) #7000,4000 / 5920,2880 / 3840, 2260 / 2960,1440
-		time.sleep(5)
-
 		# read in js
 		jsFile = open('/opt/monroe/getVideoInfos.js', 'r')
 		js = jsFile.read()
@@ -108,46 +277,38 @@ def run_yomo(ytid, duration, prefix, bitrates,interf,resultDir,quant1,quant2,qua
 		# open webpage
 		print time.time(), ' start video ', ytid
 		timeStartVideo = int(round(time.time() * 1000))
-		browser.get(url)
+		bufferFile = open(resultDir + prefix + '_buffer.txt', 'w')
+		bufferFile.write(str(timeStartVideo)+ '#0#0#0\n' )
+		eventsFile = open(resultDir + prefix + '_events.txt', 'w')
+		sampling = dict({'interval_ms': 1000, 'fast_interval_ms': 100, 'fast_window_ms': 3000}, **options.get('sampling', {}))
+		eventsFile.write(str(timeStartVideo) + '#sampling:' + ','.join(k + '=' + str(sampling[k]) for k in ('interval_ms', 'fast_interval_ms', 'fast_window_ms')) + '\n')
+		debugFile = open(resultDir + prefix + '_debug.txt', 'w')
+		driver.get(url)
 		# time.sleep(1)
 
 		# inject js
-		browser.execute_script(js)
-
-		#calculate duration
-		if (duration <= 0):
-			duration = browser.execute_script('return document.getElementsByTagName("video")[0].duration;');
-		time.sleep(duration)
+		driver.execute_script(js, sampling)
+		wait_for('player', lambda: driver.execute_script('return window.videomonState().attached;'), startupTimeout, startup, 0.2)
+		write_startup(resultDir + prefix + '_startup.txt', startup)
+
+		# stream measurement data to the output files until there is nothing left to measure
+		harvester = TelemetryHarvester(driver, (bufferFile, eventsFile, debugFile), options.get('drain_interval_s', 5), options.get('fsync_interval_s', 30))
+		harvester.start()
+		endReason = supervise_playback(harvester, duration, options)
+		print time.time(), " playback finished: ", endReason
+		dropped = harvester.stop()
+		if dropped:
+			print time.time(), " -- samples/events dropped in the browser: ", dropped
+		write_end_reason(eventsFile, endReason)
+		for f in (bufferFile, eventsFile, debugFile):
+			f.close()
 		filename_screenshot = resultDir + prefix + '_screenshot.png'
-		browser.get_screenshot_as_file(filename_screenshot)
+		driver.get_screenshot_as_file(filename_screenshot)
 		print time.time(), " video playback ended"
 
-		# get infos from js and write to file
-		print time.time(), " write output to file"
-
-		# print time.time(), " -- errorLog"
-		# errorLog = browser.execute_script('return document.getElementById("divLog").innerHTML;')
-		# with open(resultDir + prefix + '_errorLog.txt', 'w') as f:
-		# 	f.write(errorLog.encode("UTF-8"))
-		print time.time(), " -- debug"
-		debugLog = browser.execute_script('return document.getElementById("divLog").innerHTML;')
-		with open(resultDir + prefix + '_debug.txt', 'w') as f:
-			f.write(debugLog.encode("UTF-8"))
-
-		print time.time(), " -- measurementData"
-		out = browser.execute_script('return document.getElementById("outC").innerHTML;')
-		outE = browser.execute_script('return document.getElementById("outE").innerHTML;')
-		with open(resultDir + prefix + '_buffer.txt', 'w') as f:
-			f.write(str(timeStartVideo)+ '#0#0#0\n' )
-			f.write(out.encode("UTF-8"))
-		with open(resultDir + prefix + '_events.txt', 'w') as f:
-			f.write(outE.encode("UTF-8"))
-
-		# close browser and stop display
-		browser.close()
-		print time.time(), ' finished firefox'
-		display.stop()
-		print time.time(), 'display stopped'
+		if session is not None:
+			# the session stays open for the next run
+			driver.get('about:blank')
 
 	except Exception as e:
 		# handle exception
@@ -156,8 +317,52 @@ def run_yomo(ytid, duration, prefix, bitrates,interf,resultDir,quant1,quant2,qua
 		ts = time.time()
 		st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d_%H-%M-%S')
 		print st
-		display.stop()
-
+		failed = True
+		if harvester is not None and harvester.is_alive():
+			harvester.stopped.set()
+			harvester.join()
+		if eventsFile is not None and not eventsFile.closed:
+			write_end_reason(eventsFile, "exception")
+		for f in (bufferFile, eventsFile, debugFile):
+			if f is not None:
+				f.close()
+
+	finally:
+		if session is not None:
+			# the HTTP log of the run, also if it failed
+			if logOffsets is not None:
+				try:
+					copy_log(session, logOffsets, resultDir + prefix + ('_httpLog_C.json' if session['browser'] == "chrome" else '_httpLog_FF.txt'))
+				except Exception as e:
+					print time.time(), ' copying the HTTP log failed: ', e
+			if failed:
+				# the pool discards the session instead of handing it out again
+				mark_failed(session)
+		else:
+			# close browser and stop display
+			if driver is not None:
+				try:
+					driver.quit()
+					print time.time(), ' finished browser'
+				except Exception as e:
+					print time.time(), ' quitting the browser failed: ', e
+			if display is not None:
+				try:
+					display.stop()
+					print time.time(), 'display stopped'
+				except Exception as e:
+					print time.time(), ' stopping the display failed: ', e
+		stop_capture(tshark, afpacket, dumpcap)
+		dissect_capture(dumpcap, resultDir, prefix, options)
+
+	if profile is not None:
+		shutil.rmtree(profile, ignore_errors=True)
+
+	# QoE summary from the buffer and event logs
+	try:
+		return summarize(resultDir + prefix, bitrates, (quant1, quant2, quant3, quant4), options.get('out_fields'))
+	except Exception as e:
+		print time.time(), ' QoE summary failed: ', e
 
 	return ""
 
@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Browser startup for run_yomo and a pool of WebDriver sessions.
+
+Browsers run on an Xvfb display (pyvirtualdisplay) or, with headless=True,
+in the browsers' own headless mode (Chrome --headless, Firefox MOZ_HEADLESS)
+without any X server. Both modes write the same logs and screenshots and
+use the same browser flags apart from the display ones, so the player
+behaves the same.
+
+Without the pool every run_yomo call starts Xvfb, the driver and the browser
+and tears them down again. The SessionPool lives in the parent process
+(videomon_start main loop) and keeps one session per (browser, QUIC flag,
+window size, headless). The experiment process attaches to the running session with the
+executor URL and session id (attach()), so the browser survives the
+experiment process.
+
+Between two runs a session is reset according to the policy:
+    cold    restart the driver and the browser on a new clone of the profile
+            template; only the Xvfb display is kept. Every run starts with a
+            new browser process, as without the pool.
+    clear   keep the browser, delete all cookies, the HTTP cache and the
+            storage of the video origins (Chrome DevTools commands); where
+            that is not supported (Firefox, old chromedriver) the browser is
+            restarted as with cold
+    warm    keep the browser, only navigate to about:blank; cookies, cache
+            and storage are kept
+
+clear and warm keep the browser process, and with it Chrome's socket pools,
+QUIC/TLS sessions and host (DNS) cache: the next run may reuse open
+connections and cached name resolutions, which lowers its initial delay.
+They are for experiments on warm browsers only. The pool must not outlive a
+change of the network path either way; videomon_start stops all sessions
+(stop_all()) before it moves the default route to the next interface.
+
+The HTTP log of a pooled browser is written to one file per session. run_yomo
+copies the part written during its run to the usual <prefix>_httpLog_* file
+(log_offsets(), copy_log()); the Chrome net-log constants are copied as well,
+so the per-run file reads as a truncated net-log.
+
+Profile templates: build_profile_template() starts a browser once on an
+empty profile (Firefox installs the bundled extension and applies the
+autoconfig on this first start) and then removes everything a measurement
+must not inherit: caches, cookies, storage, history and remembered server
+properties (alt-svc/QUIC, HSTS). Every browser start gets its own clone of
+the template (clone_profile(), cp --reflink=auto: copy-on-write where the
+file system supports it, a plain copy otherwise). Hardlinks are not used,
+the browsers rewrite their SQLite files in place and would change the
+template.
+
+A session whose experiment exceeded exp_grace is discarded: the driver, the
+browser and all their child processes are killed, then Xvfb is stopped.
+
+--bench starts each browser with Xvfb and headless and reports the startup
+time and the memory (PSS) of the browser, driver and Xvfb processes after
+loading a page, plus the /dev/shm use.
+
+Usage:
+    webdriver_pool.py --bench [runs] [url]
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import signal
+import tempfile
+from collections import OrderedDict
+from subprocess import check_call
+
+from pyvirtualdisplay import Display
+from selenium import webdriver
+from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
+# Xvfb screen is a bit larger than the browser window
+DISPLAY_MARGIN = (160, 140)
+
+# removed from profile templates, so that every clone starts cold
+TEMPLATE_CLEAN = {
+    'chrome': ['Default/Cache', 'Default/Code Cache', 'Default/GPUCache', 'Default/Media Cache',
+               'Default/Cookies*', 'Default/Local Storage', 'Default/Session Storage', 'Default/IndexedDB',
+               'Default/Service Worker', 'Default/History*', 'Default/Visited Links', 'Default/Current *',
+               'Default/Last *', 'Default/Sessions', 'Default/Network Persistent State', 'Default/TransportSecurity',
+               'ShaderCache', 'Singleton*'],
+    'firefox': ['cache2', 'cookies.sqlite*', 'webappsstore.sqlite*', 'storage', 'places.sqlite*', 'favicons.sqlite*',
+                'sessionstore*', 'AlternateServices.txt', 'SiteSecurityServiceState.txt', 'lock', '.parentlock'],
+}
+
+# origins whose storage is cleared by the cold reset
+RESET_ORIGINS = ['https://www.youtube.com', 'https://m.youtube.com', 'https://accounts.google.com']
+
+def wait_for(name, check, timeout, timings, interval=0.05):
+    # poll check() until it is true or timeout seconds passed; the waiting time goes to timings
+    timeStart = time.time()
+    ready = False
+    while True:
+        try:
+            ready = bool(check())
+        except Exception:
+            ready = False
+        if ready or time.time() - timeStart >= timeout:
+            break
+        time.sleep(interval)
+    timings.append((name, time.time() - timeStart, ready))
+    print time.time(), " -- ", name, "ready" if ready else "timed out", "after %.2f s" % timings[-1][1]
+    return ready
+
+def start_display(window_size, timeout, timings):
+    """Start Xvfb and wait for its X socket."""
+    display = Display(visible=0, size=(window_size[0] + DISPLAY_MARGIN[0], window_size[1] + DISPLAY_MARGIN[1]))
+    print time.time(), ' start display'
+    display.start()
+    xSocket = '/tmp/.X11-unix/X' + str(getattr(display, 'display', os.environ.get('DISPLAY', ':0').lstrip(':')))
+    wait_for('display', lambda: os.path.exists(xSocket), timeout, timings)
+    return display
+
+def start_browser(browser, quic, window_size, httpLog, timeout, timings, headless=False, profile=None):
+    """Start chrome or firefox on the current display (or headless) with the HTTP log written to httpLog.
+
+       profile: profile directory (e.g. from clone_profile()), default: a new empty one
+    """
+    if (browser == "chrome"):
+
+        # chrome
+        print time.time(), ' selected browser: chrome'
+
+        # define chrome settings
+        chrome_options = webdriver.ChromeOptions()
+        chrome_options.add_argument('--no-sandbox')
+        chrome_options.add_argument('--disable-dev-shm-usage')
+        chrome_options.add_argument('-log-net-log=' + httpLog)
+        if (quic == False):
+            print time.time(), " -- quic disabled"
+            chrome_options.add_argument('--disable-quic')
+        else:
+            print time.time(), " -- quic enabled"
+            chrome_options.add_argument('--enable-quic')
+        if headless:
+            print time.time(), " -- headless"
+            chrome_options.add_argument('--headless')
+            chrome_options.add_argument('--disable-gpu')
+            chrome_options.add_argument('--window-size={},{}'.format(window_size[0], window_size[1]))
+        if profile:
+            chrome_options.add_argument('--user-data-dir=' + profile)
+
+        # start chrome
+        print time.time(), ' start chrome'
+        timeStart = time.time()
+        driver = webdriver.Chrome('/usr/bin/chromedriver', chrome_options=chrome_options)
+
+    else:
+
+        # firefox
+        print time.time(), ' selected browser: firefox'
+
+        # define firefox settings
+        caps = DesiredCapabilities.FIREFOX.copy()
+        caps["pageLoadStrategy"] = "normal"  #  complete
+        if profile:
+            # used in place by geckodriver (a FirefoxProfile would be copied again)
+            caps["moz:firefoxOptions"] = {"args": ["-profile", profile]}
+
+        # enable HTTP logging
+        print time.time(), ' - enable HTTP logging'
+        os.environ["MOZ_LOG"] = "timestamp,nsHttp:3"
+        os.environ["MOZ_LOG_FILE"] = httpLog
+        if headless:
+            print time.time(), " -- headless"
+            os.environ["MOZ_HEADLESS"] = "1"
+            os.environ["MOZ_HEADLESS_WIDTH"] = str(window_size[0])
+            os.environ["MOZ_HEADLESS_HEIGHT"] = str(window_size[1])
+        else:
+            os.environ.pop("MOZ_HEADLESS", None)
+
+        # start firefox
+        print time.time(), ' start firefox'
+        timeStart = time.time()
+        driver = webdriver.Firefox(capabilities=caps)
+    timings.append(('browser', time.time() - timeStart, True))
+    print time.time(), " -- browser started after %.2f s" % timings[-1][1]
+
+    # set window size
+    driver.set_window_position(0, 0)
+    driver.set_window_size(window_size[0], window_size[1])
+    wait_for('window', lambda: driver.get_window_size() == {'width': window_size[0], 'height': window_size[1]}, timeout, timings)
+    return driver
+
+def build_profile_template(browser, path, timeout=30):
+    """Create the profile template of browser at path; returns the seconds it took."""
+    timeStart = time.time()
+    build = path + '.build'
+    shutil.rmtree(build, ignore_errors=True)
+    os.makedirs(build)
+    try:
+        driver = start_browser(browser, True, (800, 600), os.path.join(build, 'httpLog'), timeout, [], True, build)
+        try:
+            driver.get('about:blank')
+        finally:
+            driver.quit()
+        for pattern in TEMPLATE_CLEAN[browser] + ['httpLog*']:
+            for p in glob.glob(os.path.join(build, pattern)):
+                if os.path.isdir(p) and not os.path.islink(p):
+                    shutil.rmtree(p)
+                else:
+                    os.remove(p)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(build, path)
+    except Exception:
+        shutil.rmtree(build, ignore_errors=True)
+        raise
+    return time.time() - timeStart
+
+def clone_profile(template, timings):
+    """Copy-on-write clone of a profile template in a new temporary directory."""
+    timeStart = time.time()
+    path = tempfile.mkdtemp(prefix='profile_')
+    check_call(['cp', '-a', '--reflink=auto', os.path.join(template, '.'), path])
+    timings.append(('profile', time.time() - timeStart, True))
+    return path
+
+def _children():
+    """ppid -> [pid] of all processes."""
+    children = {}
+    for stat in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat) as f:
+                # the command name may contain spaces, the fields after it don't
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (IOError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.split('/')[2]))
+    return children
+
+def process_tree(pid):
+    """pid and all its descendants."""
+    children = _children()
+    pids = [pid]
+    for p in pids:
+        pids.extend(children.get(p, []))
+    return pids
+
+def kill_tree(pid):
+    """SIGKILL pid and all its descendants."""
+    for p in process_tree(pid):
+        try:
+            os.kill(p, signal.SIGKILL)
+        except OSError:
+            pass
+
+class AttachedDriver(webdriver.Remote):
+    """Remote driver using an existing session instead of creating one."""
+
+    def __init__(self, executor, session_id, w3c):
+        self._attach = (session_id, w3c)
+        webdriver.Remote.__init__(self, command_executor=executor, desired_capabilities={})
+
+    def start_session(self, *args, **kwargs):
+        self.session_id, self.w3c = self._attach
+        self.capabilities = {}
+
+    def quit(self):
+        # the session belongs to the pool
+        pass
+
+def attach(session):
+    """Driver for a session handed out by SessionPool.acquire()."""
+    return AttachedDriver(session['executor'], session['session_id'], session['w3c'])
+
+def mark_failed(session):
+    """Tell the pool that the run failed, release() then discards the session."""
+    open(session['failed'], 'w').close()
+
+def log_offsets(session):
+    """Current sizes of the session's HTTP log files."""
+    return dict((path, os.path.getsize(path)) for path in glob.glob(session['http_log'] + '*'))
+
+def copy_log(session, offsets, path):
+    """Copy what the session logged since log_offsets() to path, starting at whole lines."""
+    with open(path, 'wb') as out:
+        for log in sorted(glob.glob(session['http_log'] + '*')):
+            with open(log, 'rb') as f:
+                start = offsets.get(log, 0)
+                if session['browser'] == 'chrome':
+                    # net-log constants, up to the line opening the events list
+                    head = f.read(1 << 20)
+                    events = head.find(b'"events"')
+                    if events < 0 or head.find(b'\n', events) < 0:
+                        continue
+                    header = head.find(b'\n', events) + 1
+                    out.write(head[:header])
+                    start = max(start, header)
+                f.seek(start)
+                if start:
+                    # skip the rest of a line written before the run
+                    f.seek(start - 1)
+                    f.readline()
+                shutil.copyfileobj(f, out)
+
+class SessionPool(object):
+    """WebDriver sessions (display and browser) keyed by (browser, quic, window size, headless)."""
+
+    def __init__(self, policy='cold', size=2, timeout=30, templates=None):
+        # templates: browser -> profile template directory
+        self.policy = policy
+        self.templates = templates or {}
+        self.size = size
+        self.timeout = timeout
+        self.workdir = tempfile.mkdtemp(prefix='webdriver_pool_')
+        self.sessions = OrderedDict()
+        self.count = 0
+
+    def _start(self, key, display=None):
+        browser, quic, window_size, headless = key
+        timings = []
+        if display is None and not headless:
+            display = start_display(window_size, self.timeout, timings)
+        self.count += 1
+        httpLog = os.path.join(self.workdir, 'session{}_httpLog_{}'.format(self.count, 'C.json' if browser == 'chrome' else 'FF.txt'))
+        profile = None
+        try:
+            if browser in self.templates:
+                profile = clone_profile(self.templates[browser], timings)
+            driver = start_browser(browser, quic, window_size, httpLog, self.timeout, timings, headless, profile)
+        except Exception:
+            if profile is not None:
+                shutil.rmtree(profile, ignore_errors=True)
+            if display is not None:
+                display.stop()
+            raise
+        return {'key': key, 'display': display, 'driver': driver, 'profile': profile, 'http_log': httpLog, 'timings': timings, 'runs': 0}
+
+    def _stop(self, entry, display=True):
+        try:
+            kill_tree(entry['driver'].service.process.pid)
+        except Exception:
+            pass
+        if entry['profile'] is not None:
+            shutil.rmtree(entry['profile'], ignore_errors=True)
+        if display and entry['display'] is not None:
+            try:
+                entry['display'].stop()
+            except Exception:
+                pass
+
+    def _reset(self, entry):
+        """Reset between runs; returns False if the browser has to be restarted."""
+        if self.policy not in ('clear', 'warm'):
+            # cold: a new browser process
+            return False
+        driver = entry['driver']
+        driver.get('about:blank')
+        if self.policy == 'warm':
+            return True
+        if entry['key'][0] != 'chrome':
+            return False
+        # DevTools commands through chromedriver, also without selenium's execute_cdp_cmd
+        driver.command_executor._commands['videomonCdp'] = ('POST', '/session/$sessionId/goog/cdp/execute')
+        def cdp(cmd, params=None):
+            driver.execute('videomonCdp', {'cmd': cmd, 'params': params or {}})
+        try:
+            cdp('Network.clearBrowserCookies')
+            cdp('Network.clearBrowserCache')
+            for origin in RESET_ORIGINS:
+                cdp('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+        except Exception as e:
+            print time.time(), " -- clearing the browser failed, restarting it: ", e
+            return False
+        return True
+
+    def acquire(self, browser, quic, window_size, headless=False):
+        """Return the session info (picklable) for attach() in the experiment process."""
+        key = (browser, bool(quic), tuple(window_size), bool(headless))
+        entry = self.sessions.pop(key, None)
+        if entry is not None:
+            timeStart = time.time()
+            try:
+                reset = self._reset(entry)
+            except Exception as e:
+                print time.time(), " -- session reset failed: ", e
+                reset = False
+            entry['timings'] = [('reset', time.time() - timeStart, reset)]
+            if not reset:
+                self._stop(entry, display=False)
+                entry = self._start(key, entry['display'])
+        else:
+            # keep at most size sessions, the least recently used one goes
+            while self.sessions and len(self.sessions) >= self.size:
+                self._stop(self.sessions.popitem(last=False)[1])
+            entry = self._start(key)
+        self.sessions[key] = entry
+        entry['runs'] += 1
+        driver = entry['driver']
+        return {'browser': browser,
+                'executor': driver.command_executor._url,
+                'session_id': driver.session_id,
+                'w3c': getattr(driver, 'w3c', False),
+                'http_log': entry['http_log'],
+                'startup': entry['timings'],
+                'runs': entry['runs'],
+                'failed': os.path.join(self.workdir, 'session{}_run{}_failed'.format(self.count, entry['runs']))}
+
+    def release(self, session):
+        """End of the run of an acquired session; discards it if the run called mark_failed()."""
+        if not os.path.exists(session['failed']):
+            return
+        os.remove(session['failed'])
+        for key, entry in self.sessions.items():
+            if entry['driver'].session_id == session['session_id']:
+                del self.sessions[key]
+                self._stop(entry)
+
+    def discard(self, browser, quic, window_size, headless=False):
+        """Kill the session, e.g. after its experiment was terminated."""
+        entry = self.sessions.pop((browser, bool(quic), tuple(window_size), bool(headless)), None)
+        if entry is not None:
+            self._stop(entry)
+
+    def stop_all(self):
+        """Kill all sessions, the pool stays usable."""
+        while self.sessions:
+            self._stop(self.sessions.popitem()[1])
+
+    def close(self):
+        self.stop_all()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+def _pss_kb(pid):
+    """Proportional set size of a process (RSS on kernels without smaps_rollup)."""
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+def _shm_used_kb():
+    st = os.statvfs('/dev/shm')
+    return (st.f_blocks - st.f_bfree) * st.f_frsize // 1024
+
+def benchmark(runs, url, window_size=(3840, 2260)):
+    """Startup time and memory of chrome and firefox with Xvfb and headless."""
+    workdir = tempfile.mkdtemp(prefix='webdriver_bench_')
+    print("{:8} {:9} {:>10} {:>10} {:>10} {:>10}".format('browser', 'mode', 'startup_s', 'pss_mb', 'xvfb_mb', 'shm_mb'))
+    try:
+        for browser in ('chrome', 'firefox'):
+            for headless in (False, True):
+                mode = 'headless' if headless else 'xvfb'
+                results = []
+                for i in range(runs):
+                    shm = _shm_used_kb()
+                    timings = []
+                    display = None
+                    driver = None
+                    timeStart = time.time()
+                    try:
+                        if not headless:
+                            display = start_display(window_size, 30, timings)
+                        driver = start_browser(browser, True, window_size, os.path.join(workdir, 'httpLog'), 30, timings, headless)
+                        startup = time.time() - timeStart
+                        driver.get(url)
+                        time.sleep(5)
+                        pss = sum(_pss_kb(p) for p in process_tree(driver.service.process.pid))
+                        xvfb = 0
+                        if display is not None:
+                            xvfb = sum(_pss_kb(p) for p in process_tree(getattr(display, 'pid', None) or display.proc.pid))
+                        results.append((startup, pss / 1024.0, xvfb / 1024.0, (_shm_used_kb() - shm) / 1024.0))
+                    except Exception as e:
+                        print("{} {} failed: {}".format(browser, mode, e))
+                    finally:
+                        if driver is not None:
+                            kill_tree(driver.service.process.pid)
+                        if display is not None:
+                            display.stop()
+                if results:
+                    mean = [sum(r[j] for r in results) / len(results) for j in range(4)]
+                    print("{:8} {:9} {:10.2f} {:10.1f} {:10.1f} {:10.1f}".format(browser, mode, *mean))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 3, sys.argv[3] if len(sys.argv) > 3 else 'https://www.youtube.com/watch?v=R6MlUcmOul8')
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Binary format for the YoMo buffer and event logs (<prefix>_buffer.txt,
+<prefix>_events.txt), written to <prefix>_yomo.bin.
+
+Buffer samples are fixed-width records of SAMPLE_FIELDS float64 values (NaN
+where a value was not recorded; samples of older logs have no frame
+counters). Events are a float64 time column and a uint32 code column; the
+code indexes the interned event texts (e.g. "playing", "quality:720p
+(1280x720)") in the header. The time the video URL was requested, written
+as first buffer line "<time>#0#0#0" in the text log, is a header field.
+
+File layout:
+    magic 'YOMOBIN\\0', uint32 header length, JSON header (version, byte
+    order, request time, sampling intervals, sample fields, column
+    offsets/types, event texts), then the columns, each starting at a
+    multiple of 8 bytes.
+
+Usage:
+    yomo_binary.py convert <resultdir>/<prefix> [<output.bin>]
+    yomo_binary.py convert-all <directory>
+    yomo_binary.py dump <prefix>_yomo.bin
+"""
+
+import os
+import sys
+import json
+import mmap
+import glob
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+VERSION = 1
+MAGIC = b'YOMOBIN\0'
+HEADER_LENGTH = struct.Struct('<I')
+
+SAMPLE_FIELDS = ['time', 'current_time', 'buffered', 'available', 'total_frames', 'dropped_frames', 'corrupted_frames']
+NUMPY_TYPES = {'d': np.float64, 'I': np.uint32} if np is not None else {}
+
+def _parse_buffer(f):
+    """Return (request time ms, flat array 'd' of the samples)."""
+    request = None
+    samples = array('d')
+    nan = float('nan')
+    for line in f:
+        fields = line.strip().split('#')
+        if len(fields) not in (4, len(SAMPLE_FIELDS)):
+            continue
+        try:
+            values = [float(v) for v in fields]
+        except ValueError:
+            continue
+        if request is None:
+            request = values[0]
+            continue
+        samples.extend(values + [nan] * (len(SAMPLE_FIELDS) - len(values)))
+    return request, samples
+
+def _parse_events(f):
+    """Return (times 'd', codes 'I', texts); texts are the interned event texts."""
+    times = array('d')
+    codes = array('I')
+    texts = []
+    ids = {}
+    for line in f:
+        fields = line.rstrip('\r\n').split('#', 1)
+        if len(fields) != 2:
+            continue
+        try:
+            times.append(float(fields[0]))
+        except ValueError:
+            continue
+        text = fields[1]
+        if text not in ids:
+            ids[text] = len(texts)
+            texts.append(text)
+        codes.append(ids[text])
+    return times, codes, texts
+
+def _sampling(texts):
+    """Sampling intervals of the 'sampling:interval_ms=..,..' event, if any."""
+    for text in texts:
+        if text.startswith('sampling:'):
+            return dict((k, float(v)) for k, _, v in (item.partition('=') for item in text[len('sampling:'):].split(',')) if v)
+    return None
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % 8))
+
+def convert(path_prefix, bin_path=None):
+    """Convert <prefix>_buffer.txt and <prefix>_events.txt into the binary format; returns the output path."""
+    if bin_path is None:
+        bin_path = path_prefix + '_yomo.bin'
+    with open(path_prefix + '_buffer.txt') as f:
+        request, samples = _parse_buffer(f)
+    times, codes, texts = array('d'), array('I'), []
+    if os.path.exists(path_prefix + '_events.txt'):
+        with open(path_prefix + '_events.txt') as f:
+            times, codes, texts = _parse_events(f)
+    blocks = [('samples', 'd', samples), ('event_time', 'd', times), ('event_code', 'I', codes)]
+    columns = {}
+    offset = 0
+    for name, code, data in blocks:
+        size = len(data) * data.itemsize
+        columns[name] = {'type': code, 'offset': offset, 'count': len(data)}
+        offset += size + (-size % 8)
+    header = json.dumps({'version': VERSION,
+                         'byteorder': sys.byteorder,
+                         'request_time_ms': request,
+                         'sampling': _sampling(texts),
+                         'sample_fields': SAMPLE_FIELDS,
+                         'columns': columns,
+                         'event_texts': texts}).encode('utf-8')
+    tmp = bin_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+        _pad(f)
+        for name, code, data in blocks:
+            data.tofile(f)
+            _pad(f)
+    os.rename(tmp, bin_path)
+    return bin_path
+
+class YomoRecording(object):
+    """Memory-mapped file written by convert().
+
+       recording.samples is a (rows, SAMPLE_FIELDS) numpy view of the file
+       (a flat array.array without numpy), recording.event_time and
+       recording.event_code the event columns, recording.event_texts the
+       texts of the codes.
+    """
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise Exception('Invalid YoMo binary file: ' + path)
+        length = HEADER_LENGTH.unpack_from(self.mm, len(MAGIC))[0]
+        start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(self.mm[start:start + length].decode('utf-8'))
+        if header['version'] > VERSION:
+            raise Exception('Unsupported YoMo binary version {}: {}'.format(header['version'], path))
+        self.base = start + length + (-(start + length) % 8)
+        self.byteorder = header['byteorder']
+        self.request_time_ms = header['request_time_ms']
+        self.sampling = header['sampling']
+        self.sample_fields = header['sample_fields']
+        self.columns = header['columns']
+        self.event_texts = header['event_texts']
+        self.cache = {}
+
+    def _column(self, name):
+        if name not in self.cache:
+            column = self.columns[name]
+            offset = self.base + column['offset']
+            if np is not None:
+                dtype = np.dtype(NUMPY_TYPES[column['type']]).newbyteorder('<' if self.byteorder == 'little' else '>')
+                data = np.frombuffer(self.mm, dtype=dtype, count=column['count'], offset=offset)
+            else:
+                data = array(column['type'])
+                (getattr(data, 'frombytes', None) or data.fromstring)(self.mm[offset:offset + column['count'] * data.itemsize])
+                if self.byteorder != sys.byteorder:
+                    data.byteswap()
+            self.cache[name] = data
+        return self.cache[name]
+
+    @property
+    def samples(self):
+        data = self._column('samples')
+        if np is not None:
+            return data.reshape(-1, len(self.sample_fields))
+        return data
+
+    @property
+    def event_time(self):
+        return self._column('event_time')
+
+    @property
+    def event_code(self):
+        return self._column('event_code')
+
+    def events(self):
+        """(times, names, values) as yomo_qoe.read_events() returns them."""
+        names = []
+        values = []
+        for text in self.event_texts:
+            if not isinstance(text, str):
+                # python 2: numpy str arrays hold bytes
+                text = text.encode('utf-8')
+            name, _, value = text.partition(':')
+            names.append(name)
+            values.append(value.split(' ', 1)[0])
+        codes = self.event_code
+        return self.event_time, np.array(names, dtype=str)[codes], np.array(values, dtype=str)[codes]
+
+    def close(self):
+        self.cache = {}
+        try:
+            self.mm.close()
+        except Exception as e:
+            # numpy views still reference the map, it is unmapped with them
+            pass
+        self.f.close()
+
+def convert_all(directory):
+    """Convert every <prefix>_buffer.txt below directory that has no _yomo.bin yet; returns the new files."""
+    converted = []
+    for root, dirs, files in os.walk(directory):
+        for buffer_file in glob.glob(os.path.join(root, '*_buffer.txt')):
+            prefix = buffer_file[:-len('_buffer.txt')]
+            if not os.path.exists(prefix + '_yomo.bin'):
+                converted.append(convert(prefix))
+    return converted
+
+def dump(path):
+    """Write the recording as the text logs to stdout."""
+    recording = YomoRecording(path)
+    try:
+        if recording.request_time_ms is not None:
+            print('{:.0f}#0#0#0'.format(recording.request_time_ms))
+        width = len(recording.sample_fields)
+        samples = recording.samples
+        rows = len(samples) if np is not None else len(samples) // width
+        for i in range(rows):
+            row = samples[i] if np is not None else samples[i * width:(i + 1) * width]
+            print('#'.join('NaN' if v != v else '{:.15g}'.format(v) for v in row))
+        for t, code in zip(recording.event_time, recording.event_code):
+            print('{:.0f}#{}'.format(t, recording.event_texts[code]))
+    finally:
+        recording.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) in (3, 4) and sys.argv[1] == 'convert':
+        print(convert(*sys.argv[2:]))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'convert-all':
+        for path in convert_all(sys.argv[2]):
+            print(path)
+    elif len(sys.argv) == 3 and sys.argv[1] == 'dump':
+        dump(sys.argv[2])
+    else:
+        print(__doc__)
+        sys.exit(1)
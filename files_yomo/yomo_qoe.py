@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+QoE summary of a YoMo playback from <prefix>_buffer.txt and <prefix>_events.txt.
+
+buffer.txt: first line "<time the URL was requested>#0#0#0", then the samples
+"<time ms>#<currentTime s>#<buffered s>#<available playback time s>#<total frames>#<dropped frames>#<corrupted frames>"
+(frame counters of getVideoPlaybackQuality(), NaN if not reported; older
+files have the first four values only), once per
+interval_ms and once per fast_interval_ms for fast_window_ms around stalls,
+playback starts and resolution changes.
+events.txt: first line "<time ms>#sampling:interval_ms=..,fast_interval_ms=..,fast_window_ms=..",
+then "<time ms>#<event>" for player events (playing, waiting, ended, ...)
+and "<time ms>#quality:<height>p (<width>x<height>)" on resolution changes.
+
+Computed metrics (field names as used in cnf_yomo_out_fields):
+    yomo_initial_delay_ms     URL request until the first "playing"
+    yomo_stall_count          "waiting" after playback started, until the next "playing"
+    yomo_stall_duration_ms    total duration of these stalls
+    yomo_quality_switches     resolution changes (ignoring 0p before the first frame)
+    yomo_avg_bitrate_kbps     time weighted bitrate of the played resolutions (cnf_yomo_bitrates_kbps)
+    yomo_playback_s           first "playing" until "ended" or the last sample
+    yomo_time_<res>_s         time spent at each resolution, e.g. yomo_time_720p_s (0 for unplayed ones)
+    yomo_buffer_q1_s..q4_s    buffer level quantiles at cnf_q1..cnf_q4 (percent) during playback,
+                              each sample weighted with the time until the next one
+    yomo_end_reason           why run_yomo ended the playback: ended, error, no_progress, duration or exception
+    yomo_dropped_rate         dropped / total decoded frames during playback
+    yomo_corrupted_frames     corrupted frames (NA where the browser doesn't count them)
+    yomo_render_bottleneck    1 if yomo_dropped_rate >= BOTTLENECK_DROPPED_RATE: the node could not
+                              render the video in time, stalls and quality need not be the network's fault
+    yomo_dropped_rate_<res>   dropped frame rate at each resolution, e.g. yomo_dropped_rate_720p
+
+The logs can also be read from <prefix>_yomo.bin (see yomo_binary.py).
+
+Usage:
+    yomo_qoe.py <resultdir>/<prefix> [q1,q2,q3,q4]
+"""
+
+import os
+import sys
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# dropped frame rate from which a run counts as rendering bound
+BOTTLENECK_DROPPED_RATE = 0.1
+
+DEFAULT_BITRATES = "144p:114.792,240p:250.618,360p:606.343,480p:1166.528,720p:2213.150,1080p:4018.795,1440p:9489.022,2160p:21322.799"
+
+def parse_bitrates(bitrates):
+    """"144p:114.792,240p:250.618,..." -> {'144p': 114.792, ...}"""
+    result = {}
+    for entry in bitrates.split(','):
+        if ':' in entry:
+            label, kbps = entry.split(':', 1)
+            result[label.strip()] = float(kbps)
+    return result
+
+def out_fields(bitrates=DEFAULT_BITRATES):
+    """All field names computed for the resolutions of the bitrate ladder."""
+    labels = sorted(parse_bitrates(bitrates), key=lambda l: int(l.rstrip('p')))
+    return (['yomo_initial_delay_ms', 'yomo_stall_count', 'yomo_stall_duration_ms', 'yomo_quality_switches',
+             'yomo_avg_bitrate_kbps', 'yomo_playback_s'] +
+            ['yomo_time_{}_s'.format(label) for label in labels] +
+            ['yomo_buffer_q{}_s'.format(i) for i in range(1, 5)] +
+            ['yomo_end_reason', 'yomo_dropped_rate', 'yomo_corrupted_frames', 'yomo_render_bottleneck'] +
+            ['yomo_dropped_rate_{}'.format(label) for label in labels])
+
+def read_buffer(path):
+    """Return (request time ms, samples) with one row time, current, buffered, available,
+       total, dropped, corrupted frames per sample (NaN where not recorded)."""
+    rows = []
+    with open(path) as f:
+        for line in f:
+            fields = line.strip().split('#')
+            if len(fields) in (4, 7):
+                try:
+                    rows.append([float(v) for v in fields] + [float('nan')] * (7 - len(fields)))
+                except ValueError:
+                    pass
+    if not rows:
+        return None, np.zeros((0, 7))
+    return rows[0][0], np.array(rows[1:]).reshape(-1, 7)
+
+def read_events(path):
+    """Return (times ms, event names, values); the value is the part after ':' (e.g. '720p')."""
+    times = []
+    names = []
+    values = []
+    with open(path) as f:
+        for line in f:
+            fields = line.strip().split('#', 1)
+            if len(fields) != 2:
+                continue
+            try:
+                times.append(float(fields[0]))
+            except ValueError:
+                continue
+            name, _, value = fields[1].partition(':')
+            names.append(name)
+            values.append(value.split(' ', 1)[0])
+    return np.array(times), np.array(names, dtype=str), np.array(values, dtype=str)
+
+def weighted_percentile(values, weights, quantiles):
+    """Percentiles of values, each value counting with its weight."""
+    order = np.argsort(values)
+    values = values[order]
+    cumulative = np.cumsum(weights[order])
+    if cumulative[-1] <= 0:
+        return np.percentile(values, quantiles)
+    # the value holding the middle of each weight
+    centers = (cumulative - weights[order] / 2.0) / cumulative[-1] * 100
+    return np.interp(quantiles, centers, values)
+
+def read_binary(path):
+    """read_buffer() and read_events() of a yomo_binary file: (request, samples, times, names, values)."""
+    from yomo_binary import YomoRecording
+    recording = YomoRecording(path)
+    try:
+        samples = np.array(recording.samples)
+        if samples.shape[1] < 7:
+            samples = np.hstack((samples, np.full((len(samples), 7 - samples.shape[1]), np.nan)))
+        t, names, values = recording.events()
+        return recording.request_time_ms, samples, np.array(t), names, values
+    finally:
+        recording.close()
+
+def compute(buffer_path, events_path, bitrates=DEFAULT_BITRATES, quantiles=(25, 50, 75, 90)):
+    """Compute the QoE metrics; returns a dict field -> value (None if not available).
+
+       buffer_path may also be a yomo_binary file (events_path is not used then).
+    """
+    if np is None:
+        raise ImportError('QoE analysis requires numpy')
+    if buffer_path.endswith('.bin'):
+        request, samples, t, names, values = read_binary(buffer_path)
+    else:
+        request, samples = read_buffer(buffer_path)
+        t, names, values = read_events(events_path)
+    metrics = dict((field, None) for field in out_fields(bitrates))
+    end_reason = values[names == 'videomon_end']
+    if len(end_reason):
+        metrics['yomo_end_reason'] = end_reason[-1]
+
+    playing = t[names == 'playing']
+    if len(playing):
+        play_start = playing[0]
+    elif np.any(samples[:, 1] > 0):
+        play_start = samples[samples[:, 1] > 0, 0][0]
+    else:
+        return metrics
+    ended = t[(names == 'ended') & (t >= play_start)]
+    ends = [samples[-1, 0]] if len(samples) else []
+    play_end = ended[0] if len(ended) else max(ends + [t.max() if len(t) else play_start])
+    if request is not None:
+        metrics['yomo_initial_delay_ms'] = int(play_start - request)
+    metrics['yomo_playback_s'] = round((play_end - play_start) / 1000.0, 3)
+    rates = parse_bitrates(bitrates)
+    for label in rates:
+        metrics['yomo_time_{}_s'.format(label)] = 0.0
+
+    # a stall lasts from "waiting" to the next "playing" (or the end), repeated waits belong to one stall
+    waiting = t[(names == 'waiting') & (t > play_start) & (t < play_end)]
+    later = playing[playing > play_start]
+    if len(later):
+        idx = np.searchsorted(later, waiting, side='right')
+        stall_end = np.where(idx < len(later), later[np.minimum(idx, len(later) - 1)], play_end)
+    else:
+        stall_end = np.full(len(waiting), play_end)
+    stall_end, first = np.unique(stall_end, return_index=True)
+    stall_duration = np.clip(stall_end - waiting[first], 0, None)
+    metrics['yomo_stall_count'] = len(stall_duration)
+    metrics['yomo_stall_duration_ms'] = int(np.sum(stall_duration))
+
+    quality = (names == 'quality') & (values != '0p')
+    quality_t = t[quality]
+    quality_v = values[quality]
+    metrics['yomo_quality_switches'] = int(np.count_nonzero(quality_v[1:] != quality_v[:-1]))
+    segment_start = np.clip(quality_t, play_start, play_end)
+    segment_end = np.clip(np.r_[quality_t[1:], play_end], play_start, play_end)
+    duration = (segment_end - segment_start) / 1000.0
+    for label in np.unique(quality_v):
+        metrics['yomo_time_{}_s'.format(label)] = round(float(np.sum(duration[quality_v == label])), 3)
+    known = np.array([v in rates for v in quality_v], dtype=bool)
+    if np.sum(duration[known]) > 0:
+        kbps = np.array([rates.get(v, 0.0) for v in quality_v])
+        metrics['yomo_avg_bitrate_kbps'] = round(float(np.sum(duration[known] * kbps[known]) / np.sum(duration[known])), 3)
+
+    # frames decoded between two samples count for the resolution at the later one
+    counted = samples[(samples[:, 0] <= play_end) & np.isfinite(samples[:, 4])]
+    if len(counted) > 1:
+        step = np.diff(counted[:, 4:7], axis=0)
+        # the counters restart with a new media element (corrupted frames may be NaN)
+        with np.errstate(invalid='ignore'):
+            step = np.where(step < 0, counted[1:, 4:7], step)
+        at = np.searchsorted(quality_t, counted[1:, 0], side='right') - 1
+        label = np.where(at >= 0, quality_v[np.maximum(at, 0)] if len(quality_v) else '', '')
+        total = np.sum(step[:, 0])
+        if total > 0:
+            rate = np.sum(step[:, 1]) / total
+            metrics['yomo_dropped_rate'] = round(float(rate), 4)
+            metrics['yomo_render_bottleneck'] = int(rate >= BOTTLENECK_DROPPED_RATE)
+        if np.any(np.isfinite(step[:, 2])):
+            metrics['yomo_corrupted_frames'] = int(np.nansum(step[:, 2]))
+        for res in np.unique(label[label != '']):
+            frames = np.sum(step[label == res, 0])
+            if frames > 0:
+                metrics['yomo_dropped_rate_{}'.format(res)] = round(float(np.sum(step[label == res, 1]) / frames), 4)
+
+    played = samples[(samples[:, 0] >= play_start) & (samples[:, 0] <= play_end)]
+    if len(played):
+        # samples are denser around events, a sample counts until the next one
+        weights = np.diff(np.r_[played[:, 0], play_end])
+        for i, level in enumerate(weighted_percentile(played[:, 2], weights, list(quantiles))):
+            metrics['yomo_buffer_q{}_s'.format(i + 1)] = round(float(level), 3)
+    return metrics
+
+def _logs(path_prefix):
+    """The text logs of path_prefix, or its binary file if the text logs are gone."""
+    if not os.path.exists(path_prefix + '_buffer.txt') and os.path.exists(path_prefix + '_yomo.bin'):
+        return path_prefix + '_yomo.bin', None
+    return path_prefix + '_buffer.txt', path_prefix + '_events.txt'
+
+def summarize(path_prefix, bitrates=DEFAULT_BITRATES, quantiles=(25, 50, 75, 90), fields=None):
+    """Return the comma separated values of fields (default: out_fields()), "NA" where not available."""
+    buffer_log, events_log = _logs(path_prefix)
+    metrics = compute(buffer_log, events_log, bitrates, quantiles)
+    if fields is None:
+        fields = out_fields(bitrates)
+    return ",".join('NA' if metrics.get(field) is None else str(metrics[field]) for field in fields)
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__)
+        sys.exit(1)
+    quantiles = [float(q) for q in sys.argv[2].split(',')] if len(sys.argv) == 3 else (25, 50, 75, 90)
+    print(json.dumps(compute(*_logs(sys.argv[1]), quantiles=quantiles), indent=1, sort_keys=True))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+asn_lookup against a local stub DNS responder: parsing of the Team Cymru
+TXT answers, NXDOMAIN, timeouts and the parallel batch lookup.
+
+Usage:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files_nettest'))
+
+import dns.message
+import dns.rcode
+import dns.rrset
+
+import asn_lookup
+
+class StubServer(object):
+    """Local DNS responder answering every TXT query after delay seconds.
+
+       answers maps the first label of the query (the last octet of an IPv4
+       address) to the TXT string, None for NXDOMAIN; queries for labels in
+       silent are never answered. Every other query gets the default answer.
+    """
+
+    DEFAULT = '64500 | 192.0.2.0/24 | ZZ | stub | 2018-01-01'
+
+    def __init__(self, delay=0.0, answers=None, silent=()):
+        self.delay = delay
+        self.answers = answers or {}
+        self.silent = set(silent)
+        self.queries = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.error:
+                return
+            query = dns.message.from_wire(data)
+            name = query.question[0].name
+            label = name.labels[0].decode('ascii')
+            with self.lock:
+                self.queries.append(name.to_text())
+                if label in self.silent:
+                    continue
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            timer = threading.Timer(self.delay, self.answer, (query, label, addr))
+            timer.daemon = True
+            timer.start()
+
+    def answer(self, query, label, addr):
+        response = dns.message.make_response(query)
+        text = self.answers.get(label, self.DEFAULT)
+        if text is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        else:
+            response.answer.append(dns.rrset.from_text(query.question[0].name, 300, 'IN', 'TXT', '"{}"'.format(text)))
+        with self.lock:
+            self.in_flight -= 1
+        try:
+            self.sock.sendto(response.to_wire(), addr)
+        except socket.error:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+class AsnLookupTest(unittest.TestCase):
+
+    def start(self, timeout=1.0, **kwargs):
+        self.server = StubServer(**kwargs)
+        asn_lookup.configure_asn_resolver(['127.0.0.1'], self.server.port, timeout)
+        return self.server
+
+    def setUp(self):
+        self.server = None
+        asn_lookup.configure_asn_backend('dns')
+        asn_lookup.configure_asn_cache(None)
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.close()
+
+    def test_parse(self):
+        self.start(answers={'1': '3320 | 1.2.3.0/24 | DE | ripencc | 2001-01-01',
+                            '2': '15169 36040 | 8.8.8.0/24 | US | arin | 1992-12-01',
+                            '3': 'unexpected'})
+        self.assertEqual(asn_lookup.get_asn('1.2.3.1'), '3320')
+        # several origin ASNs: the first one
+        self.assertEqual(asn_lookup.get_asn('1.2.3.2'), '15169')
+        self.assertIsNone(asn_lookup.get_asn('1.2.3.3'))
+        self.assertEqual(self.server.queries[0], '1.3.2.1.origin.asn.cymru.com.')
+
+    def test_ipv6_query_name(self):
+        self.start()
+        self.assertEqual(asn_lookup.get_asn('2001:4860::1'), '64500')
+        self.assertTrue(self.server.queries[0].endswith('.6.8.4.1.0.0.2.origin6.asn.cymru.com.'))
+
+    def test_private_ip_not_queried(self):
+        self.start()
+        self.assertIsNone(asn_lookup.get_asn('10.0.0.1'))
+        self.assertIsNone(asn_lookup.get_asn('not an ip'))
+        self.assertEqual(self.server.queries, [])
+
+    def test_nxdomain_cached(self):
+        self.start(answers={'9': None})
+        self.assertIsNone(asn_lookup.get_asn('1.2.3.9'))
+        self.assertIsNone(asn_lookup.get_asn('1.2.3.9'))
+        self.assertEqual(len(self.server.queries), 1)
+        self.assertEqual(asn_lookup.get_asn_cache().get('1.2.3.9'), (True, None))
+
+    def test_timeout_not_cached(self):
+        self.start(timeout=0.2, silent=['7'])
+        time_start = time.time()
+        self.assertIsNone(asn_lookup.get_asn('1.2.3.7'))
+        self.assertLess(time.time() - time_start, 1.0)
+        self.assertEqual(asn_lookup.get_asn_cache().get('1.2.3.7'), (False, None))
+        # asked again on the next lookup
+        asn_lookup.get_asn('1.2.3.7')
+        self.assertEqual(len([q for q in self.server.queries if q.startswith('7.')]), 2)
+
+    def test_parallel(self):
+        self.start(delay=0.2, silent=['250'], timeout=0.5)
+        ips = ['1.2.3.{}'.format(i) for i in range(1, 17)] + ['1.2.3.1', '192.168.1.1', '', '1.2.3.250']
+        asn_lookup.get_asn_cache().put('1.2.3.16', '3320')
+        time_start = time.time()
+        result = asn_lookup.get_asns(ips, max_parallel=8)
+        duration = time.time() - time_start
+        self.assertEqual(set(result), set(ips))
+        for i in range(1, 16):
+            self.assertEqual(result['1.2.3.{}'.format(i)], '64500')
+        self.assertEqual(result['1.2.3.16'], '3320')
+        self.assertIsNone(result['192.168.1.1'])
+        self.assertIsNone(result[''])
+        self.assertIsNone(result['1.2.3.250'])
+        # one query per uncached public IP, at most 8 at a time
+        self.assertEqual(len(self.server.queries), 16)
+        self.assertLessEqual(self.server.max_in_flight, 8)
+        self.assertGreater(self.server.max_in_flight, 1)
+        # 15 answered queries of 0.2 s in two rounds and the timeout, not 15 * 0.2 s + 0.5 s
+        self.assertLess(duration, 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+asn_prefix_table: flattening of nested prefixes, a table built from a small
+dump with nested, adjacent and IPv6 prefixes, lookups at the interval
+boundaries, and the 'table' backend of asn_lookup against the 'dns' backend
+with a stub DNS responder answering from the same dump.
+
+Usage:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files_nettest'))
+
+import dns.message
+import dns.rcode
+import dns.rrset
+from IPy import IP
+
+import asn_lookup
+import asn_prefix_table
+from test_asn_lookup import StubServer
+
+DUMP = """# prefix length asn
+1.0.0.0\t8\t100
+1.2.0.0\t16\t200
+1.2.3.0\t24\t300
+1.2.4.0\t24\t300
+1.2.5.0\t24\t400
+1.2.255.0\t24\t500
+5.6.7.0\t24\t64500_64501
+8.8.8.8\t24\t15169,36040
+not a prefix
+1.2.3.0\tx\t1
+2001:4860::\t32\t15169
+2001:4860:4860::\t48\t15170
+2001:4860:ffff:ffff::\t64\t15171
+2a00::\t12\t600
+"""
+
+# address -> ASN of its most specific prefix in DUMP
+BOUNDARIES = [
+    ('0.255.255.255', None),
+    ('1.0.0.0', '100'),
+    ('1.1.255.255', '100'),
+    ('1.2.0.0', '200'),
+    ('1.2.2.255', '200'),
+    ('1.2.3.0', '300'),
+    ('1.2.4.255', '300'),
+    ('1.2.5.0', '400'),
+    ('1.2.5.255', '400'),
+    ('1.2.6.0', '200'),
+    ('1.2.254.255', '200'),
+    ('1.2.255.0', '500'),
+    ('1.2.255.255', '500'),
+    ('1.3.0.0', '100'),
+    ('1.255.255.255', '100'),
+    ('2.0.0.0', None),
+    ('5.6.6.255', None),
+    ('5.6.7.0', '64500'),
+    ('5.6.7.255', '64500'),
+    ('5.6.8.0', None),
+    ('8.8.7.255', None),
+    ('8.8.8.0', '15169'),
+    ('8.8.8.255', '15169'),
+    ('8.8.9.0', None),
+    ('255.255.255.255', None),
+    ('2001:485f:ffff:ffff:ffff:ffff:ffff:ffff', None),
+    ('2001:4860::', '15169'),
+    ('2001:4860:485f:ffff:ffff:ffff:ffff:ffff', '15169'),
+    ('2001:4860:4860::', '15170'),
+    ('2001:4860:4860:ffff:ffff:ffff:ffff:ffff', '15170'),
+    ('2001:4860:4861::', '15169'),
+    ('2001:4860:ffff:fffe:ffff:ffff:ffff:ffff', '15169'),
+    ('2001:4860:ffff:ffff::', '15171'),
+    ('2001:4860:ffff:ffff:ffff:ffff:ffff:ffff', '15171'),
+    ('2001:4861::', None),
+    ('2a00::', '600'),
+    ('2a0f:ffff:ffff:ffff:ffff:ffff:ffff:ffff', '600'),
+    ('2a10::', None),
+]
+
+def longest_match(ip):
+    """ASN of the most specific prefix of DUMP containing ip, the slow way."""
+    best = None
+    for line in DUMP.splitlines():
+        fields = line.split('\t')
+        if len(fields) != 3 or not fields[1].isdigit():
+            continue
+        prefix = IP(fields[0]).make_net(int(fields[1]))
+        if ip in prefix and (best is None or prefix.prefixlen() > best[0].prefixlen()):
+            best = (prefix, fields[2].replace('_', ',').split(',')[0])
+    return best
+
+class DumpServer(StubServer):
+    """Stub DNS responder answering origin(6).asn.cymru.com queries from DUMP."""
+
+    def answer(self, query, label, addr):
+        name = query.question[0].name
+        labels = [l.decode('ascii') for l in name.labels]
+        if labels[-5] == 'origin6':
+            nibbles = ''.join(reversed(labels[:-5]))
+            ip = ':'.join(nibbles[i:i + 4] for i in range(0, 32, 4))
+        else:
+            ip = '.'.join(reversed(labels[:-5]))
+        best = longest_match(ip)
+        response = dns.message.make_response(query)
+        if best is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        else:
+            text = '{} | {} | ZZ | stub | 2018-01-01'.format(best[1], best[0].strNormal())
+            response.answer.append(dns.rrset.from_text(name, 300, 'IN', 'TXT', '"{}"'.format(text)))
+        self.sock.sendto(response.to_wire(), addr)
+
+class FlattenTest(unittest.TestCase):
+
+    def test_nested(self):
+        prefixes = [(0, 99, 1), (50, 59, 4), (10, 29, 2), (20, 24, 3), (90, 99, 5)]
+        self.assertEqual(asn_prefix_table.flatten(prefixes),
+                         [(0, 9, 1), (10, 19, 2), (20, 24, 3), (25, 29, 2), (30, 49, 1), (50, 59, 4), (60, 89, 1), (90, 99, 5)])
+
+    def test_adjacent(self):
+        # same ASN: merged, other ASN or a gap: separate intervals
+        prefixes = [(0, 9, 1), (10, 19, 1), (20, 29, 2), (40, 49, 2)]
+        self.assertEqual(asn_prefix_table.flatten(prefixes), [(0, 19, 1), (20, 29, 2), (40, 49, 2)])
+
+    def test_same_asn_as_enclosing(self):
+        self.assertEqual(asn_prefix_table.flatten([(0, 99, 1), (10, 19, 1)]), [(0, 99, 1)])
+
+    def test_empty(self):
+        self.assertEqual(asn_prefix_table.flatten([]), [])
+
+class PrefixTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        dump = os.path.join(self.directory, 'pfx2as.txt')
+        with open(dump, 'w') as f:
+            f.write(DUMP)
+        self.path = os.path.join(self.directory, 'asn.table')
+        self.counts = asn_prefix_table.build(dump, self.path)
+        self.server = None
+        asn_lookup.configure_asn_cache(None)
+
+    def tearDown(self):
+        asn_lookup.configure_asn_backend('dns')
+        if self.server is not None:
+            self.server.close()
+        shutil.rmtree(self.directory)
+
+    def test_build(self):
+        self.assertEqual(self.counts, (9, 5))
+        table = asn_prefix_table.PrefixTable(self.path)
+        self.assertEqual(len(table), 14)
+
+    def test_boundaries(self):
+        table = asn_prefix_table.PrefixTable(self.path)
+        for ip, asn in BOUNDARIES:
+            self.assertEqual(table.lookup(ip), asn, ip)
+        self.assertIsNone(table.lookup('not an ip'))
+
+    def test_invalid_table(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * asn_prefix_table.HEADER.size)
+        self.assertRaises(Exception, asn_prefix_table.PrefixTable, self.path)
+
+    def test_reference(self):
+        for ip, asn in BOUNDARIES:
+            best = longest_match(ip)
+            self.assertEqual(best and best[1], asn, ip)
+
+    def test_backends_agree(self):
+        ips = [ip for ip, asn in BOUNDARIES]
+        asn_lookup.configure_asn_backend('table', self.path)
+        from_table = asn_lookup.get_asns(ips)
+        self.server = DumpServer()
+        asn_lookup.configure_asn_resolver(['127.0.0.1'], self.server.port, 1.0)
+        self.assertEqual(asn_lookup.get_asn('1.2.3.0'), '300')
+        # the table backend needs no DNS
+        self.assertEqual(self.server.queries, [])
+        asn_lookup.configure_asn_backend('dns')
+        from_dns = asn_lookup.get_asns(ips)
+        self.assertTrue(self.server.queries)
+        self.assertEqual(from_table, from_dns)
+        self.assertEqual(from_table['1.2.4.255'], '300')
+        self.assertEqual(from_table['2001:4860:4860::'], '15170')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+tshark_columnar parsing of logs with and without the field header.
+
+Usage:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files_yomo'))
+
+import tshark_columnar
+from tshark_columnar import LOG_HEADER, TSHARK_FIELDS, FLAG_DNS, FLAG_QUIC_LONG_HEADER
+
+HEADER = LOG_HEADER + ','.join(TSHARK_FIELDS) + '\n'
+# tshark without the IETF QUIC dissector
+HEADER_NO_FORM = LOG_HEADER + ','.join(TSHARK_FIELDS[:-1]) + '\n'
+
+def parse(lines):
+    arrays, dictionaries, skipped = tshark_columnar._parse_lines(lines)
+    return arrays, dictionaries, skipped
+
+def strings(arrays, dictionaries, column, kind='name'):
+    return [dictionaries[kind][i] for i in arrays[column]]
+
+class OldFormatTest(unittest.TestCase):
+    """Logs without header, repeated fields joined with ','."""
+
+    def test_repeated_dns_answer(self):
+        # two dns.a answers and an empty dns.aaaa: 22 fields
+        line = '1524000000.3,,200,8.8.8.8,10.0.0.2,,,,,,,,1,,,a.example,a.example,a.example,1,192.0.2.1,192.0.2.2,\n'
+        arrays, dictionaries, skipped = parse([line])
+        self.assertEqual(list(arrays['dns_row']), [0])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_a'), [''])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_aaaa'), [''])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_tail'), ['a.example,a.example,a.example,1,192.0.2.1,192.0.2.2,'])
+        self.assertEqual(arrays['flags'][0], FLAG_DNS)
+
+    def test_single_values(self):
+        line = '1524000000.3,,200,8.8.8.8,10.0.0.2,,,,,,,,1,,,a.example,a.example,a.example,1,192.0.2.1,\n'
+        arrays, dictionaries, skipped = parse([line])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_a'), ['192.0.2.1'])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_tail'), [''])
+
+    def test_repeated_non_dns_field(self):
+        # ICMP error quoting TCP (two ip.src, two ip.dst) and coalesced QUIC (two quic.cid)
+        lines = ['1524000000.4,0,70,198.51.100.1,10.0.0.2,10.0.0.2,192.0.2.1,40000,443,,,,,,,,,,,,,,\n',
+                 '1524000000.5,,1300,192.0.2.1,10.0.0.2,,,,,,,,,aaaa,bbbb,0,1,,,,,,\n']
+        arrays, dictionaries, skipped = parse(lines)
+        self.assertEqual(len(arrays['time']), 2)
+        self.assertEqual(skipped, 0)
+        self.assertEqual(list(arrays['dns_row']), [])
+        # the fields after the repeated one are shifted and not used
+        self.assertEqual(list(arrays['flags']), [0, 0])
+        self.assertEqual(list(arrays['srcport']), [0, 0])
+        self.assertEqual(strings(arrays, dictionaries, 'quic_cid', 'cid'), ['', ''])
+        self.assertEqual(strings(arrays, dictionaries, 'src', 'ip'), ['198.51.100.1', '192.0.2.1'])
+        self.assertEqual(list(arrays['frame_len']), [70, 1300])
+
+class HeaderFormatTest(unittest.TestCase):
+    """Logs written with the aggregator ';' and the field header."""
+
+    def test_repeated_fields(self):
+        lines = [HEADER,
+                 '1524000000.1,,1300,192.0.2.1,10.0.0.2,,,,,,,,,aaaa;bbbb,5;6,,,,,,,1;0\n',
+                 '1524000000.2,0,70,198.51.100.1;10.0.0.2,10.0.0.2;192.0.2.1,40000,443,,,,,,,,,,,,,,,\n',
+                 '1524000000.3,,200,8.8.8.8,10.0.0.2,,,,,,,,1,,,a.example,a.example,a.example;a.example,5;1,192.0.2.1;192.0.2.2,,\n']
+        arrays, dictionaries, skipped = parse(lines)
+        self.assertEqual(skipped, 0)
+        self.assertEqual(strings(arrays, dictionaries, 'quic_cid', 'cid'), ['aaaa', '', ''])
+        self.assertEqual(list(arrays['quic_pn']), [5, -1, -1])
+        self.assertEqual(strings(arrays, dictionaries, 'src', 'ip'), ['192.0.2.1', '198.51.100.1', '8.8.8.8'])
+        self.assertEqual(list(arrays['srcport']), [0, 40000, 0])
+        self.assertEqual(list(arrays['flags']), [FLAG_QUIC_LONG_HEADER, 0, FLAG_DNS])
+        self.assertEqual(list(arrays['dns_row']), [2])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_a'), ['192.0.2.1;192.0.2.2'])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_tail'), [''])
+
+    def test_without_header_form(self):
+        lines = [HEADER_NO_FORM,
+                 '1524000000.1,,1300,192.0.2.1,10.0.0.2,,,,,,,,,aaaa,5,,,,,,\n',
+                 '1524000000.3,,200,8.8.8.8,10.0.0.2,,,,,,,,1,,,a.example,a.example,a.example,1,192.0.2.1,\n']
+        arrays, dictionaries, skipped = parse(lines)
+        self.assertEqual(list(arrays['flags']), [0, FLAG_DNS])
+        self.assertEqual(strings(arrays, dictionaries, 'dns_a'), ['192.0.2.1'])
+
+    def test_garbled_values(self):
+        lines = [HEADER, '1524000000.1,x,,192.0.2.1,10.0.0.2,99999,-1,abc,,,,,,,99999999999,,,,,,,\n', 'cut off li\n']
+        arrays, dictionaries, skipped = parse(lines)
+        self.assertEqual(skipped, 1)
+        self.assertEqual(list(arrays['tcp_len']), [-1])
+        self.assertEqual(list(arrays['srcport']), [0])
+        self.assertEqual(list(arrays['dstport']), [0])
+        self.assertEqual(list(arrays['quic_pn']), [-1])
+        self.assertNotEqual(arrays['ack_rtt'][0], arrays['ack_rtt'][0])
+
+class ConvertTest(unittest.TestCase):
+
+    def test_columnar_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'x_tshark.txt')
+            with open(path, 'w') as f:
+                f.write(HEADER)
+                f.write('1524000000.1,1388,1454,192.0.2.1,10.0.0.2,443,40000,0.050,,,,,,,,,,,,,,\n')
+                f.write('1524000001.2,0,66,10.0.0.2,192.0.2.1,40000,443,,,,,,,,,,,,,,,\n')
+            capture = tshark_columnar.load(tshark_columnar.convert(path))
+            try:
+                self.assertEqual(len(capture), 2)
+                self.assertEqual(capture.skipped, 0)
+                self.assertEqual(list(capture['tcp_len']), [1388, 0])
+                self.assertEqual(capture.second_rows(1524000001), (1, 2))
+            finally:
+                capture.close()
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+SessionPool reset policies, with the display and browser startup replaced
+by fakes (no Xvfb or browser is started).
+
+Usage:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import itertools
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files_yomo'))
+
+try:
+    import webdriver_pool
+except ImportError:
+    webdriver_pool = None
+
+class FakeDisplay(object):
+
+    def __init__(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+class FakeDriver(object):
+
+    pids = itertools.count(1000)
+
+    def __init__(self, browser):
+        self.browser = browser
+        pid = next(self.pids)
+        self.service = type('Service', (), {'process': type('Process', (), {'pid': pid})})()
+        self.session_id = 'session{}'.format(pid)
+        self.command_executor = type('Executor', (), {'_url': 'http://127.0.0.1:9515', '_commands': {}})()
+        self.urls = []
+        self.commands = []
+
+    def get(self, url):
+        self.urls.append(url)
+
+    def execute(self, command, params):
+        self.commands.append(params['cmd'])
+
+@unittest.skipIf(webdriver_pool is None, 'webdriver_pool needs selenium and pyvirtualdisplay')
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((name, getattr(webdriver_pool, name)) for name in ('start_display', 'start_browser', 'kill_tree'))
+        self.displays = []
+        self.drivers = []
+        self.killed = []
+        def start_display(window_size, timeout, timings):
+            self.displays.append(FakeDisplay())
+            return self.displays[-1]
+        def start_browser(browser, quic, window_size, httpLog, timeout, timings, headless=False, profile=None):
+            self.drivers.append(FakeDriver(browser))
+            return self.drivers[-1]
+        webdriver_pool.start_display = start_display
+        webdriver_pool.start_browser = start_browser
+        webdriver_pool.kill_tree = self.killed.append
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+        for name, function in self.saved.items():
+            setattr(webdriver_pool, name, function)
+
+    def acquire_twice(self, policy, browser='chrome'):
+        self.pool = webdriver_pool.SessionPool(policy)
+        first = self.pool.acquire(browser, True, (1280, 720))
+        second = self.pool.acquire(browser, True, (1280, 720))
+        return first, second
+
+    def test_cold_restarts_the_browser(self):
+        for browser in ('chrome', 'firefox'):
+            first, second = self.acquire_twice('cold', browser)
+            self.assertNotEqual(first['session_id'], second['session_id'])
+            # the first browser process is gone, the display is kept
+            self.assertEqual(self.killed, [self.drivers[0].service.process.pid])
+            self.assertEqual(len(self.displays), 1)
+            self.assertFalse(self.displays[0].stopped)
+            self.assertNotEqual(first['http_log'], second['http_log'])
+            self.pool.close()
+            self.assertTrue(self.displays[0].stopped)
+            self.pool = None
+            del self.drivers[:], self.displays[:], self.killed[:]
+
+    def test_default_policy_is_cold(self):
+        self.pool = webdriver_pool.SessionPool()
+        first = self.pool.acquire('chrome', True, (1280, 720))
+        second = self.pool.acquire('chrome', True, (1280, 720))
+        self.assertNotEqual(first['session_id'], second['session_id'])
+
+    def test_clear_keeps_the_browser(self):
+        first, second = self.acquire_twice('clear')
+        self.assertEqual(first['session_id'], second['session_id'])
+        self.assertEqual(second['runs'], 2)
+        self.assertEqual(self.killed, [])
+        self.assertIn('Network.clearBrowserCache', self.drivers[0].commands)
+
+    def test_clear_restarts_firefox(self):
+        first, second = self.acquire_twice('clear', 'firefox')
+        self.assertNotEqual(first['session_id'], second['session_id'])
+
+    def test_warm_keeps_the_browser(self):
+        first, second = self.acquire_twice('warm')
+        self.assertEqual(first['session_id'], second['session_id'])
+        self.assertEqual(self.drivers[0].urls, ['about:blank'])
+        self.assertEqual(self.drivers[0].commands, [])
+
+    def test_failed_run_discards_the_session(self):
+        self.pool = webdriver_pool.SessionPool('warm')
+        first = self.pool.acquire('chrome', True, (1280, 720))
+        self.pool.release(first)
+        second = self.pool.acquire('chrome', True, (1280, 720))
+        self.assertEqual(first['session_id'], second['session_id'])
+        webdriver_pool.mark_failed(second)
+        self.pool.release(second)
+        self.assertEqual(self.killed, [self.drivers[0].service.process.pid])
+        self.assertTrue(self.displays[0].stopped)
+        third = self.pool.acquire('chrome', True, (1280, 720))
+        self.assertNotEqual(second['session_id'], third['session_id'])
+        self.assertEqual(len(self.displays), 2)
+
+    def test_separate_keys(self):
+        self.pool = webdriver_pool.SessionPool('warm')
+        chrome = self.pool.acquire('chrome', True, (1280, 720))
+        no_quic = self.pool.acquire('chrome', False, (1280, 720))
+        self.assertNotEqual(chrome['session_id'], no_quic['session_id'])
+        self.assertEqual(len(self.displays), 2)
+
+if __name__ == '__main__':
+    unittest.main()
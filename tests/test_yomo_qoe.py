@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+yomo_qoe.compute() on the sample logs in data/yomo. The samples are
+synthetic: written by hand in the format of the YoMo output files, with
+round timestamps so that the expected metrics can be worked out from
+the description below. They are not traces of a YoMo run.
+
+v4_*   old format: 4 field buffer samples every second, no sampling header,
+       no frame counters; 360p -> 720p at 10 s, stall 15 s - 16.5 s
+v7_*   current format: 7 field buffer samples, sampling header, fast samples
+       around the quality change and the stall, 40 frames/s with 10 %
+       dropped at 1080p; 480p -> 1080p at 8 s, stall 12 s - 13 s
+
+Usage:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files_yomo'))
+
+import yomo_qoe
+import yomo_binary
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'yomo')
+
+def sample(name):
+    return os.path.join(DATA, name + '_buffer.txt'), os.path.join(DATA, name + '_events.txt')
+
+class ComputeTest(unittest.TestCase):
+
+    def test_old_format(self):
+        metrics = yomo_qoe.compute(*sample('v4'))
+        self.assertEqual(metrics['yomo_initial_delay_ms'], 2000)
+        self.assertEqual(metrics['yomo_stall_count'], 1)
+        self.assertEqual(metrics['yomo_stall_duration_ms'], 1500)
+        self.assertEqual(metrics['yomo_quality_switches'], 1)
+        self.assertEqual(metrics['yomo_playback_s'], 17.0)
+        self.assertEqual(metrics['yomo_time_360p_s'], 7.0)
+        self.assertEqual(metrics['yomo_time_720p_s'], 10.0)
+        self.assertEqual(metrics['yomo_time_1080p_s'], 0.0)
+        self.assertEqual(metrics['yomo_avg_bitrate_kbps'], round((7 * 606.343 + 10 * 2213.150) / 17, 3))
+        for i in range(1, 5):
+            self.assertEqual(metrics['yomo_buffer_q{}_s'.format(i)], 5.0)
+        # no frame counters and no end reason in the old logs
+        for field in ('yomo_dropped_rate', 'yomo_corrupted_frames', 'yomo_render_bottleneck', 'yomo_dropped_rate_720p', 'yomo_end_reason'):
+            self.assertIsNone(metrics[field])
+
+    def test_current_format(self):
+        metrics = yomo_qoe.compute(*sample('v7'))
+        # the sampling header is not a player event
+        self.assertEqual(metrics['yomo_initial_delay_ms'], 2000)
+        self.assertEqual(metrics['yomo_stall_count'], 1)
+        self.assertEqual(metrics['yomo_stall_duration_ms'], 1000)
+        self.assertEqual(metrics['yomo_quality_switches'], 1)
+        self.assertEqual(metrics['yomo_playback_s'], 13.0)
+        self.assertEqual(metrics['yomo_time_480p_s'], 5.0)
+        self.assertEqual(metrics['yomo_time_1080p_s'], 8.0)
+        self.assertEqual(metrics['yomo_avg_bitrate_kbps'], round((5 * 1166.528 + 8 * 4018.795) / 13, 3))
+        self.assertEqual(metrics['yomo_end_reason'], 'ended')
+        # 520 frames, 32 dropped after 8 s
+        self.assertEqual(metrics['yomo_dropped_rate'], round(32 / 520.0, 4))
+        self.assertEqual(metrics['yomo_corrupted_frames'], 0)
+        self.assertEqual(metrics['yomo_render_bottleneck'], 0)
+        self.assertEqual(metrics['yomo_dropped_rate_480p'], 0.0)
+        # the frames up to the sample at the switch count for 1080p already
+        self.assertEqual(metrics['yomo_dropped_rate_1080p'], round(32 / 360.0, 4))
+        self.assertIsNone(metrics['yomo_dropped_rate_720p'])
+
+    def test_buffer_quantiles_time_weighted(self):
+        # 9 s at 10 s buffer, 1 s empty, 3 s at 4 s: the fast samples around the stall must not outweigh the rest
+        metrics = yomo_qoe.compute(*sample('v7'))
+        self.assertEqual(metrics['yomo_buffer_q1_s'], 4.0)
+        self.assertEqual(metrics['yomo_buffer_q2_s'], 10.0)
+        self.assertEqual(metrics['yomo_buffer_q4_s'], 10.0)
+
+    def test_quantiles_argument(self):
+        metrics = yomo_qoe.compute(*sample('v4'), quantiles=(10, 20, 30, 40))
+        self.assertEqual(metrics['yomo_buffer_q1_s'], 5.0)
+
+class BinaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, name):
+        prefix = os.path.join(self.directory, name)
+        buffer_path, events_path = sample(name)
+        shutil.copy(buffer_path, prefix + '_buffer.txt')
+        shutil.copy(events_path, prefix + '_events.txt')
+        return prefix, yomo_binary.convert(prefix)
+
+    def test_same_metrics(self):
+        for name in ('v4', 'v7'):
+            prefix, bin_path = self.convert(name)
+            self.assertEqual(yomo_qoe.compute(bin_path, None), yomo_qoe.compute(*sample(name)))
+
+    def test_sampling_header(self):
+        prefix, bin_path = self.convert('v7')
+        recording = yomo_binary.YomoRecording(bin_path)
+        try:
+            self.assertEqual(recording.request_time_ms, 1000)
+            self.assertEqual(recording.sampling, {'interval_ms': 1000, 'fast_interval_ms': 250, 'fast_window_ms': 1000})
+        finally:
+            recording.close()
+
+    def test_summarize_without_text_logs(self):
+        prefix, bin_path = self.convert('v7')
+        text = yomo_qoe.summarize(prefix)
+        os.remove(prefix + '_buffer.txt')
+        os.remove(prefix + '_events.txt')
+        self.assertEqual(yomo_qoe.summarize(prefix), text)
+        self.assertEqual(len(text.split(',')), len(yomo_qoe.out_fields()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,12 +14,14 @@ The output will be formatted into a JSON object suitable for storage in the MONR
 
 import io
 import json
+import atexit
 import zmq
 import sys
 import netifaces
 import time
 from subprocess import Popen, PIPE, STDOUT, call, check_output, CalledProcessError
 from multiprocessing import Process, Manager
+from multiprocessing.pool import ThreadPool
 import shutil
 from tempfile import NamedTemporaryFile
 import glob
@@ -28,7 +30,14 @@ from os import listdir
 
 #sys.path.append('files_yomo')
 from videomon_yomo import *
-from traceroute_parser import parse_traceroute
+from httplog_scanner import get_servers
+from netlog_analyzer import analyze_netlog
+from tshark_columnar import convert as convert_tshark
+from tshark_analysis import analyze_file as analyze_tshark
+from yomo_binary import convert as convert_yomo
+from traceroute_parser import parse_traceroute, parse_traceroute_stream, configure_asn_backend, configure_asn_cache, save_asn_cache
+from traceroute_planner import run_planned_traceroutes
+from webdriver_pool import SessionPool, build_profile_template
 import pingparser
 
 # Configuration
@@ -103,19 +112,68 @@ EXPCONFIG = {
   "cnf_yomo_bitrates_kbps": "144p:114.792,240p:250.618,360p:606.343,480p:1166.528,720p:2213.150,1080p:4018.795,1440p:9489.022,2160p:21322.799", #for D8YQn7o_AyA,
   "cnf_yomo_skip": False,
   "cnf_yomo_quic_enabled": True,
+  "cnf_yomo_drain_interval_s": 5,                 # Interval for streaming buffer samples and player events from the browser to the output files
+  "cnf_yomo_fsync_interval_s": 30,                # Interval for syncing the streamed output files to disk
+  "cnf_yomo_sample_interval_ms": 1000,            # Buffer sampling interval of the player collector
+  "cnf_yomo_fast_sample_interval_ms": 100,        # Sampling interval around stalls, playback starts and quality changes
+  "cnf_yomo_fast_sample_window_ms": 3000,         # How long the fast sampling lasts after such an event
+  "cnf_yomo_progress_timeout_s": 60,              # End the playback if its position did not advance for this long
+  "cnf_yomo_startup_timeout_s": 30,               # Upper bound for each startup wait (X server, browser window, video player)
+  "cnf_yomo_window_size": [3840, 2260],           # Browser window (width, height), Xvfb is slightly larger
+  "cnf_yomo_headless": False,                     # Run Chrome/Firefox in their headless mode instead of on Xvfb
+  "cnf_yomo_profile_templates": True,             # Start browsers on a clone of a prebuilt (cold) profile instead of an empty one
+  "cnf_yomo_profile_dir": "/tmp/videomon_profiles/", # Profile templates, built once at start
+  "cnf_yomo_session_pool": True,                  # Keep Xvfb (the browser too, see cnf_yomo_session_reset) running across multiconfig combinations
+  "cnf_yomo_session_pool_size": 2,                # Sessions (browser, QUIC, window size) kept open at the same time
+  "cnf_yomo_session_reset": "cold",               # Between runs: "cold" (new browser process, only Xvfb is kept), "clear" (keep the
+                                                  # browser, clear cookies, cache and storage) or "warm" (keep all); clear and warm
+                                                  # reuse open connections, TLS/QUIC sessions and the DNS cache of the previous run
+  "cnf_yomo_netlog_analysis": True,               # Summarize request/session timing from the Chrome net-log
+  "cnf_yomo_capture": "tshark",                   # "tshark" (live dissection into _tshark.txt), "afpacket" (TPACKET_V3 ring, counters in _afpacket.json)
+                                                  # or "dumpcap" (pcapng ring files during playback, dissected into _tshark.txt afterwards)
+  "cnf_afpacket_interval_s": 1.0,                 # Interval of the afpacket throughput counters
+  "cnf_dumpcap_snaplen": 0,                       # Bytes captured per packet by dumpcap (0 = full packets, less cuts large DNS responses)
+  "cnf_dumpcap_filesize_kb": 20000,               # Size of the dumpcap ring files
+  "cnf_dumpcap_ring_files": 50,                   # Ring files kept, older packets are dropped (0 = unbounded)
+  "cnf_dumpcap_dissect_parallel": 1,              # tshark processes dissecting ring files in parallel (>1 loses TCP analysis at file boundaries)
+  "cnf_dumpcap_keep_pcap": False,                 # Keep the pcapng files in the results
+  "cnf_tshark_columnar": True,                    # Convert the tshark log into the columnar binary format (_tshark.col)
+  "cnf_tshark_keep_text": True,                   # Keep the tshark text log next to the columnar file
+  "cnf_yomo_binary": True,                        # Convert the YoMo buffer and event logs into the binary format (_yomo.bin)
+  "cnf_yomo_keep_text": True,                     # Keep the YoMo text logs next to the binary file
+  "cnf_tshark_analysis": True,                    # Throughput/RTT/loss time series from the capture into the summary (needs numpy)
   "cnf_run_traceroute": True,
+  "cnf_asn_cache_file": "/tmp/asn_cache.json",    # on-disk ASN cache shared by all traceroutes, "" = memory only
+  "cnf_asn_cache_ttl_s": 604800,                  # lifetime of resolved ASNs in the cache
+  "cnf_asn_cache_negative_ttl_s": 21600,          # lifetime of unresolvable IPs in the cache
+  "cnf_asn_backend": "dns",                       # "dns" (Team Cymru) or "table" (offline prefix table, no network)
+  "cnf_asn_table_file": "/opt/monroe/asn_prefix_table.bin",  # built with asn_prefix_table.py
+  "cnf_traceroute_streaming": True,               # Parse hops and look up ASNs while traceroute is running
+  "cnf_traceroute_max_star_hops": 5,              # Stop traceroute after this many hops without reply (0 = never)
+  "cnf_traceroute_tail_hops": 2,                  # Hops per server that are traced on top of the path shared with its cluster
+  "cnf_traceroute_prefix_v4": 24,                 # Servers in the same IPv4 prefix form one traceroute cluster
+  "cnf_traceroute_prefix_v6": 48,                 # Servers in the same IPv6 prefix form one traceroute cluster
+  "cnf_traceroute_max_parallel": 4,               # Concurrent tail traceroutes within a cluster
   #"cnf_yomo_resolution": "1920,1080",
   #"180p:236.059,270p:461.195,360p:922.220,540p:1780.741,810p:3369.892,1080p:7823.352,1620p:15500.364",
   #"144p:110.139,240p:246.425,360p:262.750,480p:529.500,720p:1036.744,1080p:2793.167",             	   # REQUIRED PARAMETER; list (as String) with all available qualities and their bitrates in KBs
   "cnf_wait_btw_algorithms_s": 20,                 # Time to wait between different algorithms
   "cnf_wait_btw_videos_s": 20,                     # Time to wait between different videos
   "cnf_compress_additional_results": True,         # Whether or not to tar additional log files
-  "cnf_q1": 25,
+  "cnf_yomo_out_fields": "yomo_initial_delay_ms,yomo_stall_count,yomo_stall_duration_ms,yomo_quality_switches,yomo_avg_bitrate_kbps,yomo_playback_s,"
+                         "yomo_time_144p_s,yomo_time_240p_s,yomo_time_360p_s,yomo_time_480p_s,yomo_time_720p_s,yomo_time_1080p_s,yomo_time_1440p_s,yomo_time_2160p_s,"
+                         "yomo_buffer_q1_s,yomo_buffer_q2_s,yomo_buffer_q3_s,yomo_buffer_q4_s,yomo_end_reason,"
+                         "yomo_dropped_rate,yomo_corrupted_frames,yomo_render_bottleneck,"
+                         "yomo_dropped_rate_144p,yomo_dropped_rate_240p,yomo_dropped_rate_360p,yomo_dropped_rate_480p,yomo_dropped_rate_720p,"
+                         "yomo_dropped_rate_1080p,yomo_dropped_rate_1440p,yomo_dropped_rate_2160p",  # QoE fields returned by run_yomo (see yomo_qoe.py)
+  "cnf_q1": 25,                                   # Buffer level quantiles (percent) in the QoE fields
   "cnf_q2": 50,
   "cnf_q3": 75,
   "cnf_q4": 90,
   "cnf_ping_count": 11,
   "cfg_ping_timeout": 2,
+  "cnf_ping_max_parallel": 8,                      # Number of servers pinged concurrently (1 = one after another)
+  "cnf_ping_keep_raw": False,                      # Store the raw ping output next to the parsed per-reply data
   # "cnf_yomo_multiconfig": [ {"cnf_video_id": "R6MlUcmOul8", "cnf_yomo_browser": "firefox", "cnf_yomo_quic_enabled": False},
   # {"cnf_video_id": "R6MlUcmOul8", "cnf_yomo_browser": "chrome", "cnf_yomo_quic_enabled": False},
   # {"cnf_video_id": "R6MlUcmOul8", "cnf_yomo_browser": "chrome", "cnf_yomo_quic_enabled": True}]
@@ -124,21 +182,10 @@ EXPCONFIG = {
   }
 
 
-# regular expression that searches for xyz.googlevideo.com server URLs for traceroute/ping content servers
-# returns a list with URLs
+# scans the HTTP logs for xyz.googlevideo.com server URLs for traceroute/ping content servers
+# returns a sorted list with unique URLs
 def get_yt_servers(logfiles):
-    data=[]
-    for logfile in logfiles:
-        # go for: ..."https://r2---sn-4g5ednss.googlevideo.com/generate_204"...
-        #         ...ders":["Host: r2---sn-4g5e6nlk.googlevideo.com","...
-        #         ...":"r2---sn-4g5e6nlk.googlevideo.com:443","is...
-        #         .../nsHttp   Host: r2---sn-4g5e6nlk.googlevideo.com...
-        #sed -re 's/^.*(https?:[^\.]+\.googlevideo.com)\/.*$/\1/g’ <LOGFILE> | sort | uniq
-        cmd = "grep googlevideo.com " + logfile + " | sed -re 's/^.*[ \"\/]([^\. :\"]+\.googlevideo\.com).*$/\\1/g' | sort | uniq"
-        p = Popen(cmd, shell=True, stdout=PIPE)
-        data = data + list(filter(None,p.communicate()[0].decode("utf-8").split("\n")))
-        data = [ el for el in data if "*." not in el ]  # remove entries like *.googlevideo.com with wildcards
-    return data
+    return sorted(get_servers(logfiles))
 
 
 def get_filename(data, postfix, ending, tstamp, interface):
@@ -284,17 +331,19 @@ def create_meta_process(ifname, expconfig):
     process.daemon = True
     return (meta_info, process)
 
-def create_exp_process(meta_info, expconfig):
-    process = Process(target=run_exp, args=(meta_info, expconfig, ))
+def create_exp_process(meta_info, expconfig, session=None):
+    process = Process(target=run_exp, args=(meta_info, expconfig, session, ))
     process.daemon = True
     return process
 
-def traceroute(target, interface):
+def traceroute(target, interface, first_ttl=1):
 
     cmd = ['traceroute', '-A']
 
     if (interface):
         cmd.extend(['-i', interface])
+    if first_ttl > 1:
+        cmd.extend(['-f', str(first_ttl)])
     cmd.append(target)
 
     if EXPCONFIG['verbosity'] > 1:
@@ -302,7 +351,23 @@ def traceroute(target, interface):
 
     time_start = time.time()
     p = Popen(cmd, stdout=PIPE)
-    data = p.communicate()[0]
+    if EXPCONFIG['cnf_traceroute_streaming']:
+        # parse each hop as it arrives, stop early at the target or after too many silent hops
+        lines = []
+        def read_lines():
+            for line in iter(p.stdout.readline, b''):
+                lines.append(line)
+                yield line
+        try:
+            traceroute = parse_traceroute_stream(read_lines(), max_star_hops=EXPCONFIG['cnf_traceroute_max_star_hops'])
+        except Exception as e:
+            traceroute = {'error': 'could not parse traceroute'}
+        if p.poll() is None:
+            p.terminate()
+        p.wait()
+        data = b''.join(lines)
+    else:
+        data = p.communicate()[0]
     time_end = time.time()
 
     if EXPCONFIG['verbosity'] > 1:
@@ -311,10 +376,12 @@ def traceroute(target, interface):
     if EXPCONFIG['verbosity'] > 2:
         print("traceroute result: {}".format(data))
 
-    try:
-        traceroute = parse_traceroute(data)
-    except Exception as e:
-        traceroute = {'error': 'could not parse traceroute'}
+    if not EXPCONFIG['cnf_traceroute_streaming']:
+        try:
+            traceroute = parse_traceroute(data)
+        except Exception as e:
+            traceroute = {'error': 'could not parse traceroute'}
+    save_asn_cache()
     if not traceroute:
         traceroute = {'error': 'no traceroute output'}
 
@@ -323,7 +390,7 @@ def traceroute(target, interface):
     traceroute['raw'] = data.decode('ascii', 'replace')
     return traceroute
 
-def ping(target, num_pings, interface, ping_timeout):
+def ping(target, num_pings, interface, ping_timeout, keep_raw=True):
 
     cmd = ['ping', '-c', str(num_pings), '-a', '-W', str(ping_timeout)]
 
@@ -346,7 +413,7 @@ def ping(target, num_pings, interface, ping_timeout):
         print("ping result: {}".format(data))
 
     try:
-        ping = pingparser.parse(data)
+        ping = pingparser.parse(data, replies=True)
     except Exception as e:
         ping = {'error': 'could not parse ping'}
     if not ping:
@@ -354,10 +421,28 @@ def ping(target, num_pings, interface, ping_timeout):
 
     ping['time_start'] = time_start
     ping['time_end'] = time_end
-    ping['raw'] = data.decode('ascii', 'replace')
+    if keep_raw or 'error' in ping:
+        ping['raw'] = data.decode('ascii', 'replace')
 
     return ping
 
+def ping_targets(targets, num_pings, interface, ping_timeout, max_parallel, keep_raw=True):
+    """Ping all targets with at most max_parallel ping processes at a time.
+
+        Returns a dict target -> ping result; each result keeps its own
+        time_start/time_end so overlapping measurements stay visible.
+    """
+    targets = list(targets)
+    if not targets:
+        return {}
+    pool = ThreadPool(max(1, min(max_parallel, len(targets))))
+    try:
+        results = pool.map(lambda target: ping(target, num_pings, interface, ping_timeout, keep_raw), targets)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(targets, results))
+
 def get_config_combinations(config):
 
     if 'cnf_yomo_multiconfig' not in config or not config['cnf_yomo_multiconfig']:
@@ -384,13 +469,15 @@ def get_config_combinations(config):
         out.update(configuration)
         yield out
 
-def run_exp(meta_info, expconfig):
+def run_exp(meta_info, expconfig, session=None):
     """Seperate process that runs the experiment and collects the ouput.
         Will abort if the interface goes down.
+        session: warm browser session for YoMo (webdriver_pool.SessionPool.acquire())
     """
 
     cfg = expconfig.copy()
     output = None
+    output_traceroute = None
 
     try:
         if 'cnf_add_to_result' not in cfg:
@@ -460,9 +547,9 @@ def run_exp(meta_info, expconfig):
                 os.makedirs(resultdir_yomo)
 
         if cfg['cnf_run_traceroute']:
-            # resultdir_traceroute=resultdir_videomon+'traceroute/'
-            # if not os.path.exists(resultdir_traceroute):
-            #     os.makedirs(resultdir_traceroute)
+            resultdir_traceroute=resultdir_videomon+'traceroute/'
+            if not os.path.exists(resultdir_traceroute):
+                os.makedirs(resultdir_traceroute)
             resultdir_ping=resultdir_videomon+'ping/'
             if not os.path.exists(resultdir_ping):
                 os.makedirs(resultdir_ping)
@@ -501,25 +588,92 @@ def run_exp(meta_info, expconfig):
                 #os.system("/opt/monroe/nettest.py")
                 #nettest.main()
 
-                out_yomo=run_yomo(cfg['cnf_video_id'],cfg['cnf_yomo_playback_duration_s'],prefix_yomo,cfg['cnf_yomo_bitrates_kbps'],ifname,resultdir_yomo,cfg['cnf_q1'],cfg['cnf_q2'],cfg['cnf_q3'],cfg['cnf_q4'],cfg['cnf_yomo_browser'],cfg['cnf_yomo_quic_enabled'])
-
-                if not (out_yomo == "") and cfg['verbosity'] > 2:
-                    print('')
-                    print('----------------------------------------------------------')
-                    print('DBG: YoMo output')
-                    print('----------------------------------------------------------')
-                    print(out_yomo)
+                # clone of the profile template built at start, if there is one
+                profile_template = os.path.join(cfg['cnf_yomo_profile_dir'], cfg['cnf_yomo_browser'])
+                if not (cfg['cnf_yomo_profile_templates'] and os.path.isdir(profile_template)):
+                    profile_template = None
+
+                out_yomo=run_yomo(cfg['cnf_video_id'],cfg['cnf_yomo_playback_duration_s'],prefix_yomo,cfg['cnf_yomo_bitrates_kbps'],ifname,resultdir_yomo,cfg['cnf_q1'],cfg['cnf_q2'],cfg['cnf_q3'],cfg['cnf_q4'],cfg['cnf_yomo_browser'],cfg['cnf_yomo_quic_enabled'],
+                                  {'capture': cfg['cnf_yomo_capture'], 'capture_interval_s': cfg['cnf_afpacket_interval_s'],
+                                   'snaplen': cfg['cnf_dumpcap_snaplen'], 'ring_filesize_kb': cfg['cnf_dumpcap_filesize_kb'],
+                                   'ring_files': cfg['cnf_dumpcap_ring_files'], 'dissect_parallel': cfg['cnf_dumpcap_dissect_parallel'], 'keep_pcap': cfg['cnf_dumpcap_keep_pcap'],
+                                   'out_fields': cfg['cnf_yomo_out_fields'].split(","), 'drain_interval_s': cfg['cnf_yomo_drain_interval_s'],
+                                   'fsync_interval_s': cfg['cnf_yomo_fsync_interval_s'],
+                                   'sampling': {'interval_ms': cfg['cnf_yomo_sample_interval_ms'], 'fast_interval_ms': cfg['cnf_yomo_fast_sample_interval_ms'],
+                                                'fast_window_ms': cfg['cnf_yomo_fast_sample_window_ms']},
+                                   'progress_timeout_s': cfg['cnf_yomo_progress_timeout_s'],
+                                   'startup_timeout_s': cfg['cnf_yomo_startup_timeout_s'],
+                                   'window_size': cfg['cnf_yomo_window_size'], 'headless': cfg['cnf_yomo_headless'], 'session': session,
+                                   'profile_template': profile_template})
+
+                if not (out_yomo == ""):
+                    if cfg['verbosity'] > 2:
+                        print('')
+                        print('----------------------------------------------------------')
+                        print('DBG: YoMo output')
+                        print('----------------------------------------------------------')
+                        print(out_yomo)
 
                     out_yomo_fields = out_yomo.split(",")
                     summary_yomo_fields = cfg['cnf_yomo_out_fields'].split(",")
 
                     if len(out_yomo_fields) == len(summary_yomo_fields):
-                        for i in xrange(0,len(out_yomo_fields)-1):
+                        for i in xrange(0,len(out_yomo_fields)):
                             towrite_data[summary_yomo_fields[i]]=out_yomo_fields[i]
                     else:
-                        for i in xrange(0,len(out_yomo_fields)-1):
+                        for i in xrange(0,len(summary_yomo_fields)):
                             towrite_data[summary_yomo_fields[i]]="NA"
 
+                # binary buffer/event logs, typed and loaded without parsing
+                yomo_prefix = resultdir_yomo + prefix_yomo
+                if cfg['cnf_yomo_binary'] and os.path.exists(yomo_prefix + '_buffer.txt'):
+                    try:
+                        yomo_bin = convert_yomo(yomo_prefix)
+                        if cfg['verbosity'] > 2:
+                            print('DBG: Binary YoMo logs: {} bytes'.format(os.path.getsize(yomo_bin)))
+                        if not cfg['cnf_yomo_keep_text']:
+                            for postfix in ('_buffer.txt', '_events.txt'):
+                                if os.path.exists(yomo_prefix + postfix):
+                                    os.remove(yomo_prefix + postfix)
+                    except Exception as e:
+                        if cfg['verbosity'] > 0:
+                            print ('[Exception #7] YoMo binary conversion failed for error: {}').format(e)
+
+                # columnar tshark log, smaller in the archive and faster to load
+                tshark_file = resultdir_yomo + prefix_yomo + '_tshark.txt'
+                if cfg['cnf_tshark_columnar'] and os.path.exists(tshark_file):
+                    try:
+                        tshark_col = convert_tshark(tshark_file)
+                        if cfg['verbosity'] > 2:
+                            print('DBG: Columnar tshark log: {} bytes (text: {} bytes)'.format(os.path.getsize(tshark_col), os.path.getsize(tshark_file)))
+                        if not cfg['cnf_tshark_keep_text']:
+                            os.remove(tshark_file)
+                        tshark_file = tshark_col
+                    except Exception as e:
+                        if cfg['verbosity'] > 0:
+                            print ('[Exception #5] Columnar tshark conversion failed for error: {}').format(e)
+
+                # per-second throughput, RTT and loss from the capture
+                if cfg['cnf_tshark_analysis'] and os.path.exists(tshark_file):
+                    try:
+                        towrite_data['yomo_tshark_stats'] = analyze_tshark(tshark_file, cfg.get('cnf_bind_ip'))
+                    except Exception as e:
+                        if cfg['verbosity'] > 0:
+                            print ('[Exception #6] tshark analysis failed for error: {}').format(e)
+
+                # per-request and per-session network timing from the Chrome net-log
+                netlog_file = resultdir_yomo + prefix_yomo + '_httpLog_C.json'
+                if cfg['cnf_yomo_netlog_analysis'] and os.path.exists(netlog_file):
+                    try:
+                        netlog = analyze_netlog(netlog_file)
+                        if netlog:
+                            with open(resultdir_yomo + prefix_yomo + '_netlog.json', 'w') as f:
+                                f.write(json.dumps(netlog))
+                            towrite_data['yomo_netlog_sessions'] = netlog['sessions']
+                    except Exception as e:
+                        if cfg['verbosity'] > 0:
+                            print ('[Exception #4] Net-log analysis failed for error: {}').format(e)
+
             if cfg['cnf_run_traceroute']:
 
                 #PART III - Traceroute
@@ -527,8 +681,7 @@ def run_exp(meta_info, expconfig):
                 if cfg['verbosity'] > 1:
                     print('')
                     print('----------------------------------------------------------')
-                    #print('DBG: Running ping+traceroute')
-                    print('DBG: Running ping to servers')
+                    print('DBG: Running ping+traceroute to servers')
                     print('----------------------------------------------------------')
 
                 #TODO
@@ -538,20 +691,16 @@ def run_exp(meta_info, expconfig):
                     youtube_servers = get_yt_servers(logfile)
                     print(youtube_servers)
 
-                    output = {}
-                    for target in youtube_servers:
-                        #output[target] = {}
-                        ping_result = ping(target, cfg['cnf_ping_count'], ifname, cfg['cfg_ping_timeout'])
-                        #traceroute_result = traceroute(target, ifname)
-                        #output[target]['ping'] = ping_result
-                        #output[target]['traceroute'] = traceroute_result
-                        output[target] = ping_result
+                    output = ping_targets(youtube_servers, cfg['cnf_ping_count'], ifname, cfg['cfg_ping_timeout'], cfg['cnf_ping_max_parallel'], cfg['cnf_ping_keep_raw'])
                     #print output
+                    # one full traceroute per server cluster, only the tail hops for the other servers
+                    output_traceroute = run_planned_traceroutes(youtube_servers, lambda target, first_ttl: traceroute(target, ifname, first_ttl),
+                                                                cfg['cnf_traceroute_tail_hops'], cfg['cnf_traceroute_prefix_v4'], cfg['cnf_traceroute_prefix_v6'], cfg['cnf_traceroute_max_parallel'])
                 except Exception as e:
                     if cfg['verbosity'] > 0:
                         print ('[Exception #3] Execution or parsing failed for error: {}').format(e)
 
-                #save_output(data=cfg, msg=json.dumps(output), postfix="traceroute", tstamp=prefix_timestamp, outdir=resultdir_traceroute, interface=ifname)
+                save_output(data=cfg, msg=json.dumps(output_traceroute), postfix="traceroute", tstamp=prefix_timestamp, outdir=resultdir_traceroute, interface=ifname)
                 save_output(data=cfg, msg=json.dumps(output), postfix="ping", tstamp=prefix_timestamp, outdir=resultdir_ping, interface=ifname)
 
 
@@ -613,6 +762,34 @@ if __name__ == '__main__':
         print("Missing expconfig variable {}".format(e))
         raise e
 
+    configure_asn_cache(EXPCONFIG['cnf_asn_cache_file'] or None,
+                        EXPCONFIG['cnf_asn_cache_ttl_s'],
+                        EXPCONFIG['cnf_asn_cache_negative_ttl_s'])
+    try:
+        configure_asn_backend(EXPCONFIG['cnf_asn_backend'], EXPCONFIG['cnf_asn_table_file'])
+    except Exception as e:
+        print("Cannot load ASN prefix table, using DNS lookups {}".format(e))
+
+    # one cold profile per browser, cloned for every browser start
+    profile_templates = {}
+    if EXPCONFIG['cnf_yomo_profile_templates']:
+        for browser in set(cfg['cnf_yomo_browser'] for cfg in get_config_combinations(EXPCONFIG) if not cfg['cnf_yomo_skip']):
+            path = os.path.join(EXPCONFIG['cnf_yomo_profile_dir'], browser)
+            try:
+                elapsed = build_profile_template(browser, path, EXPCONFIG['cnf_yomo_startup_timeout_s'])
+                profile_templates[browser] = path
+                if EXPCONFIG['verbosity'] > 1:
+                    print("Built {} profile template in {:.2f} s".format(browser, elapsed))
+            except Exception as e:
+                print("Cannot build {} profile template, using empty profiles {}".format(browser, e))
+
+    # browser sessions outlive the experiment processes
+    session_pool = None
+    if EXPCONFIG['cnf_yomo_session_pool']:
+        session_pool = SessionPool(EXPCONFIG['cnf_yomo_session_reset'], EXPCONFIG['cnf_yomo_session_pool_size'], EXPCONFIG['cnf_yomo_startup_timeout_s'],
+                                   profile_templates)
+        atexit.register(session_pool.close)
+
     sequence_number = 0
     tot_start_time = time.time()
     for ifname in netifaces.interfaces():
@@ -710,9 +887,16 @@ if __name__ == '__main__':
             if EXPCONFIG['verbosity'] > 1:
                 print("Starting experiment")
 
+            session = None
+            if session_pool and not cfg['cnf_yomo_skip']:
+                try:
+                    session = session_pool.acquire(cfg['cnf_yomo_browser'], cfg['cnf_yomo_quic_enabled'], cfg['cnf_yomo_window_size'], cfg['cnf_yomo_headless'])
+                except Exception as e:
+                    print("Cannot start browser session, the experiment starts its own {}".format(e))
+
             # Create an experiment process and start it
             start_time_exp=time.time()
-            exp_process = create_exp_process(meta_info, cfg)
+            exp_process = create_exp_process(meta_info, cfg, session)
             exp_process.start()
 
             while (time.time() - start_time_exp < exp_grace and
@@ -732,9 +916,19 @@ if __name__ == '__main__':
 
             if exp_process.is_alive():
                 exp_process.terminate()
+                if session:
+                    # the browser may be stuck as well
+                    session_pool.discard(cfg['cnf_yomo_browser'], cfg['cnf_yomo_quic_enabled'], cfg['cnf_yomo_window_size'], cfg['cnf_yomo_headless'])
+            elif session:
+                # discarded if the run failed
+                session_pool.release(session)
             if meta_process.is_alive():
                 meta_process.terminate()
 
+        if session_pool:
+            # sockets, QUIC/TLS sessions and the DNS cache of the browsers belong to this interface
+            session_pool.stop_all()
+
         elapsed = time.time() - start_time
         if EXPCONFIG['verbosity'] > 1:
             print("Finished {} after {}".format(ifname, elapsed))